@@ -12,6 +12,7 @@ import atexit
 from config.config import config
 # 导入数据库
 from utils.database import db
+from utils.indexes import bootstrap_indexes_async
 # 导入路由
 from routes.excel_routes import excel_bp
 from routes.admin_routes import admin_bp
@@ -47,7 +48,9 @@ def create_app(config_name=None):
     CORS(app, origins=app.config['CORS_ORIGINS'])
     
     # 连接数据库
-    db.connect()
+    if db.connect():
+        # 创建各查询需要的索引
+        bootstrap_indexes_async(db.client)
     
     # 注册蓝图
     app.register_blueprint(auth_bp)
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+extract_video_data 性能对比
+对比原先逐条构造三个字典再合并的实现与编译后的单次遍历抽取函数，
+先校验两者输出完全一致（含字段顺序），再分别统计每秒处理的记录数
+用法: python benchmark_extract.py [记录数] [重复次数]
+"""
+import random
+import sys
+import time
+
+from services.video_data_collector import extract_video_record
+
+
+def legacy_extract_video_data(video_list_response):
+    """改造前的 extract_video_data 实现（仅用于对比）"""
+    if not video_list_response or 'data' not in video_list_response:
+        return []
+
+    data = video_list_response['data']
+    video_list = data.get('list', [])
+    extracted_data = []
+
+    for video in video_list:
+        basic_info = {
+            'id': video.get('id'),
+            'prompt': video.get('prompt', '').strip(),
+            'nickname': video.get('nickname'),
+            'status': video.get('status'),
+            'gen_start_time': video.get('gen_start_time'),
+            'submit_time': video.get('submit_time'),
+            'finish_time': video.get('finish_time'),
+            'deleted': video.get('deleted'),
+            'endpoint': video.get('endpoint')
+        }
+
+        param_info = {}
+        if 'param' in video and isinstance(video['param'], dict):
+            param = video['param']
+
+            if 'param' in param and 'model' in param['param']:
+                model = param['param']['model']
+                param_info.update({
+                    'model_name': model.get('model_name'),
+                    'model_id': model.get('id'),
+                    'model_type': model.get('type'),
+                    'model_describe': model.get('describe')
+                })
+
+            if 'param' in param:
+                inner_param = param['param']
+                param_info.update({
+                    'gen_time': inner_param.get('gen_time'),
+                    'input_image': inner_param.get('input_image'),
+                    'file_name': inner_param.get('fileName'),
+                    'picture_scale': inner_param.get('pictureScale')
+                })
+
+                if 'scale' in inner_param:
+                    scale = inner_param['scale']
+                    param_info.update({
+                        'scale_ratio': scale.get('scale'),
+                        'scale_width': scale.get('scaleWidth'),
+                        'scale_height': scale.get('scaleHeight')
+                    })
+
+            param_info['tools_type'] = video.get('tools_type')
+            param_info['kind'] = video.get('kind')
+
+        video_data = {**basic_info, **param_info}
+        extracted_data.append(video_data)
+
+    return extracted_data
+
+
+def new_extract_video_data(video_list_response):
+    """改造后的实现（与 VideoDataCollector.extract_video_data 相同）"""
+    if not video_list_response or 'data' not in video_list_response:
+        return []
+    return list(map(extract_video_record, video_list_response['data'].get('list') or []))
+
+
+def make_videos(count, seed=42):
+    """生成接近真实接口结构的视频记录，覆盖有/无 param、model、scale 的各种组合"""
+    rng = random.Random(seed)
+    videos = []
+    for i in range(count):
+        video = {
+            'id': i,
+            'prompt': f'  prompt {i}  ',
+            'nickname': f'user{i % 50}',
+            'status': rng.choice(['已完成', '失败', '生成中']),
+            'gen_start_time': '2025-07-20 10:00:05',
+            'submit_time': '2025-07-20 10:00:00',
+            'finish_time': '2025-07-20 10:03:00',
+            'deleted': 0,
+            'endpoint': 'gpu-01',
+            'tools_type': 'video',
+            'kind': rng.randint(1, 3)
+        }
+        shape = rng.random()
+        if shape < 0.9:
+            inner = {'gen_time': 5, 'input_image': f'img{i}.png', 'fileName': f'f{i}.mp4', 'pictureScale': '16:9'}
+            if rng.random() < 0.95:
+                inner['model'] = {'model_name': 'wan2.1', 'id': 7, 'type': 'video', 'describe': 'demo'}
+            if rng.random() < 0.8:
+                inner['scale'] = {'scale': '16:9', 'scaleWidth': 1280, 'scaleHeight': 720}
+            video['param'] = {'param': inner}
+        elif shape < 0.95:
+            video['param'] = {}
+        videos.append(video)
+    return videos
+
+
+def measure(func, response, repeat):
+    """返回 (每秒记录数, 最好一次用时)"""
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(response)
+        best = min(best, time.perf_counter() - started)
+    return len(response['data']['list']) / best, best
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    response = {'data': {'list': make_videos(count)}}
+
+    legacy = legacy_extract_video_data(response)
+    new = new_extract_video_data(response)
+    assert legacy == new, "两种实现的输出不一致"
+    assert all(list(a) == list(b) for a, b in zip(legacy, new)), "字段顺序不一致"
+    print(f"✅ 输出校验通过: {count} 条记录")
+
+    legacy_rate, legacy_time = measure(legacy_extract_video_data, response, repeat)
+    new_rate, new_time = measure(new_extract_video_data, response, repeat)
+
+    print(f"改造前: {legacy_rate:,.0f} 条/秒 ({legacy_time * 1000:.1f} ms)")
+    print(f"改造后: {new_rate:,.0f} 条/秒 ({new_time * 1000:.1f} ms)")
+    print(f"提升: {new_rate / legacy_rate:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
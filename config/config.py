@@ -13,6 +13,41 @@ class Config:
     MONGO_URI = os.environ.get('MONGO_URI') or "mongodb://localhost:27017/"
     MONGO_DB_NAME = "运营部"
     MONGO_COLLECTION_NAME = "张童义森"
+    MONGO_RETENTION_DB_NAME = "留存"  # 留存分析和视频数据采集使用的数据库
+    
+    # MongoDB连接池配置（整个进程共用一个客户端）
+    MONGO_MAX_POOL_SIZE = int(os.environ.get('MONGO_MAX_POOL_SIZE', 50))
+    MONGO_MIN_POOL_SIZE = int(os.environ.get('MONGO_MIN_POOL_SIZE', 0))
+    MONGO_MAX_IDLE_TIME_MS = int(os.environ.get('MONGO_MAX_IDLE_TIME_MS', 300000))
+    MONGO_CONNECT_TIMEOUT_MS = int(os.environ.get('MONGO_CONNECT_TIMEOUT_MS', 5000))
+    MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', 5000))
+    MONGO_SOCKET_TIMEOUT_MS = int(os.environ.get('MONGO_SOCKET_TIMEOUT_MS', 0)) or None  # 0 表示不限
+    
+    # 视频数据接口配置
+    VIDEO_API_BASE_URL = os.environ.get('VIDEO_API_BASE_URL') or "https://tu.liandanxia.com"
+    # 后台登录接口，配置后可不启动浏览器直接获取令牌
+    VIDEO_LOGIN_API_URL = os.environ.get('VIDEO_LOGIN_API_URL')
+    # 无法从令牌本身解析过期时间时的默认有效期
+    VIDEO_TOKEN_TTL_HOURS = float(os.environ.get('VIDEO_TOKEN_TTL_HOURS', 12))
+    
+    # HTTP连接池与重试配置
+    HTTP_POOL_SIZE = int(os.environ.get('HTTP_POOL_SIZE', 16))
+    HTTP_TIMEOUT = float(os.environ.get('HTTP_TIMEOUT', 30))
+    HTTP_MAX_RETRIES = int(os.environ.get('HTTP_MAX_RETRIES', 4))
+    HTTP_BACKOFF_BASE = float(os.environ.get('HTTP_BACKOFF_BASE', 0.5))  # 秒
+    HTTP_BACKOFF_MAX = float(os.environ.get('HTTP_BACKOFF_MAX', 30))  # 秒
+    
+    # 数据采集任务配置：同时运行的任务数，超出的任务排队等待
+    COLLECTION_MAX_CONCURRENT_JOBS = int(os.environ.get('COLLECTION_MAX_CONCURRENT_JOBS', 2))
+    # 单个任务每批获取的页数上限（并发数上限为 HTTP_POOL_SIZE，超出连接池的并发只会排队等待连接）
+    COLLECTION_MAX_BATCH_SIZE = int(os.environ.get('COLLECTION_MAX_BATCH_SIZE', 100))
+    # 同时阻塞等待的进度订阅者上限（SSE 连接 + 长轮询），每个订阅者占用一个工作线程，
+    # 应明显小于 Web 服务器的工作线程数；超过上限的请求返回 503
+    PROGRESS_MAX_SUBSCRIBERS = int(os.environ.get('PROGRESS_MAX_SUBSCRIBERS', 8))
+    
+    # 留存数据导入配置：每次读取的行数和每批写入的文档数
+    RETENTION_CHUNK_SIZE = int(os.environ.get('RETENTION_CHUNK_SIZE', 100000))
+    RETENTION_INSERT_BATCH_SIZE = int(os.environ.get('RETENTION_INSERT_BATCH_SIZE', 5000))
     
     # CORS配置
     CORS_ORIGINS = ["*"]  # 生产环境应该限制具体域名
@@ -3,6 +3,10 @@ import pymongo
 from datetime import datetime
 import os
 
+# 排除网页端尚未发布的导入数据（导入状态=staging），与 utils/retention_filters.py 中的 VISIBLE_FILTER 一致
+# 本脚本独立运行，不依赖项目包，因此在这里单独定义；本脚本自己写入的数据不带导入状态，始终可见
+VISIBLE_FILTER = {'导入状态': {'$ne': 'staging'}}
+
 def process_and_store_data(file_path):
     """
     数据处理阶段：从Excel/CSV读取数据，处理合并后存入数据库
@@ -210,8 +214,8 @@ def analyze_retention(start_date=None, end_date=None):
         db = client['留存']
         collection = db['数据']
 
-        # 处理日期参数
-        query_filter = {}
+        # 处理日期参数（只读取已发布的数据）
+        query_filter = dict(VISIBLE_FILTER)
         if start_date or end_date:
             time_filter = {}
             if start_date:
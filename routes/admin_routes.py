@@ -6,6 +6,7 @@ from auth.middleware import login_required, require_role
 from auth.services import AuthService
 from auth.models import UserRole
 from utils.database import db
+from utils.indexes import ensure_indexes, check_query_plans
 
 # 创建管理员蓝图
 admin_bp = Blueprint('admin', __name__, url_prefix='/api/admin')
@@ -285,4 +286,28 @@ def get_system_stats():
         return jsonify({
             'success': False,
             'message': f'获取统计信息失败: {str(e)}'
-        }), 500 
\ No newline at end of file
+        }), 500 
+
+@admin_bp.route('/index-report', methods=['GET'])
+@login_required
+@require_role('admin')
+def get_index_report():
+    """查询计划自检：报告仍在全表扫描（COLLSCAN）的查询，?ensure=true 时先补建索引"""
+    try:
+        index_result = None
+        if request.args.get('ensure', 'false').lower() == 'true':
+            index_result = ensure_indexes(db.client)
+
+        report = check_query_plans(db.client)
+        report['data'] = {
+            'queries': report.pop('queries'),
+            'collscans': report.pop('collscans'),
+            'indexes': index_result
+        }
+        return jsonify(report)
+
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': f'查询计划自检失败: {str(e)}'
+        }), 500
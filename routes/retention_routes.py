@@ -3,8 +3,9 @@
 """
 from flask import Blueprint, request, jsonify
 from auth.middleware import login_required, require_permission
-from services.retention_service import RetentionService
-import io
+from services.retention_service import RetentionService, DEFAULT_RETENTION_DAYS
+from utils.retention_filters import VISIBLE_FILTER
+from utils.database import db
 import os
 
 retention_bp = Blueprint('retention', __name__, url_prefix='/api/retention')
@@ -38,8 +39,8 @@ def upload_data():
                 'message': f'不支持的文件格式: {file_ext}，支持的格式: {", ".join(allowed_extensions)}'
             }), 400
         
-        # 读取文件内容
-        file_content = io.BytesIO(file.read())
+        # 直接传入上传文件流（大文件由 werkzeug 暂存到磁盘），由服务逐块读取
+        file_content = file.stream
 
         # 获取强制覆盖参数
         force_overwrite = request.form.get('force_overwrite', 'false').lower() == 'true'
@@ -85,10 +86,24 @@ def analyze_retention():
         start_date = data.get('start_date')
         end_date = data.get('end_date')
         
+        # 留存间隔天数（默认次日/7日/30日）和是否返回留存用户明细
+        try:
+            retention_days = RetentionService.parse_retention_days(data.get('retention_days', DEFAULT_RETENTION_DAYS))
+            details_limit = RetentionService.parse_details_limit(data.get('details_limit', 100))
+            include_details = RetentionService.parse_include_details(data.get('include_details', False))
+        except (TypeError, ValueError) as e:
+            return jsonify({
+                'success': False,
+                'message': f'参数错误: {str(e)}'
+            }), 400
+        
         # 调用服务进行留存分析
         result = RetentionService.analyze_retention(
             start_date=start_date,
-            end_date=end_date
+            end_date=end_date,
+            retention_days=retention_days,
+            include_details=include_details,
+            details_limit=details_limit
         )
         
         # 返回结果
@@ -107,16 +122,13 @@ def analyze_retention():
 def get_data_summary():
     """获取数据库中的数据概览"""
     try:
-        import pymongo
         from datetime import datetime
         
-        # 连接数据库
-        client = pymongo.MongoClient('mongodb://localhost:27017/')
-        retention_db = client['留存']
-        collection = retention_db['数据']
+        # 使用共享连接池
+        collection = db.retention_db['数据']
         
         # 获取基本统计信息
-        total_records = collection.count_documents({})
+        total_records = collection.count_documents(VISIBLE_FILTER)
         
         if total_records == 0:
             return jsonify({
@@ -129,8 +141,8 @@ def get_data_summary():
             })
         
         # 获取日期范围
-        earliest_record = collection.find().sort("访问时间", 1).limit(1)
-        latest_record = collection.find().sort("访问时间", -1).limit(1)
+        earliest_record = collection.find(VISIBLE_FILTER).sort("访问时间", 1).limit(1)
+        latest_record = collection.find(VISIBLE_FILTER).sort("访问时间", -1).limit(1)
         
         earliest_date = None
         latest_date = None
@@ -145,6 +157,7 @@ def get_data_summary():
         
         # 获取每日数据统计
         pipeline = [
+            {"$match": VISIBLE_FILTER},
             {
                 "$group": {
                     "_id": {
@@ -169,8 +182,6 @@ def get_data_summary():
         
         daily_stats = list(collection.aggregate(pipeline))
         
-        client.close()
-        
         return jsonify({
             'success': True,
             'data': {
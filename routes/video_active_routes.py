@@ -7,18 +7,44 @@
 
 from flask import Blueprint, request, jsonify, make_response, Response
 from auth.middleware import login_required, require_roles
-from services.video_active_service import VideoActiveService
-from services.video_data_collector import VideoDataCollector
+from services.video_active_service import VideoActiveService, InvalidCursorError
+from utils.database import db
+from services.collection_job_store import CollectionJobStore
+from services.collection_job_manager import CollectionJobManager, ACTIVE_STATUSES
+from utils.progress_bus import SubscriberLimiter
+from config.config import Config
 import io
 import csv
 import json
 import time
 import threading
-import queue
 from datetime import datetime
 
 video_active_bp = Blueprint('video_active', __name__)
 
+def _page_options():
+    """
+    分页参数：cursor（上一页的 next_cursor）、limit（每页条数）、
+    include_video_ids=true 时返回 video_ids 数组
+    """
+    limit = request.args.get('limit')
+    return {
+        'cursor': request.args.get('cursor') or None,
+        'limit': int(limit) if limit and limit.isdigit() else None,
+        'include_video_ids': request.args.get('include_video_ids', 'false').lower() == 'true'
+    }
+
+def _page_response(page):
+    return jsonify({
+        'success': True,
+        'data': page['items'],
+        'total': page['total'],
+        'stats': page['stats'],
+        'count': len(page['items']),
+        'next_cursor': page['next_cursor'],
+        'has_more': page['has_more']
+    })
+
 @video_active_bp.route('/data-summary', methods=['GET'])
 @login_required
 @require_roles(['admin', 'leader', 'employee'])
@@ -60,14 +86,11 @@ def query_date_range():
                 'message': '请提供开始日期和结束日期'
             }), 400
         
-        data = service.query_users_by_date_range(start_date, end_date)
-        
-        return jsonify({
-            'success': True,
-            'data': data,
-            'total': len(data)
-        })
+        page = service.page_users_by_date_range(start_date, end_date, **_page_options())
+        return _page_response(page)
         
+    except InvalidCursorError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
     except Exception as e:
         return jsonify({
             'success': False,
@@ -90,14 +113,11 @@ def query_single_date():
                 'message': '请提供查询日期'
             }), 400
         
-        data = service.query_users_by_single_date(single_date)
-        
-        return jsonify({
-            'success': True,
-            'data': data,
-            'total': len(data)
-        })
+        page = service.page_users_by_single_date(single_date, **_page_options())
+        return _page_response(page)
         
+    except InvalidCursorError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
     except Exception as e:
         return jsonify({
             'success': False,
@@ -120,14 +140,11 @@ def query_user_history():
                 'message': '请提供用户昵称'
             }), 400
         
-        data = service.query_user_history(nickname)
-        
-        return jsonify({
-            'success': True,
-            'data': data,
-            'total': len(data)
-        })
+        page = service.page_user_history(nickname, **_page_options())
+        return _page_response(page)
         
+    except InvalidCursorError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
     except Exception as e:
         return jsonify({
             'success': False, 
@@ -164,6 +181,36 @@ def get_active_summary():
             'message': f'活跃用户汇总失败: {str(e)}'
         }), 500
 
+@video_active_bp.route('/rebuild-summaries', methods=['POST'])
+@login_required
+@require_roles(['admin', 'leader'])
+def rebuild_summaries():
+    """从原始数据重新生成指定日期范围的用户日活跃"""
+    try:
+        data = request.get_json() or {}
+        start_date = data.get('start_date')
+        end_date = data.get('end_date')
+        
+        if not start_date or not end_date:
+            return jsonify({
+                'success': False,
+                'message': '请提供开始日期和结束日期'
+            }), 400
+        
+        # 重建期间采集任务的增量合并会被覆盖或重复计入，两者不能同时进行
+        service = VideoActiveService()
+        result = job_manager.run_exclusive('重建用户日活跃', service.rebuild_daily_summaries, start_date, end_date)
+        if result.get('conflict'):
+            return jsonify(result), 409
+        
+        return jsonify(result), (200 if result['success'] else 400)
+        
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': f'重建用户日活跃失败: {str(e)}'
+        }), 500
+
 @video_active_bp.route('/export-csv', methods=['GET'])
 @login_required
 @require_roles(['admin', 'leader', 'employee'])
@@ -287,24 +334,17 @@ def export_to_csv():
         }), 500
 
 
-# 全局变量管理数据采集实例
-data_collector_instance = None
-progress_queue = queue.Queue()
-collection_thread = None
+# 数据采集任务管理器：每个任务独立的采集实例和进度通道
+job_store = CollectionJobStore()
+job_manager = CollectionJobManager(job_store=job_store)
+# 阻塞等待进度的订阅者（SSE、长轮询）各占一个工作线程，限制同时在线的数量
+progress_subscribers = SubscriberLimiter(Config.PROGRESS_MAX_SUBSCRIBERS)
 
 def cleanup_global_resources():
     """清理全局资源"""
-    global data_collector_instance, collection_thread
     try:
-        if data_collector_instance:
-            data_collector_instance.force_cleanup()
-            data_collector_instance = None
-        
-        if collection_thread and collection_thread.is_alive():
-            collection_thread.join(timeout=5)
-            if collection_thread.is_alive():
-                print("⚠️ 数据采集线程未能正常退出")
-        
+        job_manager.shutdown()
+        db.disconnect()
         print("✅ 全局资源清理完成")
     except Exception as e:
         print(f"❌ 清理全局资源异常: {e}")
@@ -314,120 +354,131 @@ import atexit
 atexit.register(cleanup_global_resources)
 
 
+def _request_job_id():
+    """从查询参数或JSON请求体中获取任务ID"""
+    job_id = request.args.get('job_id')
+    if not job_id and request.is_json:
+        job_id = (request.get_json(silent=True) or {}).get('job_id')
+    return job_id
+
+
+def _bounded_int(data, name, default, lower, upper):
+    """
+    读取整数参数并限制在 [lower, upper] 范围内
+    :raises ValueError: 不是整数（布尔值、小数和非数字字符串都拒绝）
+    """
+    value = data.get(name)
+    if value is None or value == '':
+        value = default
+    if isinstance(value, str) and value.strip().lstrip('-').isdigit():
+        value = int(value)
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise ValueError(f'{name} 必须是整数')
+    return min(max(value, lower), upper)
+
+
 @video_active_bp.route('/start-data-collection', methods=['POST'])
 @login_required
 @require_roles(['admin', 'leader', 'employee'])
 def start_data_collection():
-    """启动数据采集"""
-    global data_collector_instance, collection_thread
-    
+    """启动数据采集，页码或日期范围与运行中任务不重叠时可以并行"""
     try:
-        if data_collector_instance and data_collector_instance.is_running:
+        # 获取参数（密码不随任务持久化）
+        data = request.get_json() or {}
+        # 数值参数在创建任务记录前校验：并发数不超过连接池大小，批次大小不超过配置上限
+        try:
+            params = {
+                'start_page': int(data.get('start_page', 1)),
+                'total_pages': int(data.get('end_page') or data.get('total_pages', 500)),
+                'batch_size': _bounded_int(data, 'batch_size', 20, 1, Config.COLLECTION_MAX_BATCH_SIZE),
+                'max_workers': _bounded_int(data, 'max_workers', 8, 1, Config.HTTP_POOL_SIZE),
+                'incremental': data.get('incremental', False),
+                'username': data.get('username', 'admin'),
+                'filter_start_date': data.get('filter_start_date'),
+                'filter_end_date': data.get('filter_end_date')
+            }
+        except (TypeError, ValueError) as e:
             return jsonify({
                 'success': False,
-                'message': '数据采集正在运行中'
+                'message': f'参数错误: {str(e)}'
             }), 400
-        
-        # 获取参数
-        data = request.get_json() or {}
-        total_pages = data.get('total_pages', 500)
-        batch_size = data.get('batch_size', 20)
-        username = data.get('username', 'admin')
         password = data.get('password', 'admin@liandanxia')
-        filter_start_date = data.get('filter_start_date')
-        filter_end_date = data.get('filter_end_date')
-        
-        # 清空进度队列
-        while not progress_queue.empty():
-            try:
-                progress_queue.get_nowait()
-            except queue.Empty:
-                break
-        
-        # 创建数据采集实例
-        def progress_callback(progress_info):
-            progress_queue.put(progress_info)
-        
-        data_collector_instance = VideoDataCollector(
-            progress_callback=progress_callback,
-            filter_start_date=filter_start_date,
-            filter_end_date=filter_end_date
-        )
-        
-        # 在后台线程中启动数据采集
-        def collection_worker():
-            try:
-                # 连接和登录
-                progress_queue.put({
-                    'message': '🔗 开始连接浏览器...',
-                    'level': 'info',
-                    'timestamp': datetime.now().strftime('%H:%M:%S')
-                })
-                
-                if not data_collector_instance.connect():
-                    progress_queue.put({
-                        'message': '❌ 浏览器连接失败，任务结束',
-                        'level': 'error',
-                        'timestamp': datetime.now().strftime('%H:%M:%S')
-                    })
-                    return
-                
-                progress_queue.put({
-                    'message': '🔐 开始登录系统...',
-                    'level': 'info',
-                    'timestamp': datetime.now().strftime('%H:%M:%S')
-                })
-                
-                if not data_collector_instance.login(username=username, password=password):
-                    progress_queue.put({
-                        'message': '❌ 系统登录失败，任务结束',
-                        'level': 'error',
-                        'timestamp': datetime.now().strftime('%H:%M:%S')
-                    })
-                    return
-                
-                progress_queue.put({
-                    'message': '✅ 连接和登录成功，开始数据采集',
-                    'level': 'success',
-                    'timestamp': datetime.now().strftime('%H:%M:%S')
-                })
-                
-                # 开始数据采集
-                data_collector_instance.start_data_collection(
-                    total_pages=total_pages,
-                    batch_size=batch_size
-                )
-                
-            except Exception as e:
-                progress_queue.put({
-                    'message': f'数据采集异常: {str(e)}',
-                    'level': 'error',
-                    'timestamp': datetime.now().strftime('%H:%M:%S')
-                })
-            finally:
-                # 确保采集结束后重置状态和清理资源
-                if data_collector_instance:
-                    data_collector_instance.is_running = False
-                    data_collector_instance.cleanup()
-                    progress_queue.put({
-                        'message': '🔚 数据采集任务结束',
-                        'level': 'info',
-                        'timestamp': datetime.now().strftime('%H:%M:%S')
-                    })
         
-        collection_thread = threading.Thread(target=collection_worker)
-        collection_thread.daemon = True  # 设置为守护线程，程序退出时会强制终止
-        collection_thread.start()
+        if params['start_page'] < 1 or params['start_page'] > params['total_pages']:
+            return jsonify({
+                'success': False,
+                'message': '页码范围无效'
+            }), 400
+        
+        result = job_manager.submit(params, password)
+        return jsonify(result), (200 if result['success'] else 409)
         
+    except Exception as e:
         return jsonify({
-            'success': True,
-            'message': '数据采集已启动'
+            'success': False,
+            'message': f'启动数据采集失败: {str(e)}'
+        }), 500
+
+
+@video_active_bp.route('/resume-data-collection', methods=['POST'])
+@login_required
+@require_roles(['admin', 'leader', 'employee'])
+def resume_data_collection():
+    """从检查点继续未完成的采集任务"""
+    try:
+        data = request.get_json() or {}
+        job_id = data.get('job_id')
+        job = job_store.get_job(job_id) if job_id else job_store.find_resumable_job()
+        
+        if not job:
+            return jsonify({
+                'success': False,
+                'message': '没有可恢复的采集任务'
+            }), 400
+        
+        if job['status'] == 'completed':
+            return jsonify({
+                'success': False,
+                'message': '该采集任务已完成，无需恢复'
+            }), 400
+        
+        if job_manager.get_active_job(job['_id']):
+            return jsonify({
+                'success': False,
+                'message': '该采集任务正在运行中'
+            }), 400
+        
+        params = job['params']
+        start_page = max(params.get('start_page', 1), job.get('last_completed_page', 0) + 1)
+        # 检查点之前失败的页面需要重新获取
+        retry_pages = sorted(set(job.get('failed_pages') or []))
+        if start_page > params.get('total_pages', 500) and not retry_pages:
+            job_store.finish_job(job['_id'], 'completed')
+            return jsonify({
+                'success': False,
+                'message': '该采集任务的所有页面均已完成'
+            }), 400
+        
+        password = data.get('password', 'admin@liandanxia')
+        result = job_manager.submit(params, password, job_id=job['_id'], start_page=start_page,
+                                    initial_stats=job.get('total_stats'), retry_pages=retry_pages)
+        if not result['success']:
+            return jsonify(result), 409
+        
+        message = f'数据采集已从第 {start_page} 页继续'
+        if retry_pages:
+            message += f'，并重新获取 {len(retry_pages)} 个失败页面'
+        result.update({
+            'message': message,
+            'start_page': start_page,
+            'retry_pages': retry_pages
         })
+        return jsonify(result)
         
     except Exception as e:
         return jsonify({
             'success': False,
-            'message': f'启动数据采集失败: {str(e)}'
+            'message': f'恢复数据采集失败: {str(e)}'
         }), 500
 
 
@@ -435,23 +486,65 @@ def start_data_collection():
 @login_required
 @require_roles(['admin', 'leader', 'employee'])
 def stop_data_collection():
-    """停止数据采集"""
-    global data_collector_instance
-    
+    """停止数据采集（未指定 job_id 时停止最近启动的任务）"""
     try:
-        if not data_collector_instance:
+        job = job_manager.get_active_job(_request_job_id())
+        if not job:
             return jsonify({
                 'success': False,
                 'message': '没有运行中的数据采集任务'
             }), 400
         
-        data_collector_instance.stop_data_collection()
+        result = job_manager.cancel(job.job_id)
+        return jsonify(result), (200 if result['success'] else 400)
         
+    except Exception as e:
         return jsonify({
-            'success': True,
-            'message': '数据采集停止指令已发送'
-        })
-        
+            'success': False,
+            'message': f'停止数据采集失败: {str(e)}'
+        }), 500
+
+
+@video_active_bp.route('/collection-jobs', methods=['GET'])
+@login_required
+@require_roles(['admin', 'leader', 'employee'])
+def list_collection_jobs():
+    """列出采集任务"""
+    return jsonify({
+        'success': True,
+        'jobs': job_manager.list_jobs(),
+        'max_concurrent_jobs': job_manager.max_concurrent_jobs,
+        'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    })
+
+
+@video_active_bp.route('/collection-jobs/<job_id>', methods=['GET'])
+@login_required
+@require_roles(['admin', 'leader', 'employee'])
+def get_collection_job(job_id):
+    """获取单个采集任务状态（内存中没有时查询持久化记录）"""
+    job = job_manager.get_job(job_id)
+    if job:
+        return jsonify({'success': True, 'job': job.to_dict()})
+    
+    stored_job = job_store.get_job(job_id)
+    if not stored_job:
+        return jsonify({
+            'success': False,
+            'message': '采集任务不存在'
+        }), 404
+    
+    return jsonify({'success': True, 'job': CollectionJobStore.serialize_job(stored_job)})
+
+
+@video_active_bp.route('/collection-jobs/<job_id>/cancel', methods=['POST'])
+@login_required
+@require_roles(['admin', 'leader', 'employee'])
+def cancel_collection_job(job_id):
+    """取消采集任务"""
+    try:
+        result = job_manager.cancel(job_id)
+        return jsonify(result), (200 if result['success'] else 400)
     except Exception as e:
         return jsonify({
             'success': False,
@@ -459,23 +552,69 @@ def stop_data_collection():
         }), 500
 
 
+def _event_cursor():
+    """读取客户端已收到的最后一个事件ID"""
+    try:
+        return max(0, int(request.args.get('since') or request.headers.get('Last-Event-ID') or 0))
+    except ValueError:
+        return 0
+
+
+def _subscribers_full_response():
+    """进度订阅者已满：返回503，客户端稍后重试或改用不等待的轮询（wait=0）"""
+    response = jsonify({
+        'success': False,
+        'message': f'进度订阅连接已达上限（{progress_subscribers.limit}），请稍后重试'
+    })
+    response.status_code = 503
+    response.headers['Retry-After'] = '5'
+    return response
+
+
 @video_active_bp.route('/collection-progress', methods=['GET'])
 @login_required
 @require_roles(['admin', 'leader', 'employee'])
 def collection_progress():
-    """SSE进度推送端点"""
+    """
+    SSE进度推送端点（未指定 job_id 时推送最近启动的任务）
+    断线重连时浏览器会带上 Last-Event-ID，从缓冲区补发之后的事件；任务结束后连接自动关闭
+    每个连接在整个任务期间占用一个工作线程，同时连接数受 PROGRESS_MAX_SUBSCRIBERS 限制，超出时返回503
+    """
+    job = job_manager.get_job(_request_job_id())
+    if not job:
+        return jsonify({
+            'success': False,
+            'message': '采集任务不存在'
+        }), 404
+    
+    if not progress_subscribers.try_acquire():
+        return _subscribers_full_response()
+    
+    released = threading.Event()
+    
+    def release_subscriber():
+        # 连接关闭时归还名额（生成器未开始迭代就断开时也会调用）
+        if not released.is_set():
+            released.set()
+            progress_subscribers.release()
+    
+    channel = job.progress
+    last_event_id = _event_cursor()
     
     def generate_progress():
+        cursor = last_event_id
+        yield "retry: 3000\n\n"
         try:
             while True:
-                try:
-                    # 从队列中获取进度信息，超时1秒
-                    progress_info = progress_queue.get(timeout=1)
-                    yield f"data: {json.dumps(progress_info)}\n\n"
-                except queue.Empty:
-                    # 发送心跳保持连接
-                    yield f"data: {json.dumps({'type': 'heartbeat', 'timestamp': datetime.now().strftime('%H:%M:%S')})}\n\n"
-                    continue
+                events, closed = channel.wait_for_events(cursor, timeout=15)
+                for progress_info in events:
+                    cursor = progress_info['id']
+                    yield f"id: {cursor}\ndata: {json.dumps(progress_info)}\n\n"
+                if closed and not events:
+                    break
+                if not events:
+                    # 注释行作为心跳保持连接，不会触发前端 onmessage
+                    yield ": heartbeat\n\n"
         except GeneratorExit:
             pass
     
@@ -485,10 +624,12 @@ def collection_progress():
         headers={
             'Cache-Control': 'no-cache',
             'Connection': 'keep-alive',
+            'X-Accel-Buffering': 'no',
             'Access-Control-Allow-Origin': '*',
             'Access-Control-Allow-Headers': 'Cache-Control'
         }
     )
+    response.call_on_close(release_subscriber)
     
     return response
 
@@ -496,29 +637,44 @@ def collection_progress():
 @login_required
 @require_roles(['admin', 'leader', 'employee'])
 def collection_progress_poll():
-    """轮询方式获取进度消息"""
-    messages = []
+    """
+    轮询方式获取进度消息（未指定 job_id 时返回最近启动的任务）
+    since: 已收到的最后一个事件ID，返回之后的消息；读取不会消费消息，多个页面可以同时轮询
+    wait: 没有新消息时最多等待的秒数（长轮询，最大25秒）；等待期间占用一个工作线程，
+          与SSE连接共用 PROGRESS_MAX_SUBSCRIBERS 名额，超出时返回503。wait=0 立即返回，不受限制
+    """
+    job = job_manager.get_job(_request_job_id())
+    since = _event_cursor()
     
-    # 获取队列中的所有消息（非阻塞）
     try:
-        while True:
-            try:
-                progress_info = progress_queue.get_nowait()
-                # 跳过心跳消息
-                if progress_info.get('type') != 'heartbeat':
-                    messages.append(progress_info)
-            except queue.Empty:
-                break
+        wait = min(float(request.args.get('wait', 0)), 25)
+    except ValueError:
+        wait = 0
+    
+    messages = []
+    closed = False
+    blocking = bool(job) and wait > 0
+    if blocking and not progress_subscribers.try_acquire():
+        return _subscribers_full_response()
+    try:
+        if job:
+            messages, closed = job.progress.wait_for_events(since, timeout=max(wait, 0))
     except Exception as e:
         return jsonify({
             'success': False,
             'message': f'获取进度失败: {str(e)}'
         }), 500
+    finally:
+        if blocking:
+            progress_subscribers.release()
     
     return jsonify({
         'success': True,
+        'job_id': job.job_id if job else None,
         'messages': messages,
         'count': len(messages),
+        'last_event_id': messages[-1]['id'] if messages else since,
+        'finished': closed,
         'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
     })
 
@@ -527,39 +683,29 @@ def collection_progress_poll():
 @login_required
 @require_roles(['admin', 'leader', 'employee'])
 def collection_status():
-    """获取数据采集状态"""
-    global data_collector_instance
-    
-    is_running = False
-    has_instance = False
-    
-    if data_collector_instance:
-        has_instance = True
-        is_running = data_collector_instance.is_running
+    """获取数据采集状态（未指定 job_id 时返回最近启动的任务）"""
+    job = job_manager.get_job(_request_job_id())
     
     return jsonify({
         'success': True,
-        'is_running': is_running,
-        'has_instance': has_instance,
+        'job_id': job.job_id if job else None,
+        'status': job.status if job else None,
+        'is_running': bool(job and job.is_active),
+        'has_instance': job is not None,
+        'pipeline': job.collector.get_pipeline_stats() if job and job.collector else None,
+        'running_jobs': sum(1 for item in job_manager.list_jobs() if item['status'] in ACTIVE_STATUSES),
         'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
     })
 
 @video_active_bp.route('/test-status', methods=['GET'])
 def test_status():
     """测试状态接口（无需认证）"""
-    global data_collector_instance
-    
-    is_running = False
-    has_instance = False
-    
-    if data_collector_instance:
-        has_instance = True
-        is_running = data_collector_instance.is_running
+    job = job_manager.get_job()
     
     return jsonify({
         'success': True,
-        'is_running': is_running,
-        'has_instance': has_instance,
+        'is_running': bool(job and job.is_active),
+        'has_instance': job is not None,
         'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
         'message': 'Test endpoint working'
-    })
\ No newline at end of file
+    })
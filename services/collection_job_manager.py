@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+数据采集任务调度
+每个任务拥有独立的采集实例和进度通道，由有界线程池执行；
+页码范围和日期范围都不重叠的任务可以并行运行，大批量回补可以拆分成多个任务
+"""
+
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from config.config import Config
+from services.video_data_collector import VideoDataCollector
+from services.collection_job_store import CollectionJobStore
+from utils.progress_bus import ProgressChannel
+
+# 仍占用线程池或等待执行的任务状态
+ACTIVE_STATUSES = ('queued', 'running')
+
+class CollectionJob:
+    """内存中的采集任务：参数、采集实例、进度通道和运行状态"""
+
+    def __init__(self, job_id, params, password, start_page=1, initial_stats=None, retry_pages=None):
+        self.job_id = job_id
+        self.params = params
+        self.password = password
+        self.start_page = start_page
+        self.initial_stats = initial_stats
+        # 恢复任务时需要先重新获取的失败页面
+        self.retry_pages = list(retry_pages or [])
+        self.status = 'queued'
+        self.collector = None
+        self.future = None
+        self.cancel_requested = False
+        self.progress = ProgressChannel()
+        self.created_at = datetime.now()
+        self.started_at = None
+        self.finished_at = None
+
+    @property
+    def end_page(self):
+        return self.params.get('total_pages', 500)
+
+    @property
+    def is_active(self):
+        return self.status in ACTIVE_STATUSES
+
+    def publish(self, progress_info):
+        """写入本任务的进度通道，所有订阅者都能读到"""
+        progress_info['job_id'] = self.job_id
+        self.progress.publish(progress_info)
+
+    def send_progress(self, message, level='info'):
+        self.publish({
+            'message': message,
+            'level': level,
+            'timestamp': datetime.now().strftime('%H:%M:%S')
+        })
+
+    def overlaps(self, params, start_page):
+        """页码范围和日期范围同时重叠才视为冲突（未指定日期视为不限）"""
+        end_page = params.get('total_pages', 500)
+        if start_page > self.end_page or self.start_page > end_page:
+            return False
+
+        own_start = self.params.get('filter_start_date') or '0000-00-00'
+        own_end = self.params.get('filter_end_date') or '9999-99-99'
+        other_start = params.get('filter_start_date') or '0000-00-00'
+        other_end = params.get('filter_end_date') or '9999-99-99'
+        return other_start <= own_end and own_start <= other_end
+
+    def to_dict(self):
+        """转换为可JSON序列化的字典"""
+        return {
+            'job_id': self.job_id,
+            'status': self.status,
+            'start_page': self.start_page,
+            'end_page': self.end_page,
+            'filter_start_date': self.params.get('filter_start_date'),
+            'filter_end_date': self.params.get('filter_end_date'),
+            'incremental': self.params.get('incremental', False),
+            'username': self.params.get('username'),
+            'is_running': bool(self.collector and self.collector.is_running),
+            'pipeline': self.collector.get_pipeline_stats() if self.collector else None,
+            'created_at': self.created_at.strftime('%Y-%m-%d %H:%M:%S'),
+            'started_at': self.started_at.strftime('%Y-%m-%d %H:%M:%S') if self.started_at else None,
+            'finished_at': self.finished_at.strftime('%Y-%m-%d %H:%M:%S') if self.finished_at else None
+        }
+
+class CollectionJobManager:
+    """采集任务管理器"""
+
+    def __init__(self, job_store=None, max_concurrent_jobs=None, max_finished_jobs=50):
+        """
+        :param max_concurrent_jobs: 同时运行的任务数，超出的任务排队等待
+        :param max_finished_jobs: 内存中保留的已结束任务数量（供查询状态和进度）
+        """
+        self.job_store = job_store or CollectionJobStore()
+        self.max_concurrent_jobs = max_concurrent_jobs or Config.COLLECTION_MAX_CONCURRENT_JOBS
+        self.max_finished_jobs = max_finished_jobs
+        self.executor = ThreadPoolExecutor(max_workers=self.max_concurrent_jobs,
+                                           thread_name_prefix='collection-job')
+        self.jobs = OrderedDict()
+        self.lock = threading.Lock()
+        # 正在进行的独占维护操作（如重建汇总）名称，进行期间不接受新的采集任务
+        self.exclusive_operation = None
+
+    def submit(self, params, password, job_id=None, start_page=None, initial_stats=None, retry_pages=None):
+        """
+        提交采集任务
+        :param job_id: 恢复已有任务时传入（提交前先把任务记录标记为已恢复），否则新建任务记录
+        :param start_page: 起始页码，默认取 params['start_page']
+        :param retry_pages: 恢复时需要重新获取的失败页面（位于 start_page 之前）
+        :return: {'success': bool, 'message': str, 'job_id': str, 'queued': bool}
+        """
+        start_page = start_page or params.get('start_page', 1)
+
+        with self.lock:
+            if self.exclusive_operation:
+                return {
+                    'success': False,
+                    'message': f'{self.exclusive_operation}正在进行，请稍后再提交采集任务'
+                }
+
+            for job in self.jobs.values():
+                if job.is_active and job.overlaps(params, start_page):
+                    return {
+                        'success': False,
+                        'message': f'与运行中的任务 {job.job_id} 的页码和日期范围重叠',
+                        'conflict_job_id': job.job_id
+                    }
+
+            # 先更新任务记录再交给线程池，很快结束的任务写入的最终状态不会被覆盖
+            if job_id is None:
+                job_id = self.job_store.create_job(params)
+            else:
+                self.job_store.mark_resumed(job_id)
+
+            job = CollectionJob(job_id, params, password, start_page=start_page, initial_stats=initial_stats,
+                                retry_pages=retry_pages)
+            queued = sum(1 for j in self.jobs.values() if j.is_active) >= self.max_concurrent_jobs
+            self.jobs[job_id] = job
+            self.jobs.move_to_end(job_id)
+            job.future = self.executor.submit(self._run_job, job)
+            self._prune_finished_jobs()
+
+        if queued:
+            job.send_progress('⏳ 任务已加入队列，等待其他采集任务完成', 'info')
+
+        message = '数据采集任务已加入队列' if queued else '数据采集已启动'
+        return {'success': True, 'message': message, 'job_id': job_id, 'queued': queued}
+
+    def _run_job(self, job):
+        """在线程池中执行采集任务，每批完成后保存检查点"""
+        if job.cancel_requested:
+            self._finish(job, 'stopped')
+            return
+
+        job.status = 'running'
+        job.started_at = datetime.now()
+        status = 'failed'
+
+        try:
+            collector = VideoDataCollector(
+                progress_callback=job.publish,
+                filter_start_date=job.params.get('filter_start_date'),
+                filter_end_date=job.params.get('filter_end_date'),
+                max_workers=job.params.get('max_workers', 8)
+            )
+            job.collector = collector
+
+            # 获取登录令牌（缓存 -> 接口登录 -> 浏览器登录）
+            job.send_progress('🔐 开始获取登录令牌...', 'info')
+            if not collector.acquire_token(username=job.params.get('username', 'admin'), password=job.password):
+                job.send_progress('❌ 获取登录令牌失败，任务结束', 'error')
+                return
+
+            if job.cancel_requested:
+                status = 'stopped'
+                return
+
+            job.send_progress('✅ 登录令牌就绪，开始数据采集', 'success')
+
+            def checkpoint_callback(last_completed_page, total_stats, failed_pages):
+                self.job_store.save_checkpoint(job.job_id, last_completed_page, total_stats, failed_pages)
+
+            collector.start_data_collection(
+                total_pages=job.end_page,
+                batch_size=job.params.get('batch_size', 20),
+                incremental=job.params.get('incremental', False),
+                start_page=job.start_page,
+                initial_stats=job.initial_stats,
+                checkpoint_callback=checkpoint_callback,
+                retry_pages=job.retry_pages
+            )
+            status = collector.run_status or 'failed'
+
+        except Exception as e:
+            job.send_progress(f'数据采集异常: {str(e)}', 'error')
+        finally:
+            # 确保采集结束后记录任务状态和清理资源
+            if job.collector:
+                job.collector.is_running = False
+                job.collector.cleanup()
+            job.send_progress('🔚 数据采集任务结束', 'info')
+            self._finish(job, status)
+
+    def _finish(self, job, status):
+        job.status = status
+        job.finished_at = datetime.now()
+        job.progress.close()
+        try:
+            self.job_store.finish_job(job.job_id, status)
+        except Exception as e:
+            print(f"更新采集任务状态失败: {e}")
+
+    def _prune_finished_jobs(self):
+        """只保留最近的已结束任务（调用方持有锁）"""
+        finished = [job_id for job_id, job in self.jobs.items() if not job.is_active]
+        for job_id in finished[:max(0, len(finished) - self.max_finished_jobs)]:
+            del self.jobs[job_id]
+
+    def get_job(self, job_id=None):
+        """按ID获取任务，未指定时返回最近提交的任务"""
+        with self.lock:
+            if job_id:
+                return self.jobs.get(job_id)
+            return next(reversed(self.jobs.values()), None)
+
+    def get_active_job(self, job_id=None):
+        """按ID获取运行中的任务，未指定时返回最近提交的运行中任务"""
+        with self.lock:
+            if job_id:
+                job = self.jobs.get(job_id)
+                return job if job and job.is_active else None
+            return next((job for job in reversed(self.jobs.values()) if job.is_active), None)
+
+    def list_jobs(self):
+        """按提交时间倒序列出内存中的任务"""
+        with self.lock:
+            jobs = list(self.jobs.values())
+        return [job.to_dict() for job in reversed(jobs)]
+
+    def has_running_jobs(self):
+        with self.lock:
+            return any(job.is_active for job in self.jobs.values())
+
+    def run_exclusive(self, operation, func, *args, **kwargs):
+        """
+        在没有采集任务运行时执行维护操作（如重建汇总），执行期间拒绝提交新的采集任务
+        检查和占用在同一把锁内完成，不会与刚提交的任务同时运行
+        :param operation: 操作名称，用于提示信息
+        :return: func 的返回值；有任务运行或已有维护操作时返回 {'success': False, 'message': str, 'conflict': True}
+        """
+        with self.lock:
+            if self.exclusive_operation:
+                return {'success': False, 'message': f'{self.exclusive_operation}正在进行，请稍后再试', 'conflict': True}
+            if any(job.is_active for job in self.jobs.values()):
+                return {'success': False, 'message': f'有采集任务正在运行，请等待任务结束后再{operation}', 'conflict': True}
+            self.exclusive_operation = operation
+
+        try:
+            return func(*args, **kwargs)
+        finally:
+            with self.lock:
+                self.exclusive_operation = None
+
+    def cancel(self, job_id):
+        """取消任务：排队中的直接移出队列，运行中的发送停止指令"""
+        job = self.get_job(job_id)
+        if not job or not job.is_active:
+            return {'success': False, 'message': '没有运行中的数据采集任务'}
+
+        job.cancel_requested = True
+        if job.future and job.future.cancel():
+            job.send_progress('⏹️ 排队中的任务已取消', 'warning')
+            self._finish(job, 'stopped')
+        elif job.collector:
+            job.collector.stop_data_collection()
+
+        return {'success': True, 'message': '数据采集停止指令已发送', 'job_id': job.job_id}
+
+    def shutdown(self):
+        """程序退出时停止所有任务并清理资源"""
+        with self.lock:
+            jobs = [job for job in self.jobs.values() if job.is_active]
+
+        for job in jobs:
+            job.cancel_requested = True
+            if job.future:
+                job.future.cancel()
+            if job.collector:
+                job.collector.force_cleanup()
+
+        self.executor.shutdown(wait=False)
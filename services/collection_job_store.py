@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+数据采集任务持久化
+记录每个采集任务的参数和检查点（最后完成的页码、累计统计），
+进程中断后可以从检查点继续采集
+"""
+
+import uuid
+import pymongo
+from datetime import datetime
+from utils.database import db
+
+# 可以继续执行的任务状态（running 表示进程在运行中退出，未能更新状态）
+RESUMABLE_STATUSES = ['running', 'stopped', 'failed']
+
+class CollectionJobStore:
+    def __init__(self):
+        self.init_mongodb()
+
+    def init_mongodb(self):
+        try:
+            self.myclient = db.client
+            self.mydb = db.retention_db
+            self.mycol_jobs = self.mydb["采集任务"]
+        except Exception as e:
+            print(f"MongoDB连接失败: {e}")
+            self.myclient = None
+
+    def create_job(self, params):
+        """创建采集任务，返回任务ID"""
+        job_id = uuid.uuid4().hex
+        now = datetime.now()
+        self.mycol_jobs.insert_one({
+            "_id": job_id,
+            "status": "running",
+            "params": params,
+            "last_completed_page": 0,
+            "total_stats": {},
+            "failed_pages": [],
+            "resume_count": 0,
+            "created_at": now,
+            "updated_at": now
+        })
+        return job_id
+
+    def get_job(self, job_id):
+        """按ID获取任务"""
+        return self.mycol_jobs.find_one({"_id": job_id})
+
+    def find_resumable_job(self):
+        """获取最近一个未完成的任务"""
+        return self.mycol_jobs.find_one(
+            {"status": {"$in": RESUMABLE_STATUSES}},
+            sort=[("updated_at", pymongo.DESCENDING)]
+        )
+
+    def save_checkpoint(self, job_id, last_completed_page, total_stats, failed_pages):
+        """保存检查点：最后完成的页码、累计统计和失败页面"""
+        self.mycol_jobs.update_one(
+            {"_id": job_id},
+            {"$set": {
+                "last_completed_page": last_completed_page,
+                "total_stats": dict(total_stats),
+                "failed_pages": list(failed_pages),
+                "updated_at": datetime.now()
+            }}
+        )
+
+    def mark_resumed(self, job_id):
+        """标记任务已恢复运行"""
+        self.mycol_jobs.update_one(
+            {"_id": job_id},
+            {"$set": {"status": "running", "updated_at": datetime.now()}, "$inc": {"resume_count": 1}}
+        )
+
+    def finish_job(self, job_id, status, message=None):
+        """更新任务最终状态: completed / stopped / failed"""
+        update = {"status": status, "updated_at": datetime.now()}
+        if message:
+            update["message"] = message
+        self.mycol_jobs.update_one({"_id": job_id}, {"$set": update})
+
+    @staticmethod
+    def serialize_job(job):
+        """转换为可JSON序列化的字典"""
+        if not job:
+            return None
+        serialized = dict(job)
+        serialized["job_id"] = serialized.pop("_id")
+        for key in ("created_at", "updated_at"):
+            if isinstance(serialized.get(key), datetime):
+                serialized[key] = serialized[key].strftime('%Y-%m-%d %H:%M:%S')
+        return serialized
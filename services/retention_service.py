@@ -1,12 +1,32 @@
 """
 留存分析服务 - 处理数据上传和留存分析功能
 """
+import numpy as np
 import pandas as pd
-import pymongo
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import os
-from collections import defaultdict
+from array import array
+from openpyxl import load_workbook
+from bson import ObjectId
+from pymongo.errors import PyMongoError
+from config.config import Config
 from utils.database import db
+from utils.cohort_bitmap import CohortBitmap
+from utils.retention_filters import STAGING_STATUS, VISIBLE_FILTER
+
+VISIT_TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+# 合并时保留组内第一条记录的字段
+VISIT_INFO_FIELDS = ['来源', '关键词', '搜索词', '入口界面', '系统', '浏览器', '来源类型', '网站', '流量类型']
+# 合并后存入数据库的字段顺序
+MERGED_COLUMNS = ['访问时间', '地域', '访问ip', '访问日期', '访问次数', '访问时长', '总访问时长',
+                  '最早访问时间', '最晚访问时间'] + VISIT_INFO_FIELDS
+VISIT_GROUP_KEYS = ['访问ip', '地域', '访问日期']
+
+# 超过此时间仍未发布的导入批次视为中断遗留，下次导入时清理
+STALE_STAGING_HOURS = 6
+
+# 默认计算的留存间隔：次日、7日、30日
+DEFAULT_RETENTION_DAYS = (1, 7, 30)
 
 class RetentionService:
 
@@ -34,6 +54,175 @@ class RetentionService:
                 serialized[key] = str(value) if value is not None else None
         return serialized
 
+    @staticmethod
+    def _parse_durations(df):
+        """访问时长列转为整数秒："未知"、空值和无法解析的值记为0"""
+        if '访问时长' not in df.columns:
+            return pd.Series(0, index=df.index, dtype='int64')
+        durations = pd.to_numeric(df['访问时长'], errors='coerce').fillna(0)
+        return durations.astype('int64')
+
+    @staticmethod
+    def _duration_stats(df, stats=None):
+        """统计访问时长的处理情况（按原始行），传入 stats 时累加到其中"""
+        if stats is None:
+            stats = {'有效时长': 0, '未知转换': 0, '空值转换': 0, '总时长': 0}
+        if '访问时长' not in df.columns:
+            stats['有效时长'] += len(df)
+            return stats
+        durations = RetentionService._parse_durations(df)
+        unknown = int((durations == 0).sum())
+        stats['有效时长'] += len(durations) - unknown
+        stats['未知转换'] += unknown
+        stats['总时长'] += int(durations.sum())
+        return stats
+
+    @staticmethod
+    def _iter_record_chunks(source, file_ext, chunk_size):
+        """
+        逐块读取上传文件，每块为一个 DataFrame，内存占用与块大小相关而与文件大小无关
+        :param source: 文件路径或二进制文件对象
+        """
+        if file_ext == '.csv':
+            with pd.read_csv(source, chunksize=chunk_size) as reader:
+                yield from reader
+        elif file_ext == '.xlsx':
+            # 只读模式逐行读取，不把整个工作表加载到内存
+            workbook = load_workbook(source, read_only=True, data_only=True)
+            try:
+                rows = workbook.active.iter_rows(values_only=True)
+                header = next(rows, None)
+                if header is None:
+                    return
+                columns = [str(name) if name is not None else f'列{index + 1}' for index, name in enumerate(header)]
+                chunk = []
+                for row in rows:
+                    chunk.append(row)
+                    if len(chunk) >= chunk_size:
+                        yield pd.DataFrame.from_records(chunk, columns=columns)
+                        chunk = []
+                if chunk:
+                    yield pd.DataFrame.from_records(chunk, columns=columns)
+            finally:
+                workbook.close()
+        else:
+            # .xls 没有流式读取接口，整表读取
+            yield pd.read_excel(source)
+
+    @staticmethod
+    def _combine_visit_groups(frame):
+        """
+        把部分合并结果（或逐行数据）按 IP + 地域 + 日期 再次合并
+        次数/时长求和、最早/最晚时间取最值，其他信息字段取组内第一个非空值；各分块的结果可以反复合并
+        """
+        grouped = frame.groupby(VISIT_GROUP_KEYS, sort=False).agg(
+            访问次数=('访问次数', 'sum'),
+            总访问时长=('总访问时长', 'sum'),
+            最早访问时间=('最早访问时间', 'min'),
+            最晚访问时间=('最晚访问时间', 'max'),
+            **{field: (field, 'first') for field in VISIT_INFO_FIELDS}
+        ).reset_index()
+
+        grouped['访问时间'] = grouped['最早访问时间']
+        grouped['访问时长'] = grouped['总访问时长']
+        return grouped[MERGED_COLUMNS]
+
+    @staticmethod
+    def _merge_visit_records(df):
+        """
+        按 IP + 地域 + 日期 合并访问记录
+        访问时间无法解析、IP或地域为空的行不参与合并；其他信息字段取组内第一个非空值
+        :return: 合并后的 DataFrame，列与存入数据库的文档字段一致，按各组首次出现的顺序排列
+        """
+        if '访问时间' not in df.columns or '访问ip' not in df.columns or '地域' not in df.columns:
+            return pd.DataFrame(columns=MERGED_COLUMNS)
+
+        visit_times = pd.to_datetime(df['访问时间'], format=VISIT_TIME_FORMAT, errors='coerce')
+        visits = pd.DataFrame({
+            '访问ip': df['访问ip'],
+            '地域': df['地域'],
+            '访问次数': 1,
+            '总访问时长': RetentionService._parse_durations(df),
+            '最早访问时间': visit_times,
+            '最晚访问时间': visit_times
+        })
+        for field in VISIT_INFO_FIELDS:
+            visits[field] = df[field] if field in df.columns else ''
+
+        visits = visits[visits['最早访问时间'].notna()
+                        & visits['访问ip'].notna() & (visits['访问ip'].astype(str) != '')
+                        & visits['地域'].notna() & (visits['地域'].astype(str) != '')]
+        visits['访问日期'] = visits['最早访问时间'].dt.normalize()
+        return RetentionService._combine_visit_groups(visits)
+
+    @staticmethod
+    def _visit_dates_filter(dates):
+        """访问日期落在给定日期（date 对象）中任意一天的查询条件，每天一个区间，可走 访问日期 索引"""
+        return {'$or': [
+            {'访问日期': {
+                '$gte': datetime.combine(date, datetime.min.time()),
+                '$lt': datetime.combine(date + timedelta(days=1), datetime.min.time())
+            }}
+            for date in dates
+        ]}
+
+    @staticmethod
+    def _existing_visit_dates(collection, dates):
+        """
+        一次聚合查出给定日期中数据库已有数据的日期
+        :return: {'YYYY-MM-DD', ...}
+        """
+        if not dates:
+            return set()
+        pipeline = [
+            {'$match': {'$and': [RetentionService._visit_dates_filter(dates), VISIBLE_FILTER]}},
+            {'$group': {'_id': {'$dateToString': {'format': '%Y-%m-%d', 'date': '$访问日期'}}}}
+        ]
+        return {doc['_id'] for doc in collection.aggregate(pipeline)}
+
+    @staticmethod
+    def _discard_stale_staging(collection):
+        """删除中断遗留的导入数据（批次ID即 ObjectId，按其中的创建时间判断）"""
+        cutoff = ObjectId.from_datetime(datetime.now(timezone.utc) - timedelta(hours=STALE_STAGING_HOURS))
+        result = collection.delete_many({'导入状态': STAGING_STATUS, '导入批次': {'$lt': cutoff}})
+        if result.deleted_count:
+            print(f"清理中断遗留的导入数据: {result.deleted_count} 条")
+
+    @staticmethod
+    def _publish_batch(collection, batch_id, overwrite_dates):
+        """
+        发布导入批次：删除被覆盖日期的旧数据并让新数据可见
+        优先在事务中完成，读者要么看到旧数据要么看到新数据；
+        单机 MongoDB 不支持事务时退回为先发布新数据再删除旧数据（短暂重复，但不会出现空白日期）
+        :return: 删除的旧数据条数
+        """
+        old_data_filter = None
+        if overwrite_dates:
+            old_data_filter = {'$and': [
+                RetentionService._visit_dates_filter(overwrite_dates),
+                VISIBLE_FILTER,
+                {'导入批次': {'$ne': batch_id}}
+            ]}
+        publish = ({'导入批次': batch_id, '导入状态': STAGING_STATUS}, {'$unset': {'导入状态': ''}})
+
+        def swap(session=None):
+            deleted_count = 0
+            if old_data_filter:
+                deleted_count = collection.delete_many(old_data_filter, session=session).deleted_count
+            collection.update_many(*publish, session=session)
+            return deleted_count
+
+        try:
+            with collection.database.client.start_session() as session:
+                return session.with_transaction(swap)
+        except PyMongoError as e:
+            print(f"事务不可用，改为非事务切换: {e}")
+
+        collection.update_many(*publish)
+        if old_data_filter:
+            return collection.delete_many(old_data_filter).deleted_count
+        return 0
+
     @staticmethod
     def process_and_store_data(file_path, file_content=None, force_overwrite=False):
         """
@@ -46,18 +235,15 @@ class RetentionService:
         try:
             # 根据文件扩展名选择读取方式
             file_ext = os.path.splitext(file_path)[1].lower()
+            if file_ext not in ['.xlsx', '.xls', '.csv']:
+                return {
+                    'success': False,
+                    'message': f'不支持的文件格式: {file_ext}'
+                }
             
-            if file_content:
-                # 处理前端上传的文件内容
-                if file_ext in ['.xlsx', '.xls']:
-                    df1 = pd.read_excel(file_content)
-                elif file_ext == '.csv':
-                    df1 = pd.read_csv(file_content)
-                else:
-                    return {
-                        'success': False,
-                        'message': f'不支持的文件格式: {file_ext}'
-                    }
+            if file_content is not None:
+                # 处理前端上传的文件内容（文件对象，逐块读取）
+                source = file_content
             else:
                 # 处理本地文件路径
                 if not os.path.exists(file_path):
@@ -65,161 +251,59 @@ class RetentionService:
                         'success': False,
                         'message': f'文件不存在: {file_path}'
                     }
-                
-                if file_ext in ['.xlsx', '.xls']:
-                    df1 = pd.read_excel(file_path)
-                elif file_ext == '.csv':
-                    df1 = pd.read_csv(file_path)
-                else:
-                    return {
-                        'success': False,
-                        'message': f'不支持的文件格式: {file_ext}'
-                    }
-            
-            original_count = len(df1)
+                source = file_path
             
-            # 连接MongoDB - 使用留存数据库
+            # 连接MongoDB - 使用留存数据库（共享连接池）
             try:
-                client = pymongo.MongoClient('mongodb://localhost:27017/')
-                retention_db = client['留存']  # 留存分析专用数据库
-                collection = retention_db['数据']  # 集合名称
+                collection = db.retention_db['数据']  # 集合名称
             except Exception as e:
                 return {
                     'success': False,
                     'message': f'连接数据库失败: {str(e)}'
                 }
             
-            # 将DataFrame转换为字典列表
-            data_records = df1.to_dict('records')
-            
-            # 处理数据格式并合并相同用户的记录
-            # 先处理时间格式和访问时长
-            for record in data_records:
-                # 转换访问时间
-                if '访问时间' in record:
-                    try:
-                        record['访问时间'] = datetime.strptime(record['访问时间'], '%Y-%m-%d %H:%M:%S')
-                    except:
-                        pass
-                
-                # 处理访问时长：将"未知"、空值、None转换为0
-                if '访问时长' in record:
-                    duration = record['访问时长']
-                    if duration == '未知' or duration == '' or duration is None:
-                        record['访问时长'] = 0
-                    else:
-                        try:
-                            record['访问时长'] = int(duration)
-                        except (ValueError, TypeError):
-                            record['访问时长'] = 0
+            # 逐块读取并按 IP + 地域 + 日期 合并，跨块的同组记录在累计结果中继续合并，
+            # 内存中只保留当前块和已合并的分组
+            original_count = 0
+            duration_stats = None
+            merged = None
+            for chunk in RetentionService._iter_record_chunks(source, file_ext, Config.RETENTION_CHUNK_SIZE):
+                original_count += len(chunk)
+                duration_stats = RetentionService._duration_stats(chunk, duration_stats)
+                chunk_merged = RetentionService._merge_visit_records(chunk)
+                if merged is None:
+                    merged = chunk_merged
+                elif len(chunk_merged):
+                    merged = RetentionService._combine_visit_groups(pd.concat([merged, chunk_merged], ignore_index=True))
             
-            # 按 IP + 地域 + 日期 分组合并数据
-            merged_data = defaultdict(lambda: {
-                '访问次数': 0,
-                '总访问时长': 0,
-                '最早访问时间': None,
-                '最晚访问时间': None,
-                '其他信息': {}
-            })
+            if merged is None:
+                merged = pd.DataFrame(columns=MERGED_COLUMNS)
+            if duration_stats is None:
+                duration_stats = {'有效时长': 0, '未知转换': 0, '空值转换': 0, '总时长': 0}
+            merged_count = len(merged)
             
-            for record in data_records:
-                if record.get('访问时间') and record.get('访问ip') and record.get('地域'):
-                    # 提取日期作为分组键的一部分
-                    visit_date = record['访问时间'].date()
-                    group_key = (record['访问ip'], record['地域'], visit_date)
-                    
-                    # 累加访问次数和时长
-                    merged_data[group_key]['访问次数'] += 1
-                    merged_data[group_key]['总访问时长'] += record.get('访问时长', 0)
-                    
-                    # 记录最早和最晚访问时间
-                    current_time = record['访问时间']
-                    if merged_data[group_key]['最早访问时间'] is None or current_time < merged_data[group_key]['最早访问时间']:
-                        merged_data[group_key]['最早访问时间'] = current_time
-                    if merged_data[group_key]['最晚访问时间'] is None or current_time > merged_data[group_key]['最晚访问时间']:
-                        merged_data[group_key]['最晚访问时间'] = current_time
-                    
-                    # 保存其他字段信息（使用第一条记录的信息）
-                    if not merged_data[group_key]['其他信息']:
-                        merged_data[group_key]['其他信息'] = {
-                            '来源': record.get('来源', ''),
-                            '关键词': record.get('关键词', ''),
-                            '搜索词': record.get('搜索词', ''),
-                            '入口界面': record.get('入口界面', ''),
-                            '系统': record.get('系统', ''),
-                            '浏览器': record.get('浏览器', ''),
-                            '来源类型': record.get('来源类型', ''),
-                            '网站': record.get('网站', ''),
-                            '流量类型': record.get('流量类型', '')
-                        }
-            
-            # 将合并后的数据转换为最终格式
-            final_records = []
-            for (ip, region, date), data in merged_data.items():
-                final_record = {
-                    '访问时间': data['最早访问时间'],
-                    '地域': region,
-                    '访问ip': ip,
-                    '访问日期': datetime.combine(date, datetime.min.time()),
-                    '访问次数': data['访问次数'],
-                    '访问时长': data['总访问时长'],
-                    '总访问时长': data['总访问时长'],
-                    '最早访问时间': data['最早访问时间'],
-                    '最晚访问时间': data['最晚访问时间'],
-                    **data['其他信息']
-                }
-                final_records.append(final_record)
-            
-            merged_count = len(final_records)
-            
-            # 统计合并示例
+            # 统计合并示例（前3组中有多次访问的）
+            head_records = merged.head(3).to_dict('records')
             merge_examples = []
-            for (ip, region, date), data in list(merged_data.items())[:3]:
-                if data['访问次数'] > 1:
+            for record in head_records:
+                if record['访问次数'] > 1:
                     merge_examples.append({
-                        'ip': ip,
-                        'region': region,
-                        'date': str(date),
-                        'visit_count': data['访问次数'],
-                        'total_duration': data['总访问时长'],
-                        'time_range': f"{data['最早访问时间'].strftime('%H:%M:%S')} - {data['最晚访问时间'].strftime('%H:%M:%S')}"
+                        'ip': record['访问ip'],
+                        'region': record['地域'],
+                        'date': str(record['访问日期'].date()),
+                        'visit_count': record['访问次数'],
+                        'total_duration': record['总访问时长'],
+                        'time_range': f"{record['最早访问时间'].strftime('%H:%M:%S')} - {record['最晚访问时间'].strftime('%H:%M:%S')}"
                     })
             
-            # 统计访问时长处理情况
-            duration_stats = {'有效时长': 0, '未知转换': 0, '空值转换': 0, '总时长': 0}
-            for record in data_records:
-                original_duration = record.get('访问时长')
-                if original_duration == 0:
-                    duration_stats['未知转换'] += 1
-                else:
-                    duration_stats['有效时长'] += 1
-                duration_stats['总时长'] += record.get('访问时长', 0)
-            
-            # 检查是否有重复数据
-            duplicate_dates = set()
-            for record in final_records:
-                if '访问日期' in record:
-                    visit_date = record['访问日期']
-                    date_str = visit_date.strftime('%Y-%m-%d')
-
-                    # 检查数据库中是否已存在该日期的数据
-                    existing_count = collection.count_documents({
-                        '访问日期': {
-                            '$gte': datetime.combine(visit_date.date(), datetime.min.time()),
-                            '$lt': datetime.combine(visit_date.date() + timedelta(days=1), datetime.min.time())
-                        }
-                    })
-
-                    if existing_count > 0:
-                        duplicate_dates.add(date_str)
+            # 检查是否有重复数据：按文件涉及的日期做一次聚合，查询次数与行数无关
+            incoming_dates = sorted({visit_date.date() for visit_date in merged['访问日期'] if not pd.isna(visit_date)})
+            duplicate_dates = RetentionService._existing_visit_dates(collection, incoming_dates)
 
             # 如果有重复日期且不强制覆盖，提供选项
             if duplicate_dates and not force_overwrite:
                 duplicate_dates_list = sorted(list(duplicate_dates))
 
-                # 关闭连接
-                client.close()
-
                 return {
                     'success': True,
                     'has_duplicates': True,
@@ -234,24 +318,29 @@ class RetentionService:
                     }
                 }
 
-            # 如果强制覆盖，先删除重复日期的数据
-            if duplicate_dates and force_overwrite:
-                deleted_count = 0
-                for date_str in duplicate_dates:
-                    date_obj = datetime.strptime(date_str, '%Y-%m-%d').date()
-                    delete_result = collection.delete_many({
-                        '访问日期': {
-                            '$gte': datetime.combine(date_obj, datetime.min.time()),
-                            '$lt': datetime.combine(date_obj + timedelta(days=1), datetime.min.time())
-                        }
-                    })
-                    deleted_count += delete_result.deleted_count
+            RetentionService._discard_stale_staging(collection)
 
-            # 批量插入合并后的数据到MongoDB
-            result = collection.insert_many(final_records)
+            # 分批写入暂存数据（带批次ID，发布前对查询不可见），每批只转换当前批次的文档
+            batch_id = ObjectId()
+            merged['导入批次'] = batch_id
+            merged['导入状态'] = STAGING_STATUS
+            inserted_count = 0
+            batch_size = Config.RETENTION_INSERT_BATCH_SIZE
+            try:
+                for offset in range(0, merged_count, batch_size):
+                    batch = merged.iloc[offset:offset + batch_size].to_dict('records')
+                    result = collection.insert_many(batch, ordered=False)
+                    inserted_count += len(result.inserted_ids)
+            except Exception:
+                # 写入中断时丢弃本批次，旧数据保持不变
+                collection.delete_many({'导入批次': batch_id})
+                raise
 
-            # 关闭连接
-            client.close()
+            # 一次性切换：如果强制覆盖，旧数据的删除与新数据的发布同时生效
+            overwrite_dates = []
+            if duplicate_dates and force_overwrite:
+                overwrite_dates = [datetime.strptime(date_str, '%Y-%m-%d').date() for date_str in duplicate_dates]
+            deleted_count = RetentionService._publish_batch(collection, batch_id, overwrite_dates)
 
             # 准备返回消息
             message = '数据处理完成'
@@ -260,7 +349,7 @@ class RetentionService:
 
             # 准备示例记录（序列化处理）
             sample_records = []
-            for record in final_records[:3]:
+            for record in head_records:
                 sample_records.append(RetentionService._serialize_record(record))
 
             return {
@@ -271,7 +360,7 @@ class RetentionService:
                     'original_count': original_count,
                     'merged_count': merged_count,
                     'merged_diff': original_count - merged_count,
-                    'inserted_count': len(result.inserted_ids),
+                    'inserted_count': inserted_count,
                     'deleted_count': deleted_count if duplicate_dates and force_overwrite else 0,
                     'overwritten_dates': sorted(list(duplicate_dates)) if duplicate_dates and force_overwrite else [],
                     'merge_examples': merge_examples,
@@ -288,18 +377,174 @@ class RetentionService:
             }
 
     @staticmethod
-    def analyze_retention(start_date=None, end_date=None):
+    def parse_retention_days(value):
         """
-        分析用户留存情况 - 待开发
+        校验留存间隔天数：必须是正整数列表，返回去重排序后的列表
+        单个字符串（如 "30"）或数字不是列表，直接拒绝，避免被逐字符拆成 [3, 0]
+        :raises ValueError: 格式不正确
+        """
+        if not isinstance(value, (list, tuple)) or not value:
+            raise ValueError('retention_days 必须是非空的正整数列表，如 [1, 7, 30]')
+        for day in value:
+            if isinstance(day, bool) or not isinstance(day, int) or day <= 0:
+                raise ValueError(f'retention_days 中的 {day!r} 不是正整数')
+        return sorted(set(value))
+
+    @staticmethod
+    def parse_include_details(value):
+        """
+        校验是否返回明细：接受布尔值、0/1 以及 "true"/"false"/"1"/"0"（不区分大小写）
+        不能直接 bool()，否则字符串 "false" 会被当成 True
+        :raises ValueError: 格式不正确
+        """
+        if isinstance(value, bool):
+            return value
+        if isinstance(value, int) and value in (0, 1):
+            return bool(value)
+        if isinstance(value, str) and value.strip().lower() in ('true', 'false', '1', '0'):
+            return value.strip().lower() in ('true', '1')
+        raise ValueError(f'include_details 的值 {value!r} 无效，应为 true 或 false')
+
+    @staticmethod
+    def parse_details_limit(value):
+        """
+        校验明细条数上限：非负整数（或只含数字的字符串）
+        负数会被切片解释为"去掉末尾若干条"，小数会被静默截断，都直接拒绝
+        :raises ValueError: 格式不正确
+        """
+        if isinstance(value, str) and value.strip().isascii() and value.strip().isdigit():
+            return int(value)
+        if isinstance(value, bool) or not isinstance(value, int) or value < 0:
+            raise ValueError(f'details_limit 的值 {value!r} 无效，应为非负整数')
+        return value
+
+    @staticmethod
+    def analyze_retention(start_date=None, end_date=None, retention_days=DEFAULT_RETENTION_DAYS,
+                          include_details=False, details_limit=100):
+        """
+        分析用户留存情况：以 (访问ip, 地域) 为一个用户，按访问日期分组计算N日留存
         :param start_date: 开始日期，格式：'2025-07-17' 或 datetime对象
         :param end_date: 结束日期，格式：'2025-07-27' 或 datetime对象
-        :return: 留存分析结果
+        :param retention_days: 计算的留存间隔天数，如 [1, 7, 30]
+        :param include_details: 是否返回留存用户明细（数据量大，默认不返回）
+        :param details_limit: 每个基准日、每个间隔最多返回的明细条数
+        :return: 留存分析结果，日期范围为请求的范围（未指定的一端取数据的首/末日），目标日超出范围的单元格为 None
         """
-        return {
-            'success': False,
-            'message': '留存分析功能正在开发中，敬请期待！',
-            'data': {
-                'status': 'under_development',
-                'note': '新的留存分析逻辑正在开发中'
+        try:
+            if isinstance(start_date, str) and start_date:
+                start_date = datetime.strptime(start_date, '%Y-%m-%d')
+            if isinstance(end_date, str) and end_date:
+                end_date = datetime.strptime(end_date, '%Y-%m-%d')
+            try:
+                retention_days = RetentionService.parse_retention_days(retention_days)
+            except ValueError as e:
+                return {'success': False, 'message': str(e)}
+
+            # 只读取计算需要的三个字段，按 访问日期 索引过滤
+            query_filter = dict(VISIBLE_FILTER)
+            date_filter = {}
+            if start_date:
+                date_filter['$gte'] = datetime.combine(start_date.date(), datetime.min.time())
+            if end_date:
+                date_filter['$lt'] = datetime.combine(end_date.date() + timedelta(days=1), datetime.min.time())
+            if date_filter:
+                query_filter['访问日期'] = date_filter
+
+            # 逐条读取游标直接写入整数数组，不在内存中保留文档列表或 DataFrame；
+            # 用户按首次出现的顺序编号，user_keys[用户ID] 就是对应的 (访问ip, 地域)
+            collection = db.retention_db['数据']
+            cursor = collection.find(query_filter, {'_id': 0, '访问ip': 1, '地域': 1, '访问日期': 1}).batch_size(10000)
+            user_ids = {}
+            day_ordinals = array('q')
+            user_index = array('q')
+            for doc in cursor:
+                ip = doc.get('访问ip')
+                region = doc.get('地域')
+                visit_date = doc.get('访问日期')
+                if ip is None or region is None or not isinstance(visit_date, datetime):
+                    continue
+                user_index.append(user_ids.setdefault((ip, region), len(user_ids)))
+                day_ordinals.append(visit_date.toordinal())
+
+            if not user_ids:
+                return {
+                    'success': True,
+                    'message': '指定日期范围内没有数据',
+                    'data': {'retention_days': retention_days, 'total_users': 0, 'cohorts': [], 'average': {}}
+                }
+
+            # 日期映射为相对第一天的序号；指定了日期范围时按请求的范围划定天数，
+            # 范围两端没有访问的日期也在范围内（留存为 0），只有目标日超出范围才为 None
+            day_ordinals = np.frombuffer(day_ordinals, dtype=np.int64)
+            first_ordinal = start_date.toordinal() if start_date else int(day_ordinals.min())
+            last_ordinal = end_date.toordinal() if end_date else int(day_ordinals.max())
+            first_day = pd.Timestamp(datetime.fromordinal(first_ordinal))
+            day_index = day_ordinals - first_ordinal
+            user_index = np.frombuffer(user_index, dtype=np.int64)
+            n_days = last_ordinal - first_ordinal + 1
+            n_users = len(user_ids)
+
+            bitmap = CohortBitmap(day_index, user_index, n_days, n_users)
+            day_counts = bitmap.day_counts()
+            retained = {lag: bitmap.retained_counts(lag) for lag in retention_days}
+
+            user_keys = list(user_ids) if include_details else None
+
+            cohorts = []
+            for day in np.flatnonzero(day_counts):
+                base_users = int(day_counts[day])
+                cohort = {
+                    'date': (first_day + pd.Timedelta(days=int(day))).strftime('%Y-%m-%d'),
+                    'users': base_users,
+                    'retention': {}
+                }
+                for lag in retention_days:
+                    count = int(retained[lag][day])
+                    if count < 0:
+                        cohort['retention'][f'D{lag}'] = None
+                        continue
+                    cell = {
+                        'retained': count,
+                        'rate': round(count / base_users, 4),
+                        'rate_text': f"{count / base_users:.2%}"
+                    }
+                    if include_details:
+                        users = bitmap.retained_users(int(day), lag)[:details_limit]
+                        cell['details'] = [{'ip': user_keys[user][0], 'region': user_keys[user][1]} for user in users]
+                    cohort['retention'][f'D{lag}'] = cell
+                cohorts.append(cohort)
+
+            # 各间隔的加权平均留存率（只统计目标日在范围内的基准日）
+            average = {}
+            for lag in retention_days:
+                valid = (retained[lag] >= 0) & (day_counts > 0)
+                base_total = int(day_counts[valid].sum())
+                retained_total = int(retained[lag][valid].sum())
+                average[f'D{lag}'] = {
+                    'cohort_count': int(valid.sum()),
+                    'base_users': base_total,
+                    'retained': retained_total,
+                    'rate': round(retained_total / base_total, 4) if base_total else None,
+                    'rate_text': f"{retained_total / base_total:.2%}" if base_total else None
+                }
+
+            return {
+                'success': True,
+                'message': '留存分析完成',
+                'data': {
+                    'start_date': first_day.strftime('%Y-%m-%d'),
+                    'end_date': (first_day + pd.Timedelta(days=n_days - 1)).strftime('%Y-%m-%d'),
+                    'record_count': len(user_index),
+                    'retention_days': retention_days,
+                    'total_users': n_users,
+                    'cohorts': cohorts,
+                    'average': average
+                }
+            }
+
+        except Exception as e:
+            print(f"留存分析失败: {str(e)}")
+            return {
+                'success': False,
+                'message': f'留存分析失败: {str(e)}'
             }
-        }
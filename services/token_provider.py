@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+视频后台令牌服务
+按 缓存令牌 -> HTTP直接登录 -> 浏览器登录 的顺序获取 backserver-token，
+获取到的令牌会缓存在内存并持久化到MongoDB，重复运行时无需再启动浏览器
+"""
+
+import base64
+import json
+import threading
+from datetime import datetime, timedelta
+from config.config import Config
+from utils.http_client import get_shared_transport
+
+def build_auth_headers(token):
+    """构造访问视频后台接口所需的请求头"""
+    return {
+        'Authorization': f'Bearer {token}',
+        'backserver-token': token,
+        'Content-Type': 'application/json',
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+    }
+
+class TokenProvider:
+    """backserver-token 提供者"""
+
+    # 进程内缓存: {username: {'token': ..., 'expires_at': datetime}}
+    _memory_cache = {}
+    _cache_lock = threading.Lock()
+
+    def __init__(self, token_collection=None, progress_callback=None, api_base_url=None):
+        """
+        :param token_collection: 持久化令牌的MongoDB集合，为 None 时只使用内存缓存
+        :param progress_callback: 进度回调 progress_callback(message, level)
+        """
+        self.token_collection = token_collection
+        self.progress_callback = progress_callback
+        self.api_base_url = api_base_url or Config.VIDEO_API_BASE_URL
+        self.transport = get_shared_transport()
+
+    def send_progress(self, message, level="info"):
+        if self.progress_callback:
+            self.progress_callback(message, level)
+
+    def get_token(self, username, password, browser_login=None):
+        """
+        获取可用令牌
+        :param browser_login: 浏览器登录函数，前两种方式都失败时才调用，返回令牌或 None
+        :return: 令牌，获取失败返回 None
+        """
+        token = self.get_cached_token(username)
+        if token:
+            if self.validate_token(token):
+                self.send_progress("⚡ 使用缓存的登录令牌，无需启动浏览器", "success")
+                return token
+            self.send_progress("⚠️ 缓存的令牌已失效，重新登录", "warning")
+            self.invalidate(username)
+
+        token = self.http_login(username, password)
+        if token:
+            self.send_progress("✅ 接口登录成功，已获取token", "success")
+            self.save_token(username, token)
+            return token
+
+        if browser_login:
+            self.send_progress("🌐 改用浏览器登录获取token", "info")
+            token = browser_login()
+            if token:
+                self.save_token(username, token)
+                return token
+
+        return None
+
+    def get_cached_token(self, username):
+        """读取未过期的缓存令牌（先内存，后数据库）"""
+        now = datetime.now()
+
+        with self._cache_lock:
+            cached = self._memory_cache.get(username)
+        if cached and cached['expires_at'] > now:
+            return cached['token']
+
+        if self.token_collection is None:
+            return None
+
+        try:
+            doc = self.token_collection.find_one({'_id': username})
+        except Exception as e:
+            self.send_progress(f"⚠️ 读取缓存令牌失败: {e}", "warning")
+            return None
+
+        if doc and doc.get('token') and doc.get('expires_at') and doc['expires_at'] > now:
+            with self._cache_lock:
+                self._memory_cache[username] = {'token': doc['token'], 'expires_at': doc['expires_at']}
+            return doc['token']
+
+        return None
+
+    def save_token(self, username, token):
+        """缓存并持久化令牌"""
+        expires_at = self.token_expires_at(token)
+
+        with self._cache_lock:
+            self._memory_cache[username] = {'token': token, 'expires_at': expires_at}
+
+        if self.token_collection is None:
+            return
+
+        try:
+            self.token_collection.update_one(
+                {'_id': username},
+                {'$set': {'token': token, 'expires_at': expires_at, 'updated_at': datetime.now()}},
+                upsert=True
+            )
+        except Exception as e:
+            self.send_progress(f"⚠️ 保存令牌失败: {e}", "warning")
+
+    def invalidate(self, username):
+        """删除失效的缓存令牌"""
+        with self._cache_lock:
+            self._memory_cache.pop(username, None)
+
+        if self.token_collection is not None:
+            try:
+                self.token_collection.delete_one({'_id': username})
+            except Exception:
+                pass
+
+    @staticmethod
+    def token_expires_at(token):
+        """JWT令牌取其 exp 字段（提前5分钟过期），否则使用默认有效期"""
+        default_expires_at = datetime.now() + timedelta(hours=Config.VIDEO_TOKEN_TTL_HOURS)
+        parts = token.split('.')
+        if len(parts) != 3:
+            return default_expires_at
+
+        try:
+            payload_segment = parts[1] + '=' * (-len(parts[1]) % 4)
+            payload = json.loads(base64.urlsafe_b64decode(payload_segment))
+            return datetime.fromtimestamp(int(payload['exp'])) - timedelta(minutes=5)
+        except Exception:
+            return default_expires_at
+
+    def validate_token(self, token):
+        """用一个极小的列表请求检查令牌是否仍然有效"""
+        url = f"{self.api_base_url}/api/cms/task/video_list"
+        params = {'page_number': 1, 'page_size': 1, 'status': -1, 'username': ''}
+
+        try:
+            response = self.transport.get(url, params=params, headers=build_auth_headers(token), timeout=10)
+        except Exception:
+            # 网络异常无法判断令牌状态，交给后续采集流程处理
+            return True
+
+        if response.status_code in (401, 403):
+            return False
+        if response.status_code != 200:
+            return True
+
+        try:
+            return 'data' in response.json()
+        except ValueError:
+            return False
+
+    def http_login(self, username, password):
+        """直接调用后台登录接口获取令牌，未配置登录接口时返回 None"""
+        if not Config.VIDEO_LOGIN_API_URL:
+            return None
+
+        try:
+            response = self.transport.post(
+                Config.VIDEO_LOGIN_API_URL,
+                json={'username': username, 'password': password},
+                timeout=10
+            )
+        except Exception as e:
+            self.send_progress(f"⚠️ 接口登录失败: {e}", "warning")
+            return None
+
+        if response.status_code != 200:
+            self.send_progress(f"⚠️ 接口登录失败，状态码: {response.status_code}", "warning")
+            return None
+
+        for name, value in response.cookies.items():
+            if 'token' in name.lower():
+                return value
+
+        try:
+            return self._find_token(response.json())
+        except ValueError:
+            return None
+
+    @classmethod
+    def _find_token(cls, payload):
+        """在登录接口返回的JSON中查找令牌字段"""
+        if isinstance(payload, dict):
+            for key, value in payload.items():
+                if 'token' in key.lower() and isinstance(value, str) and value:
+                    return value
+            for value in payload.values():
+                token = cls._find_token(value)
+                if token:
+                    return token
+        return None
@@ -5,10 +5,27 @@
 整合 yisen 文件夹下的视频数据查询逻辑
 """
 
-import pymongo
 from datetime import datetime, timedelta
 import pandas as pd
 from collections import defaultdict
+import base64
+from bson import json_util
+from utils.database import db
+from utils.indexes import ensure_collection_indexes
+
+# 分页查询的默认/最大每页条数
+DEFAULT_PAGE_LIMIT = 500
+MAX_PAGE_LIMIT = 2000
+
+# 各分页查询的排序键（以 _id 结尾保证顺序唯一，游标即最后一条记录在这些字段上的取值）
+PAGE_SORTS = {
+    'date_range': [('date', 1), ('_id', 1)],
+    'single_date': [('usage_count', -1), ('_id', 1)],
+    'user_history': [('date', 1), ('_id', 1)]
+}
+
+class InvalidCursorError(ValueError):
+    """分页游标无法解析"""
 
 class VideoActiveService:
     def __init__(self):
@@ -16,16 +33,23 @@ class VideoActiveService:
     
     def init_mongodb(self):
         try:
-            self.myclient = pymongo.MongoClient("mongodb://localhost:27017/")
-            self.mydb = self.myclient["留存"]
+            # 使用进程共享的连接池，不在每次请求时新建客户端
+            self.myclient = db.client
+            self.mydb = db.retention_db
             self.mycol_raw = self.mydb["原始数据"]
             self.mycol_retention = self.mydb["用户日活跃"]
-            print("MongoDB连接成功")
         except Exception as e:
             print(f"MongoDB连接失败: {e}")
             self.myclient = None
     
-    def query_users_by_date_range(self, start_date, end_date):
+    @staticmethod
+    def _normalize_date(value):
+        """日期字符串或日期对象 -> 'YYYY-MM-DD'，格式不对时抛出 ValueError"""
+        if isinstance(value, str):
+            return datetime.strptime(value, '%Y-%m-%d').strftime('%Y-%m-%d')
+        return value.strftime('%Y-%m-%d')
+    
+    def query_users_by_date_range(self, start_date, end_date, include_video_ids=True):
         """查询指定日期范围内的用户活跃数据"""
         if not self.myclient:
             print("数据库未连接")
@@ -49,7 +73,8 @@ class VideoActiveService:
                 }
             }
             
-            results = list(self.mycol_retention.find(query, {'_id': 0}).sort("date", 1))
+            projection = {'_id': 0} if include_video_ids else {'_id': 0, 'video_ids': 0}
+            results = list(self.mycol_retention.find(query, projection).sort("date", 1))
             
             print(f"查询结果: {len(results)} 条用户活跃记录")
             print(f"日期范围: {start_date} 到 {end_date}")
@@ -101,9 +126,107 @@ class VideoActiveService:
             print(f"查询失败: {e}")
             return []
     
+    @staticmethod
+    def encode_cursor(values):
+        """排序字段取值 -> URL安全的游标字符串（ObjectId 等类型由 json_util 保留）"""
+        return base64.urlsafe_b64encode(json_util.dumps(values).encode('utf-8')).decode('ascii')
+    
+    @staticmethod
+    def decode_cursor(cursor, sort):
+        """游标字符串 -> 排序字段取值列表"""
+        try:
+            values = json_util.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+        except Exception:
+            raise InvalidCursorError('分页游标无效')
+        if not isinstance(values, list) or len(values) != len(sort):
+            raise InvalidCursorError('分页游标与查询类型不匹配')
+        return values
+    
+    @staticmethod
+    def _keyset_filter(sort, values):
+        """
+        排在游标之后的记录条件，按排序键逐级展开：
+        (a > x) or (a == x and b > y) or ...（倒序字段用 $lt）
+        """
+        clauses = []
+        for index, (field, direction) in enumerate(sort):
+            clause = {prev_field: value for (prev_field, _), value in zip(sort[:index], values[:index])}
+            clause[field] = {'$gt' if direction == 1 else '$lt': values[index]}
+            clauses.append(clause)
+        return {'$or': clauses}
+    
+    def query_page(self, query_type, query, cursor=None, limit=None, include_video_ids=False):
+        """
+        按游标（keyset）分页查询用户日活跃，每页只读取 limit 条，不随范围增大而变慢
+        :param query_type: PAGE_SORTS 中的查询类型，决定排序和游标字段
+        :param cursor: 上一页返回的 next_cursor，为空表示第一页
+        :param include_video_ids: 是否返回 video_ids 数组（数据量大，默认不返回）
+        :return: {'items': [...], 'next_cursor': str|None, 'has_more': bool, 'total': int|None, 'stats': dict|None}
+            total 和 stats（整个查询范围的独立用户数、总使用次数）只在第一页计算，翻页时为 None
+        """
+        sort = PAGE_SORTS[query_type]
+        limit = min(max(int(limit or DEFAULT_PAGE_LIMIT), 1), MAX_PAGE_LIMIT)
+        
+        page_query = query
+        if cursor:
+            page_query = {'$and': [query, self._keyset_filter(sort, self.decode_cursor(cursor, sort))]}
+        
+        projection = None if include_video_ids else {'video_ids': 0}
+        # 多取一条判断是否还有下一页
+        items = list(self.mycol_retention.find(page_query, projection).sort(sort).limit(limit + 1))
+        has_more = len(items) > limit
+        items = items[:limit]
+        
+        next_cursor = None
+        if has_more:
+            last = items[-1]
+            next_cursor = self.encode_cursor([last.get(field) for field, _ in sort])
+        
+        for item in items:
+            item.pop('_id', None)
+        
+        stats = None if cursor else self.query_stats(query)
+        return {
+            'items': items,
+            'next_cursor': next_cursor,
+            'has_more': has_more,
+            'total': stats['total'] if stats else None,
+            'stats': stats
+        }
+    
+    def query_stats(self, query):
+        """
+        在MongoDB内统计整个查询范围的记录数、独立用户数和总使用次数，
+        页面上的汇总卡片不再依赖只含第一页的数据
+        """
+        pipeline = [
+            {'$match': query},
+            # 先按用户分组，独立用户数就是分组数，不需要把所有昵称收集到一个数组里
+            {'$group': {'_id': '$nickname', 'records': {'$sum': 1}, 'usage': {'$sum': '$usage_count'}}},
+            {'$group': {'_id': None, 'total': {'$sum': '$records'}, 'unique_users': {'$sum': 1},
+                        'total_usage': {'$sum': '$usage'}}}
+        ]
+        result = next(self.mycol_retention.aggregate(pipeline), None)
+        if not result:
+            return {'total': 0, 'unique_users': 0, 'total_usage': 0}
+        return {'total': result['total'], 'unique_users': result['unique_users'], 'total_usage': result['total_usage']}
+    
+    def page_users_by_date_range(self, start_date, end_date, **page_options):
+        """分页查询日期范围内的用户活跃数据（按日期排序）"""
+        query = {"date": {"$gte": self._normalize_date(start_date), "$lte": self._normalize_date(end_date)}}
+        return self.query_page('date_range', query, **page_options)
+    
+    def page_users_by_single_date(self, date, **page_options):
+        """分页查询单日的用户活跃数据（按使用次数倒序）"""
+        return self.query_page('single_date', {"date": self._normalize_date(date)}, **page_options)
+    
+    def page_user_history(self, nickname, **page_options):
+        """分页查询用户的历史活跃记录（按日期排序）"""
+        return self.query_page('user_history', {"nickname": nickname}, **page_options)
+    
     def get_active_users_summary(self, start_date, end_date):
         """获取活跃用户汇总统计"""
-        users_data = self.query_users_by_date_range(start_date, end_date)
+        users_data = self.query_users_by_date_range(start_date, end_date, include_video_ids=False)
         
         if not users_data:
             return {}
@@ -233,4 +356,129 @@ class VideoActiveService:
             
         except Exception as e:
             print(f"获取数据概览失败: {e}")
-            return {'message': f'查询失败: {str(e)}', 'total_records': 0}
\ No newline at end of file
+            return {'message': f'查询失败: {str(e)}', 'total_records': 0}
+    
+    def rebuild_daily_summaries(self, start_date, end_date):
+        """
+        在MongoDB内从原始数据重新生成指定日期范围的用户日活跃（$group + $merge，数据不经过Python）
+        用于修正历史汇总或新增汇总指标后回填，无需重新采集；需要 MongoDB 4.2+
+        已存在的汇总按 unique_key 整条替换（保留 created_at），范围内没有原始数据的汇总保持不变
+        """
+        if not self.myclient:
+            return {'success': False, 'message': '数据库未连接'}
+        
+        try:
+            start_date = datetime.strptime(start_date, '%Y-%m-%d').strftime('%Y-%m-%d')
+            end_date = datetime.strptime(end_date, '%Y-%m-%d').strftime('%Y-%m-%d')
+        except (TypeError, ValueError):
+            return {'success': False, 'message': '日期格式错误，应为 YYYY-MM-DD'}
+        
+        if start_date > end_date:
+            return {'success': False, 'message': '开始日期不能晚于结束日期'}
+        
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        time_format = '%Y-%m-%d %H:%M:%S'
+        is_success = {"$eq": ["$status", "已完成"]}
+        
+        pipeline = [
+            # submit_time 以 YYYY-MM-DD 开头，上界补最大字符使结束日期当天全部包含在内
+            {"$match": {
+                "submit_time": {"$gte": start_date, "$lte": end_date + '\uffff'},
+                "nickname": {"$nin": [None, ""]}
+            }},
+            {"$project": {
+                "nickname": 1,
+                "date": {"$substrCP": ["$submit_time", 0, 10]},
+                "submit_time": 1,
+                "id": 1,
+                "model_name": 1,
+                "is_success": {"$cond": [is_success, 1, 0]},
+                "prompt_length": {"$strLenCP": {"$ifNull": ["$prompt", ""]}},
+                # 只统计已完成任务的处理时长，时间格式不正确时为 null（$sum 会忽略）
+                "processing_minutes": {"$cond": [
+                    {"$and": [is_success, "$finish_time"]},
+                    {"$divide": [
+                        {"$subtract": [
+                            {"$dateFromString": {"dateString": "$finish_time", "format": time_format, "onError": None}},
+                            {"$dateFromString": {"dateString": "$submit_time", "format": time_format, "onError": None}}
+                        ]},
+                        60000
+                    ]},
+                    None
+                ]}
+            }},
+            {"$group": {
+                "_id": {"nickname": "$nickname", "date": "$date"},
+                "usage_count": {"$sum": 1},
+                "success_count": {"$sum": "$is_success"},
+                "first_usage_time": {"$min": "$submit_time"},
+                "last_usage_time": {"$max": "$submit_time"},
+                "video_ids": {"$push": "$id"},
+                "models_used": {"$addToSet": "$model_name"},
+                "processing_minutes_sum": {"$sum": "$processing_minutes"},
+                "processing_count": {"$sum": {"$cond": [{"$ne": [{"$type": "$processing_minutes"}, "null"]}, 1, 0]}},
+                "total_prompt_length": {"$sum": "$prompt_length"}
+            }},
+            {"$project": {
+                "_id": 0,
+                "unique_key": {"$concat": [{"$toString": "$_id.nickname"}, "_", "$_id.date"]},
+                "nickname": "$_id.nickname",
+                "date": "$_id.date",
+                "usage_count": 1,
+                "success_count": 1,
+                "fail_count": {"$subtract": ["$usage_count", "$success_count"]},
+                "first_usage_time": 1,
+                "last_usage_time": 1,
+                "video_ids": {"$filter": {"input": "$video_ids", "cond": "$$this"}},
+                "models_used": {"$filter": {"input": "$models_used", "cond": {"$and": ["$$this", {"$ne": ["$$this", ""]}]}}},
+                "avg_processing_minutes": {"$round": [{"$cond": [
+                    {"$gt": ["$processing_count", 0]},
+                    {"$divide": ["$processing_minutes_sum", "$processing_count"]},
+                    0
+                ]}, 2]},
+                "processing_minutes_sum": 1,
+                "processing_count": 1,
+                "total_prompt_length": 1,
+                "created_at": now,
+                "updated_at": now
+            }},
+            # 按 unique_key（唯一索引）写回，已存在的汇总整条替换但保留原 _id 和 created_at
+            {"$merge": {
+                "into": self.mycol_retention.name,
+                "on": "unique_key",
+                "whenMatched": [{"$replaceWith": {"$mergeObjects": [
+                    "$$new",
+                    {"_id": "$_id", "created_at": {"$ifNull": ["$created_at", "$$new.created_at"]}}
+                ]}}],
+                "whenNotMatched": "insert"
+            }}
+        ]
+        
+        try:
+            started = datetime.now()
+            # $merge 按 unique_key 写回，需要 INDEX_SPECS 中声明的唯一索引
+            ensure_collection_indexes(self.mycol_retention)
+            self.mycol_raw.aggregate(pipeline, allowDiskUse=True)
+            # 范围内的原始数据已全部计入重建后的汇总（包括已被认领、尚未合并完成的），不再需要采集时重新合并
+            self.mycol_raw.update_many(
+                {"submit_time": {"$gte": start_date, "$lte": end_date + '\uffff'}, "summarized": {"$ne": True}},
+                {"$set": {"summarized": True}, "$unset": {"summary_claimed_at": ""}}
+            )
+            elapsed = (datetime.now() - started).total_seconds()
+            
+            summary_count = self.mycol_retention.count_documents({
+                "date": {"$gte": start_date, "$lte": end_date},
+                "updated_at": now
+            })
+            print(f"重建用户日活跃: {start_date} 到 {end_date}, {summary_count} 条, 用时 {elapsed:.1f} 秒")
+            
+            return {
+                'success': True,
+                'message': f'已重建 {start_date} 到 {end_date} 的用户日活跃 {summary_count} 条',
+                'summary_count': summary_count,
+                'elapsed_seconds': round(elapsed, 2)
+            }
+            
+        except Exception as e:
+            print(f"重建用户日活跃失败: {e}")
+            return {'success': False, 'message': f'重建失败: {str(e)}'}
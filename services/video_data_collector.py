@@ -5,31 +5,135 @@
 集成video_processor_clean.py的功能，支持实时进度推送
 """
 
-from DrissionPage import Chromium
 import time
-import pymongo
-from datetime import datetime
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from datetime import datetime, timedelta
 from collections import defaultdict
-import gc
 import threading
 import queue
-import requests
 import os
 import signal
-import atexit
+import uuid
 import psutil
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from config.config import Config
+from utils.database import db
+from utils.http_client import get_shared_transport, loads_json
+from utils.field_extractor import FieldSpec, compile_extractor
+from utils.time_parser import timestamp_date, timestamp_seconds
+from utils.indexes import ensure_collection_indexes
+from services.token_provider import TokenProvider, build_auth_headers
+
+# 视频列表接口单条记录 -> 原始数据文档 的字段规格
+# 带 param 字典时才输出模型/生成参数/尺寸等字段，与接口返回的嵌套结构一一对应
+VIDEO_FIELDS = (
+    FieldSpec('id', ('id',)),
+    FieldSpec('prompt', ('prompt',), strip=True),
+    FieldSpec('nickname', ('nickname',)),
+    FieldSpec('status', ('status',)),
+    FieldSpec('gen_start_time', ('gen_start_time',)),
+    FieldSpec('submit_time', ('submit_time',)),
+    FieldSpec('finish_time', ('finish_time',)),
+    FieldSpec('deleted', ('deleted',)),
+    FieldSpec('endpoint', ('endpoint',)),
+    FieldSpec('model_name', ('param', 'param', 'model', 'model_name'), ('param', 'param', 'model')),
+    FieldSpec('model_id', ('param', 'param', 'model', 'id'), ('param', 'param', 'model')),
+    FieldSpec('model_type', ('param', 'param', 'model', 'type'), ('param', 'param', 'model')),
+    FieldSpec('model_describe', ('param', 'param', 'model', 'describe'), ('param', 'param', 'model')),
+    FieldSpec('gen_time', ('param', 'param', 'gen_time'), ('param', 'param')),
+    FieldSpec('input_image', ('param', 'param', 'input_image'), ('param', 'param')),
+    FieldSpec('file_name', ('param', 'param', 'fileName'), ('param', 'param')),
+    FieldSpec('picture_scale', ('param', 'param', 'pictureScale'), ('param', 'param')),
+    FieldSpec('scale_ratio', ('param', 'param', 'scale', 'scale'), ('param', 'param', 'scale')),
+    FieldSpec('scale_width', ('param', 'param', 'scale', 'scaleWidth'), ('param', 'param', 'scale')),
+    FieldSpec('scale_height', ('param', 'param', 'scale', 'scaleHeight'), ('param', 'param', 'scale')),
+    FieldSpec('tools_type', ('tools_type',), ('param',)),
+    FieldSpec('kind', ('kind',), ('param',)),
+)
+
+# 编译后的单条记录抽取函数：单次遍历、每条记录只创建一个字典
+extract_video_record = compile_extractor(VIDEO_FIELDS, 'extract_video_record')
+
+# MongoDB 唯一索引冲突的错误码
+DUPLICATE_KEY_ERROR = 11000
+
+# 多个采集任务并行时，浏览器登录共用调试端口，需要串行执行
+_browser_login_lock = threading.Lock()
+
+class StageStats:
+    """流水线单个阶段的吞吐统计"""
+
+    def __init__(self, name):
+        self.name = name
+        self.batches = 0
+        self.items = 0
+        self.busy_seconds = 0.0
+        self.started_at = time.time()
+
+    def record(self, items, seconds):
+        self.batches += 1
+        self.items += items
+        self.busy_seconds += seconds
+
+    def snapshot(self):
+        elapsed = max(time.time() - self.started_at, 1e-6)
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "items_per_second": round(self.items / elapsed, 1),
+            "busy_ratio": round(min(self.busy_seconds / elapsed, 1.0), 2)
+        }
 
 class VideoDataCollector:
-    def __init__(self, progress_callback=None, filter_start_date=None, filter_end_date=None):
+    def __init__(self, progress_callback=None, filter_start_date=None, filter_end_date=None, max_workers=8):
         self.progress_callback = progress_callback
         self.filter_start_date = filter_start_date
         self.filter_end_date = filter_end_date
+        # 并发获取页面的线程数（同时在途的请求数）
+        self.max_workers = max(1, int(max_workers or 1))
+        # 失败页面重新排队的轮数
+        self.page_requeue_rounds = 2
+        self.failed_pages = []
+        # 获取线程和写入线程都会记录失败页面
+        self._failed_pages_lock = threading.Lock()
+        # 增量采集的上次高水位线；本次运行是否已到达无需再获取的页面（已入库或早于日期范围）
+        self.watermark = None
+        self.reached_stop_page = False
+        self.stop_page = None
+        # 停止原因："watermark"（到达上次水位线）或 "date_range"（早于日期范围）
+        self.stop_reason = None
+        # 数据库中是否已有水位线（非增量运行也要读取，用于判断能否推进）
+        self.had_watermark = False
+        # 设置日期过滤时，二分定位出的页面窗口向后多取的页数（采集期间新数据会把旧数据往后推）
+        self.page_window_slack = 2
+        self.run_max_submit_time = None
+        self.run_max_id = None
+        # 原始数据入库后汇总合并失败（summarized=False）超过该分钟数，下次采集开始时重新合并
+        # 留出宽限期，避免把其他正在写入的任务尚未合并的记录重复计入
+        self.pending_summary_grace_minutes = 10
+        # 重新合并时认领的记录超过该分钟数仍未完成，视为认领的进程已退出，允许其他任务重新认领
+        self.summary_claim_timeout_minutes = 30
+        # 流水线各阶段之间的有界队列长度（以批次计）及运行统计
+        self.pipeline_queue_size = 2
+        self.pipeline_stats = {}
+        self.pipeline_queues = {}
+        # 进度输出节流：结构化进度事件合并后最多每秒发送一次，逐页/逐批的日志行按时间间隔抽样
+        self.progress_event_interval = 1.0
+        self.log_sample_interval = 2.0
+        self.phase = None
+        self.progress_state = {}
+        self._progress_lock = threading.Lock()
+        self._last_progress_event = 0
+        self._last_sampled_log = {}
+        self._suppressed_logs = defaultdict(int)
         self.init_config()
         self.init_mongodb()
         self.is_running = False
+        self.run_status = None
         self.browser_pid = None
-        # 注册退出清理函数
-        atexit.register(self.force_cleanup)
+        # 不在这里注册 atexit：每个任务一个实例，注册后实例（连同进度通道）在进程退出前都无法释放；
+        # 程序退出时由 CollectionJobManager.shutdown 对仍在运行的任务调用 force_cleanup
         
         # 如果设置了日期过滤，记录到日志
         if self.filter_start_date and self.filter_end_date:
@@ -37,6 +141,8 @@ class VideoDataCollector:
         
     def init_config(self):
         self.login_page = 'http://10.0.0.5:31611/login'
+        self.api_base_url = Config.VIDEO_API_BASE_URL
+        self.transport = get_shared_transport()
         self.browser = None
         self.tab = None
         self.is_connected = False
@@ -47,27 +153,143 @@ class VideoDataCollector:
     
     def init_mongodb(self):
         try:
-            self.myclient = pymongo.MongoClient("mongodb://localhost:27017/")
-            self.mydb = self.myclient["留存"]
+            # 共享进程级连接池，任务结束时不关闭
+            self.myclient = db.client
+            self.mydb = db.retention_db
             self.mycol_raw = self.mydb["原始数据"]
             self.mycol_retention = self.mydb["用户日活跃"]
+            self.mycol_state = self.mydb["采集状态"]
+            self.mycol_token = self.mydb["采集令牌"]
             self.send_progress("✅ MongoDB连接成功", "info")
         except Exception as e:
             self.send_progress(f"❌ MongoDB连接失败: {e}", "error")
             self.myclient = None
 
-    def send_progress(self, message, level="info"):
-        """发送进度信息"""
-        if self.progress_callback:
-            self.progress_callback({
-                'message': message,
-                'level': level,
-                'timestamp': datetime.now().strftime('%H:%M:%S')
-            })
+    def ensure_indexes(self):
+        """按 INDEX_SPECS 创建原始数据和用户日活跃的索引，含去重所需的唯一索引（已存在时为空操作）"""
+        for collection in (self.mycol_raw, self.mycol_retention):
+            try:
+                result = ensure_collection_indexes(collection)
+            except Exception as e:
+                self.send_progress(f"⚠️ 创建 {collection.name} 索引失败: {e}", "warning")
+                continue
+            for failure in result['failed']:
+                self.send_progress(f"⚠️ 创建索引 {failure['index']} 失败（唯一索引可能存在历史重复数据）: {failure['error']}", "warning")
+
+    def send_progress(self, message, level="info", sample=None):
+        """
+        发送进度信息
+        :param sample: 高频日志行的类别，同一类别每 log_sample_interval 秒只发送一条，被省略的条数附在下一条后面
+        """
+        if not self.progress_callback:
+            return
+
+        if sample:
+            with self._progress_lock:
+                now = time.time()
+                if now - self._last_sampled_log.get(sample, 0) < self.log_sample_interval:
+                    self._suppressed_logs[sample] += 1
+                    return
+                self._last_sampled_log[sample] = now
+                suppressed = self._suppressed_logs.pop(sample, 0)
+            if suppressed:
+                message = f"{message}（已省略 {suppressed} 条日志）"
+
+        self.progress_callback({
+            'message': message,
+            'level': level,
+            'timestamp': datetime.now().strftime('%H:%M:%S')
+        })
+
+    def set_phase(self, phase):
+        """切换采集阶段并立即发送一次进度事件"""
+        self.phase = phase
+        self.send_progress_event(force=True)
+
+    def advance_progress(self, key, amount=1):
+        """累加进度计数器，进度事件合并节流后发送"""
+        with self._progress_lock:
+            self.progress_state[key] = self.progress_state.get(key, 0) + amount
+        self.send_progress_event()
+
+    def send_progress_event(self, force=False):
+        """
+        发送结构化进度事件: 阶段、页数计数、累计统计和预计剩余时间
+        两次事件间隔小于 progress_event_interval 时直接丢弃（下一次事件会带上最新状态）
+        """
+        if not self.progress_callback:
+            return
+
+        now = time.time()
+        with self._progress_lock:
+            if not force and now - self._last_progress_event < self.progress_event_interval:
+                return
+            self._last_progress_event = now
+            state = dict(self.progress_state)
+
+        pages_total = state.get('pages_total', 0)
+        pages_done = state.get('pages_done', 0)
+        elapsed = now - state['start_time'] if state.get('start_time') else 0
+        eta = None
+        if self.phase == 'collecting' and 0 < pages_done < pages_total:
+            eta = round(elapsed / pages_done * (pages_total - pages_done))
+
+        self.progress_callback({
+            'type': 'progress',
+            'phase': self.phase,
+            'level': 'info',
+            'pages_total': pages_total,
+            'pages_fetched': state.get('pages_fetched', 0),
+            'pages_done': pages_done,
+            'percent': round(pages_done / pages_total * 100, 1) if pages_total else 0,
+            'elapsed_seconds': round(elapsed),
+            'eta_seconds': eta,
+            'counters': dict(state.get('counters') or {}),
+            'timestamp': datetime.now().strftime('%H:%M:%S')
+        })
+
+    def acquire_token(self, username='admin', password='admin@liandanxia'):
+        """获取 backserver-token：优先缓存令牌，其次接口登录，最后才启动浏览器"""
+        provider = TokenProvider(
+            token_collection=self.mycol_token if self.myclient else None,
+            progress_callback=self.send_progress,
+            api_base_url=self.api_base_url
+        )
+
+        def browser_login():
+            with _browser_login_lock:
+                # 等锁期间其他任务可能已经登录成功
+                token = provider.get_cached_token(username)
+                if token:
+                    return token
+                if not self.connect():
+                    return None
+                try:
+                    return self.backserver_token if self.login(username=username, password=password) else None
+                finally:
+                    # 拿到令牌后浏览器就不再需要，立即释放
+                    self.close_browser()
+                    self._force_kill_browser_processes(all_processes=False)
+
+        self.backserver_token = provider.get_token(username, password, browser_login=browser_login)
+        return bool(self.backserver_token)
+
+    def close_browser(self):
+        """关闭浏览器"""
+        if self.browser:
+            try:
+                self.browser.quit()
+                self.send_progress("🔧 浏览器已关闭", "info")
+            except:
+                pass
+            self.browser = None
+            self.tab = None
+            self.is_connected = False
 
     def connect(self, use_existing=False):
         try:
             self.send_progress("🔗 正在启动浏览器...", "info")
+            from DrissionPage import Chromium
             self.browser = Chromium()
             
             # 获取浏览器进程ID
@@ -151,7 +373,7 @@ class VideoDataCollector:
             self.send_progress("❌ 未获取到token", "error")
             return None
         
-        url = "https://tu.liandanxia.com/api/cms/task/video_list"
+        url = f"{self.api_base_url}/api/cms/task/video_list"
         params = {
             'page_number': page_number,
             'page_size': page_size,
@@ -159,17 +381,15 @@ class VideoDataCollector:
             'username': username
         }
         
-        headers = {
-            'Authorization': f'Bearer {self.backserver_token}',
-            'backserver-token': self.backserver_token,
-            'Content-Type': 'application/json',
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-        }
+        headers = build_auth_headers(self.backserver_token)
+        
+        def on_retry(attempt, delay, reason):
+            self.send_progress(f"🔁 第 {page_number} 页请求失败({reason})，{delay:.1f} 秒后第 {attempt} 次重试", "warning", sample="retry")
         
         try:
-            response = requests.get(url, params=params, headers=headers, timeout=30)
+            response = self.transport.get(url, params=params, headers=headers, on_retry=on_retry)
             if response.status_code == 200:
-                return response.json()
+                return loads_json(response.content)
             else:
                 self.send_progress(f"❌ 请求失败，状态码: {response.status_code}", "error")
                 return None
@@ -178,66 +398,23 @@ class VideoDataCollector:
             return None
 
     def extract_video_data(self, video_list_response):
+        """把接口响应中的视频列表解析为原始数据文档"""
         if not video_list_response or 'data' not in video_list_response:
             return []
         
-        data = video_list_response['data']
-        video_list = data.get('list', [])
-        extracted_data = []
-        
-        for video in video_list:
-            basic_info = {
-                'id': video.get('id'),
-                'prompt': video.get('prompt', '').strip(),
-                'nickname': video.get('nickname'),
-                'status': video.get('status'),
-                'gen_start_time': video.get('gen_start_time'),
-                'submit_time': video.get('submit_time'),
-                'finish_time': video.get('finish_time'),
-                'deleted': video.get('deleted'),
-                'endpoint': video.get('endpoint')
-            }
-            
-            param_info = {}
-            if 'param' in video and isinstance(video['param'], dict):
-                param = video['param']
-                
-                if 'param' in param and 'model' in param['param']:
-                    model = param['param']['model']
-                    param_info.update({
-                        'model_name': model.get('model_name'),
-                        'model_id': model.get('id'),
-                        'model_type': model.get('type'),
-                        'model_describe': model.get('describe')
-                    })
-                
-                if 'param' in param:
-                    inner_param = param['param']
-                    param_info.update({
-                        'gen_time': inner_param.get('gen_time'),
-                        'input_image': inner_param.get('input_image'),
-                        'file_name': inner_param.get('fileName'),
-                        'picture_scale': inner_param.get('pictureScale')
-                    })
-                    
-                    if 'scale' in inner_param:
-                        scale = inner_param['scale']
-                        param_info.update({
-                            'scale_ratio': scale.get('scale'),
-                            'scale_width': scale.get('scaleWidth'),
-                            'scale_height': scale.get('scaleHeight')
-                        })
-                
-                param_info['tools_type'] = video.get('tools_type')
-                param_info['kind'] = video.get('kind')
-            
-            video_data = {**basic_info, **param_info}
-            extracted_data.append(video_data)
-        
-        return extracted_data
+        return list(map(extract_video_record, video_list_response['data'].get('list') or []))
+
+    @staticmethod
+    def _submit_date(submit_time):
+        """从 submit_time 提取日期，格式不正确时返回 None"""
+        return timestamp_date(submit_time)
 
     def aggregate_user_daily_data(self, raw_records):
-        user_daily_groups = defaultdict(list)
+        """
+        按 用户+日期 汇总原始记录
+        单次遍历累计所有指标，每个时间戳只解析一次
+        """
+        groups = {}
         
         for record in raw_records:
             nickname = record.get('nickname')
@@ -246,304 +423,919 @@ class VideoDataCollector:
             if not nickname or not submit_time:
                 continue
             
-            try:
-                submit_date = datetime.strptime(submit_time, '%Y-%m-%d %H:%M:%S').strftime('%Y-%m-%d')
-            except:
+            submit_date = record.get('submit_date') or self._submit_date(submit_time)
+            if not submit_date:
                 continue
             
             record['submit_date'] = submit_date
             group_key = f"{nickname}_{submit_date}"
-            user_daily_groups[group_key].append(record)
-        
-        user_summaries = []
-        for group_key, records in user_daily_groups.items():
-            nickname = records[0]['nickname']
-            date = records[0]['submit_date']
+            group = groups.get(group_key)
+            if group is None:
+                group = groups[group_key] = {
+                    "nickname": nickname,
+                    "date": submit_date,
+                    "usage_count": 0,
+                    "success_count": 0,
+                    "first_usage_time": submit_time,
+                    "last_usage_time": submit_time,
+                    "video_ids": [],
+                    "models_used": set(),
+                    "processing_minutes_sum": 0,
+                    "processing_count": 0,
+                    "total_prompt_length": 0
+                }
             
-            usage_count = len(records)
-            success_count = len([r for r in records if r.get('status') == '已完成'])
-            fail_count = usage_count - success_count
+            group["usage_count"] += 1
+            if submit_time < group["first_usage_time"]:
+                group["first_usage_time"] = submit_time
+            elif submit_time > group["last_usage_time"]:
+                group["last_usage_time"] = submit_time
             
-            submit_times = [r['submit_time'] for r in records if r.get('submit_time')]
-            first_usage_time = min(submit_times) if submit_times else None
-            last_usage_time = max(submit_times) if submit_times else None
+            video_id = record.get('id')
+            if video_id:
+                group["video_ids"].append(video_id)
+            model_name = record.get('model_name')
+            if model_name:
+                group["models_used"].add(model_name)
+            group["total_prompt_length"] += len(record.get('prompt') or '')
             
-            video_ids = [r.get('id') for r in records if r.get('id')]
-            models_used = list(set([r.get('model_name') for r in records if r.get('model_name')]))
-            total_prompt_length = sum([len(r.get('prompt', '')) for r in records])
-            
-            processing_times = []
-            for record in records:
-                if record.get('submit_time') and record.get('finish_time') and record.get('status') == '已完成':
-                    try:
-                        submit_dt = datetime.strptime(record['submit_time'], '%Y-%m-%d %H:%M:%S')
-                        finish_dt = datetime.strptime(record['finish_time'], '%Y-%m-%d %H:%M:%S')
-                        processing_minutes = (finish_dt - submit_dt).total_seconds() / 60
-                        processing_times.append(processing_minutes)
-                    except:
-                        pass
-            
-            avg_processing_minutes = sum(processing_times) / len(processing_times) if processing_times else 0
+            if record.get('status') == '已完成':
+                group["success_count"] += 1
+                finish_time = record.get('finish_time')
+                if finish_time:
+                    submit_seconds = timestamp_seconds(submit_time)
+                    finish_seconds = timestamp_seconds(finish_time)
+                    if submit_seconds is not None and finish_seconds is not None:
+                        group["processing_minutes_sum"] += (finish_seconds - submit_seconds) / 60
+                        group["processing_count"] += 1
+        
+        created_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        user_summaries = []
+        for group_key, group in groups.items():
+            processing_count = group["processing_count"]
+            avg_processing_minutes = group["processing_minutes_sum"] / processing_count if processing_count else 0
             
-            summary = {
+            user_summaries.append({
                 "unique_key": group_key,
-                "nickname": nickname,
-                "date": date,
-                "usage_count": usage_count,
-                "success_count": success_count,
-                "fail_count": fail_count,
-                "first_usage_time": first_usage_time,
-                "last_usage_time": last_usage_time,
-                "video_ids": video_ids,
-                "models_used": models_used,
+                "nickname": group["nickname"],
+                "date": group["date"],
+                "usage_count": group["usage_count"],
+                "success_count": group["success_count"],
+                "fail_count": group["usage_count"] - group["success_count"],
+                "first_usage_time": group["first_usage_time"],
+                "last_usage_time": group["last_usage_time"],
+                "video_ids": group["video_ids"],
+                "models_used": list(group["models_used"]),
                 "avg_processing_minutes": round(avg_processing_minutes, 2),
-                "total_prompt_length": total_prompt_length,
-                "created_at": datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            }
-            
-            user_summaries.append(summary)
+                "processing_minutes_sum": group["processing_minutes_sum"],
+                "processing_count": processing_count,
+                "total_prompt_length": group["total_prompt_length"],
+                "created_at": created_at
+            })
         
         return user_summaries
 
-    def save_batch_to_mongodb(self, raw_records, user_summaries):
-        if not self.myclient:
-            self.send_progress("❌ MongoDB未连接", "error")
-            return {"raw_saved": 0, "summary_saved": 0}
+    def _bulk_insert_ignore(self, collection, key_field, documents):
+        """
+        按唯一键批量 upsert（仅在不存在时插入），代价只与批次大小相关
+        :return: 新插入文档在 documents 中的下标集合
+        """
+        operations = [
+            UpdateOne(
+                {key_field: doc[key_field]},
+                {"$setOnInsert": {k: v for k, v in doc.items() if k != key_field}},
+                upsert=True
+            )
+            for doc in documents
+        ]
+        if not operations:
+            return set()
+
+        try:
+            bulk_result = collection.bulk_write(operations, ordered=False)
+            return set(bulk_result.upserted_ids.keys())
+        except BulkWriteError as e:
+            # 并发写入同一键时可能触发唯一索引冲突（11000），冲突的文档视为已存在；
+            # 其他写入错误说明记录没有入库，必须向上抛出，不能算作跳过
+            other_errors = [error for error in e.details.get("writeErrors", []) if error.get("code") != DUPLICATE_KEY_ERROR]
+            if other_errors:
+                raise
+            return {item["index"] for item in e.details.get("upserted", [])}
+
+    def merge_user_summaries(self, user_summaries):
+        """
+        将本批次的用户日活跃汇总增量合并到数据库
+        计数用 $inc 累加，首末时间用 $min/$max，视频和模型用 $addToSet，
+        平均处理时长由累计的总时长和次数重新计算
+        :return: (新增条数, 合并到已有记录的条数)
+        """
+        if not user_summaries:
+            return 0, 0
+
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        operations = []
+        for summary in user_summaries:
+            update = {
+                "$inc": {
+                    "usage_count": summary["usage_count"],
+                    "success_count": summary["success_count"],
+                    "fail_count": summary["fail_count"],
+                    "total_prompt_length": summary["total_prompt_length"],
+                    "processing_minutes_sum": summary["processing_minutes_sum"],
+                    "processing_count": summary["processing_count"]
+                },
+                "$addToSet": {
+                    "video_ids": {"$each": summary["video_ids"]},
+                    "models_used": {"$each": summary["models_used"]}
+                },
+                "$setOnInsert": {
+                    "nickname": summary["nickname"],
+                    "date": summary["date"],
+                    "created_at": summary["created_at"]
+                },
+                "$set": {"updated_at": now}
+            }
+            if summary["first_usage_time"]:
+                update["$min"] = {"first_usage_time": summary["first_usage_time"]}
+            if summary["last_usage_time"]:
+                update["$max"] = {"last_usage_time": summary["last_usage_time"]}
+            operations.append(UpdateOne({"unique_key": summary["unique_key"]}, update, upsert=True))
 
-        result = {"raw_saved": 0, "summary_saved": 0, "raw_skipped": 0, "summary_skipped": 0, 
-                 "raw_filtered": 0, "summary_filtered": 0}
+        bulk_result = self.mycol_retention.bulk_write(operations, ordered=False)
+        self.refresh_avg_processing_minutes([summary["unique_key"] for summary in user_summaries])
 
+        return bulk_result.upserted_count, bulk_result.matched_count
+
+    def refresh_avg_processing_minutes(self, unique_keys):
+        """根据累计值重新计算指定汇总记录的平均处理时长"""
+        self.mycol_retention.update_many(
+            {"unique_key": {"$in": unique_keys}},
+            [{"$set": {"avg_processing_minutes": {"$round": [{"$cond": [
+                {"$gt": ["$processing_count", 0]},
+                {"$divide": ["$processing_minutes_sum", "$processing_count"]},
+                0
+            ]}, 2]}}}]
+        )
+
+    def _mark_summarized(self, record_ids):
+        """合并成功后标记原始数据已计入用户日活跃"""
+        if record_ids:
+            self.mycol_raw.update_many({"id": {"$in": record_ids}}, {"$set": {"summarized": True}})
+
+    def _claim_pending_summaries(self, claim_token, chunk_size):
+        """
+        认领一批待重新合并的原始数据：把 summarized 从 False 改成本次运行的认领标记
+        条件判断和修改在同一次 update 中逐条原子完成，同时开始的并行任务不会认领到同一条记录；
+        认领后超时仍未完成的记录（认领的进程已退出）可以被重新认领
+        :return: 本次认领到的记录；没有可认领的记录时返回 None
+        """
+        now = datetime.now()
+        cutoff = (now - timedelta(minutes=self.pending_summary_grace_minutes)).strftime('%Y-%m-%d %H:%M:%S')
+        stale_cutoff = (now - timedelta(minutes=self.summary_claim_timeout_minutes)).strftime('%Y-%m-%d %H:%M:%S')
+        claimable = {"$or": [
+            {"summarized": False, "collected_at": {"$lte": cutoff}},
+            {"summarized": {"$type": "string"}, "summary_claimed_at": {"$lte": stale_cutoff}},
+        ]}
+        record_ids = [record["id"] for record in self.mycol_raw.find(claimable, {"_id": 0, "id": 1}).limit(chunk_size)]
+        if not record_ids:
+            return None
+        self.mycol_raw.update_many(
+            {"$and": [{"id": {"$in": record_ids}}, claimable]},
+            {"$set": {"summarized": claim_token, "summary_claimed_at": now.strftime('%Y-%m-%d %H:%M:%S')}}
+        )
+        # 只读取确实由本次运行认领的记录，被其他任务抢先认领的不在其中
+        return list(self.mycol_raw.find({"summarized": claim_token}, {"_id": 0}))
+
+    def merge_pending_summaries(self, chunk_size=5000):
+        """
+        重新合并入库后未能计入汇总的原始数据（summarized=False）
+        上次运行在合并汇总前失败或进程退出时，这些记录已入库但还没有累加到用户日活跃，
+        增量采集不会再获取它们，只能在这里补上。记录先按批认领再合并，并行任务不会重复计入
+        :return: 重新合并的原始记录条数
+        """
+        claim_token = f"claim:{uuid.uuid4().hex}"
+        merged = 0
         try:
-            # 处理原始数据
-            if raw_records:
-                # 先应用日期过滤 - 原始数据使用 submit_time 字段
-                filtered_raw_records = self._filter_records_by_date(raw_records, "submit_time")
-                result["raw_filtered"] = len(raw_records) - len(filtered_raw_records)
-                
-                # 再过滤已存在的记录
-                existing_ids = set(self.mycol_raw.distinct("id"))
-                new_raw_records = [r for r in filtered_raw_records if r.get("id") not in existing_ids]
-                result["raw_skipped"] = len(filtered_raw_records) - len(new_raw_records)
-
-                if new_raw_records:
-                    insert_result = self.mycol_raw.insert_many(new_raw_records, ordered=False)
-                    result["raw_saved"] = len(insert_result.inserted_ids)
-                
-                # 显示详细统计信息
-                if result["raw_filtered"] > 0:
-                    self.send_progress(f"✅ 原始数据: 新增 {result['raw_saved']} 条，重复跳过 {result['raw_skipped']} 条，日期过滤 {result['raw_filtered']} 条", "success")
-                else:
-                    self.send_progress(f"✅ 原始数据: 新增 {result['raw_saved']} 条，跳过 {result['raw_skipped']} 条", "success")
+            while True:
+                records = self._claim_pending_summaries(claim_token, chunk_size)
+                if records is None:
+                    break
+                if not records:
+                    continue
+                self.merge_user_summaries(self.aggregate_user_daily_data(records))
+                self.mycol_raw.update_many(
+                    {"summarized": claim_token},
+                    {"$set": {"summarized": True}, "$unset": {"summary_claimed_at": ""}}
+                )
+                merged += len(records)
+        except Exception as e:
+            self.send_progress(f"⚠️ 重新合并未汇总的原始数据失败: {e}", "warning")
+            # 释放未完成的认领，下次采集开始时重新合并
+            try:
+                self.mycol_raw.update_many(
+                    {"summarized": claim_token},
+                    {"$set": {"summarized": False}, "$unset": {"summary_claimed_at": ""}}
+                )
+            except Exception:
+                pass
 
-            # 处理用户汇总数据
-            if user_summaries:
-                # 先应用日期过滤
-                filtered_summaries = self._filter_records_by_date(user_summaries, "date")
-                result["summary_filtered"] = len(user_summaries) - len(filtered_summaries)
-                
-                # 再过滤已存在的记录
-                existing_keys = set(self.mycol_retention.distinct("unique_key"))
-                new_summaries = [s for s in filtered_summaries if s.get("unique_key") not in existing_keys]
-                result["summary_skipped"] = len(filtered_summaries) - len(new_summaries)
-
-                if new_summaries:
-                    insert_result = self.mycol_retention.insert_many(new_summaries, ordered=False)
-                    result["summary_saved"] = len(insert_result.inserted_ids)
-                
-                # 显示详细统计信息
-                if result["summary_filtered"] > 0:
-                    self.send_progress(f"✅ 用户日活跃: 新增 {result['summary_saved']} 条，重复跳过 {result['summary_skipped']} 条，日期过滤 {result['summary_filtered']} 条", "success")
-                else:
-                    self.send_progress(f"✅ 用户日活跃: 新增 {result['summary_saved']} 条，跳过 {result['summary_skipped']} 条", "success")
+        if merged:
+            self.send_progress(f"🔁 已将 {merged} 条未汇总的原始数据重新合并到用户日活跃", "info")
+        return merged
+
+    def save_batch_to_mongodb(self, raw_records):
+        """
+        保存一批原始数据，并用其中新入库的记录增量更新用户日活跃
+        已存在的原始记录不会再次计入汇总，因此重复采集不会重复计数
+        新记录先以 summarized=False 入库，合并成功后才标记为已汇总；合并失败的记录由下次采集
+        开始时的 merge_pending_summaries 补上，也可以对相应日期范围执行重建
+        日期过滤已在解析前完成，这里不再过滤
+        :raises Exception: 原始数据写入失败（汇总合并失败不抛出，记在 summary_pending 中）
+        """
+        if not self.myclient:
+            raise RuntimeError("MongoDB未连接")
+
+        result = {"raw_saved": 0, "summary_saved": 0, "raw_skipped": 0, "summary_merged": 0, "summary_pending": 0}
 
-            return result
+        try:
+            if not raw_records:
+                return result
+
+            # 按 id 唯一索引插入，已存在的记录自动跳过
+            collected_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            keyed_raw_records = [r for r in raw_records if r.get("id") is not None]
+            for record in keyed_raw_records:
+                submit_date = self._submit_date(record.get("submit_time"))
+                if submit_date:
+                    record["submit_date"] = submit_date
+                record["summarized"] = False
+                record["collected_at"] = collected_at
+            inserted = self._bulk_insert_ignore(self.mycol_raw, "id", keyed_raw_records)
+            result["raw_saved"] = len(inserted)
+            result["raw_skipped"] = len(raw_records) - len(inserted)
+            
+            self.send_progress(f"✅ 原始数据: 新增 {result['raw_saved']} 条，跳过 {result['raw_skipped']} 条", "success", sample="raw_saved")
 
         except Exception as e:
+            # 原始数据写入失败必须让调用方知道，由其把这批页面记为失败
             self.send_progress(f"❌ 保存到MongoDB失败: {e}", "error")
-            return result
+            raise
+
+        # 只用新入库的记录更新用户日活跃汇总
+        new_raw_records = [keyed_raw_records[i] for i in sorted(inserted)]
+        try:
+            user_summaries = self.aggregate_user_daily_data(new_raw_records)
+            if user_summaries:
+                result["summary_saved"], result["summary_merged"] = self.merge_user_summaries(user_summaries)
+                self.send_progress(f"✅ 用户日活跃: 新增 {result['summary_saved']} 条，合并更新 {result['summary_merged']} 条", "success", sample="summary_saved")
+            self._mark_summarized([record["id"] for record in new_raw_records])
+        except Exception as e:
+            result["summary_pending"] = len(new_raw_records)
+            self.send_progress(
+                f"❌ 用户日活跃合并失败，{len(new_raw_records)} 条原始数据尚未汇总，"
+                f"将在下次采集开始时重新合并（也可对该日期范围执行重建）: {e}", "error"
+            )
+
+        return result
     
-    def _filter_records_by_date(self, records, date_field):
-        """根据日期范围过滤记录"""
+    def _filter_records_by_date(self, records, date_field="submit_time"):
+        """
+        按日期范围过滤记录（包含边界），缺少日期字段的记录会被过滤掉
+        时间字段都是以 YYYY-MM-DD 开头的字符串，直接和预先算好的上下界整体比较，不逐条截取日期
+        """
         if not self.filter_start_date or not self.filter_end_date or not records:
             return records
-        
+
+        # 上界补一个最大字符，使结束日期当天的任意时间都落在范围内
+        lower = self.filter_start_date
+        upper = self.filter_end_date + '\uffff'
+        return [
+            record for record in records
+            if isinstance(value := record.get(date_field), str) and lower <= value <= upper
+        ]
+
+    def load_watermark(self):
+        """读取上次完整采集记录的高水位线"""
+        if not self.myclient:
+            return None
         try:
-            filtered_records = []
-            
-            # 调试信息：记录过滤设置
-            self.send_progress(f"🔍 开始日期过滤: 范围 {self.filter_start_date} 到 {self.filter_end_date} (包含边界)", "info")
-            
-            for i, record in enumerate(records):
-                record_date = record.get(date_field)
-                if record_date:
-                    # 根据字段类型处理日期
-                    if date_field == "submit_time":
-                        # submit_time 是完整时间戳，需要提取日期部分
-                        try:
-                            if isinstance(record_date, str) and len(record_date) >= 10:
-                                record_date_str = record_date[:10]  # YYYY-MM-DD
-                            else:
-                                record_date_str = str(record_date)[:10]
-                        except:
-                            # 如果提取失败，跳过这条记录
-                            if i < 3:
-                                self.send_progress(f"🔍 记录 {i+1} 日期格式错误: '{record_date}'", "warning")
-                            continue
-                    else:
-                        # date 字段已经是日期格式
-                        if isinstance(record_date, str):
-                            record_date_str = record_date[:10]  # 取前10位 YYYY-MM-DD
-                        else:
-                            record_date_str = str(record_date)[:10]
-                    
-                    # 调试信息：显示前几条记录的日期格式
-                    if i < 3:
-                        self.send_progress(f"🔍 记录 {i+1} 日期: 字段='{date_field}', 原始='{record_date}', 处理后='{record_date_str}'", "info")
-                    
-                    # 判断是否在日期范围内 (包含边界)
-                    if self.filter_start_date <= record_date_str <= self.filter_end_date:
-                        filtered_records.append(record)
-                        if i < 3:
-                            self.send_progress(f"🔍 记录 {i+1} 通过过滤: '{record_date_str}' 在范围内", "info")
-                    elif i < 3:
-                        # 显示为什么被过滤的原因
-                        self.send_progress(f"🔍 记录 {i+1} 被过滤: '{record_date_str}' 不在 [{self.filter_start_date}, {self.filter_end_date}] 范围内", "info")
-                else:
-                    # 没有日期字段的记录
-                    if i < 3:
-                        self.send_progress(f"🔍 记录 {i+1} 被过滤: 缺少日期字段 '{date_field}'", "warning")
-            
-            # 调试信息：过滤结果统计
-            self.send_progress(f"🔍 过滤结果: 总数 {len(records)}, 保留 {len(filtered_records)}, 过滤 {len(records) - len(filtered_records)}", "info")
-            
-            return filtered_records
-            
+            return self.mycol_state.find_one({"_id": "video_list"})
         except Exception as e:
-            self.send_progress(f"⚠️ 日期过滤失败: {e}，将保存所有数据", "warning")
-            return records
+            self.send_progress(f"⚠️ 读取增量水位线失败: {e}", "warning")
+            return None
 
-    def fetch_batch_pages(self, start_page, end_page):
-        batch_raw_data = []
+    def save_watermark(self):
+        """保存本次运行看到的最大 submit_time 和 id 作为新的高水位线"""
+        if not self.myclient or not self.run_max_submit_time:
+            return
+        try:
+            new_marks = {"max_submit_time": self.run_max_submit_time}
+            if self.run_max_id is not None:
+                new_marks["max_id"] = self.run_max_id
+            self.mycol_state.update_one(
+                {"_id": "video_list"},
+                {"$max": new_marks, "$set": {"updated_at": datetime.now().strftime('%Y-%m-%d %H:%M:%S')}},
+                upsert=True
+            )
+            self.send_progress(f"💾 增量水位线已更新: {self.run_max_submit_time}", "info")
+        except Exception as e:
+            self.send_progress(f"⚠️ 保存增量水位线失败: {e}", "warning")
 
-        for page in range(start_page, end_page + 1):
-            # 在每个页面获取前检查停止状态
-            if not self.is_running:
-                self.send_progress("❌ 数据获取已停止", "warning")
-                break
-                
-            try:
-                self.send_progress(f"🔄 正在获取第 {page} 页数据...", "info")
-                page_response = self.get_video_list(page_number=page, page_size=100)
+    def should_advance_watermark(self, start_page):
+        """
+        是否推进水位线：必须从第1页完整跑完（未停止、无失败页、未按日期过滤），并且
+        本次一直采集到了上次水位线（与已入库数据连续），或者之前还没有水位线。
+        没衔接上旧水位线时推进会让两者之间的数据在以后的增量采集中被永久跳过
+        """
+        if not self.is_running or start_page != 1 or self.failed_pages:
+            return False
+        if self.filter_start_date and self.filter_end_date:
+            return False
+        return self.stop_reason == "watermark" or not self.had_watermark
+
+    def _is_known_page(self, page_records):
+        """页面中的记录是否全部早于水位线（即已入库）"""
+        if not self.watermark or not page_records:
+            return False
+        max_submit_time = self.watermark.get("max_submit_time")
+        if not max_submit_time:
+            return False
+        return all(r.get("submit_time") and r["submit_time"] <= max_submit_time for r in page_records)
+
+    def _is_before_date_range(self, page_records):
+        """页面中的记录是否全部早于日期过滤的开始日期（列表按提交时间倒序，之后的页面只会更早）"""
+        if not self.filter_start_date or not self.filter_end_date or not page_records:
+            return False
+        return all(r.get("submit_time") and r["submit_time"] < self.filter_start_date for r in page_records)
+
+    def _stop_reason(self, page_records):
+        """判断该页之后的页面是否都不需要获取，返回原因或 None"""
+        if self._is_known_page(page_records):
+            return "watermark"
+        if self._is_before_date_range(page_records):
+            return "date_range"
+        return None
+
+    def _track_run_max(self, page_records):
+        """记录本次运行看到的最大 submit_time 和 id"""
+        for record in page_records:
+            submit_time = record.get("submit_time")
+            if submit_time and (self.run_max_submit_time is None or submit_time > self.run_max_submit_time):
+                self.run_max_submit_time = submit_time
+            record_id = record.get("id")
+            if isinstance(record_id, int) and (self.run_max_id is None or record_id > self.run_max_id):
+                self.run_max_id = record_id
+
+    @staticmethod
+    def _page_items(page_response):
+        """取出接口响应中的视频列表"""
+        if not page_response:
+            return []
+        return (page_response.get('data') or {}).get('list') or []
 
-                if page_response and 'data' in page_response:
-                    page_extracted = self.extract_video_data(page_response)
-                    batch_raw_data.extend(page_extracted)
-                    self.send_progress(f"✅ 第 {page} 页: 获取 {len(page_extracted)} 条记录", "success")
+    def fetch_page(self, page):
+        """获取单个页面的接口响应（在线程池中执行）"""
+        if not self.is_running:
+            return None
+
+        page_response = self.get_video_list(page_number=page, page_size=100)
+
+        if page_response is None:
+            raise RuntimeError("接口请求失败")
+
+        self.advance_progress('pages_fetched')
+        if 'data' in page_response:
+            # 只保留视频列表，响应中的其他内容不随批次在流水线中驻留
+            items = self._page_items(page_response)
+            self.send_progress(f"✅ 第 {page} 页: 获取 {len(items)} 条记录", "success", sample="page")
+            return {'data': {'list': items}}
+
+        self.send_progress(f"⚠️ 第 {page} 页: 无数据", "warning")
+        return {}
+
+    def _probe_page(self, page):
+        """获取单页，返回该页 (最新 submit_time, 最早 submit_time)，页面无数据时返回 None"""
+        page_response = self.get_video_list(page_number=page, page_size=100)
+        if page_response is None:
+            raise RuntimeError(f"第 {page} 页请求失败")
+        submit_times = [r["submit_time"] for r in self._page_items(page_response) if r.get("submit_time")]
+        if not submit_times:
+            return None
+        return max(submit_times), min(submit_times)
+
+    def locate_page_window(self, total_pages):
+        """
+        在按提交时间倒序的列表中二分查找日期范围所在的页面窗口
+        :return: ((起始页, 结束页), 探测页数)；前 total_pages 页中没有该范围的数据时窗口为 None
+        """
+        lower = self.filter_start_date
+        upper = self.filter_end_date + '\uffff'
+        probes = {}
+
+        def probe(page):
+            if page not in probes:
+                probes[page] = self._probe_page(page)
+            return probes[page]
+
+        # 起始页：第一个最早记录不晚于结束日期的页面（空页面在数据末尾之后，视为更早）
+        first_page = None
+        low, high = 1, total_pages
+        while low <= high:
+            mid = (low + high) // 2
+            bounds = probe(mid)
+            if bounds is None or bounds[1] <= upper:
+                first_page = mid
+                high = mid - 1
+            else:
+                low = mid + 1
+
+        if first_page is None:
+            return None, len(probes)
+
+        # 结束页：最后一个最新记录不早于开始日期的页面
+        last_page = None
+        low, high = first_page, total_pages
+        while low <= high:
+            mid = (low + high) // 2
+            bounds = probe(mid)
+            if bounds is not None and bounds[0] >= lower:
+                last_page = mid
+                low = mid + 1
+            else:
+                high = mid - 1
+
+        if last_page is None:
+            return None, len(probes)
+        return (first_page, last_page), len(probes)
+
+    def narrow_to_date_window(self, start_page, total_pages):
+        """
+        把采集页码范围缩小到日期范围所在的页面窗口，返回新的 (起始页, 结束页)
+        定位失败时保持原范围，仍可依靠"早于日期范围即停止"提前结束
+        """
+        try:
+            window, probe_count = self.locate_page_window(total_pages)
+        except Exception as e:
+            self.send_progress(f"⚠️ 定位日期范围所在页面失败: {e}，按原页码范围获取", "warning")
+            return start_page, total_pages
+
+        if window is None:
+            self.send_progress(f"🔎 前 {total_pages} 页中没有 {self.filter_start_date} 到 {self.filter_end_date} 的数据（探测 {probe_count} 页）", "warning")
+            return start_page, start_page - 1
+
+        first_page, last_page = window
+        new_start_page = max(start_page, first_page)
+        new_total_pages = min(total_pages, last_page + self.page_window_slack)
+        self.send_progress(
+            f"🔎 日期范围位于第 {first_page} - {last_page} 页（探测 {probe_count} 页），"
+            f"只获取第 {new_start_page} - {new_total_pages} 页",
+            "info"
+        )
+        return new_start_page, new_total_pages
+
+    def _fetch_pages(self, pages):
+        """并发获取指定页面，返回 (页码->接口响应 字典, 失败页码列表)"""
+        page_results = {}
+        failed = []
+        stopped = False
+        known_page = None
+        known_reason = None
+
+        executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='video-fetch')
+        try:
+            futures = {executor.submit(self.fetch_page, page): page for page in pages}
+
+            for future in as_completed(futures):
+                page = futures[future]
+                if future.cancelled():
+                    continue
+                try:
+                    page_response = future.result()
+                    if page_response is not None:
+                        page_results[page] = page_response
+                        # 遇到已入库或早于日期范围的页面后，更靠后的页面都不再需要
+                        stop_reason = self._stop_reason(self._page_items(page_response))
+                        if stop_reason and (known_page is None or page < known_page):
+                            known_page, known_reason = page, stop_reason
+                            for pending, pending_page in futures.items():
+                                if pending_page > page:
+                                    pending.cancel()
+                except Exception as e:
+                    self.send_progress(f"❌ 第 {page} 页获取失败: {e}", "error")
+                    failed.append(page)
+
+                # 收到停止指令后取消尚未开始的页面请求
+                if not self.is_running and not stopped:
+                    stopped = True
+                    self.send_progress("❌ 数据获取已停止", "warning")
+                    for pending in futures:
+                        pending.cancel()
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+        if known_page is not None:
+            page_results = {page: response for page, response in page_results.items() if page < known_page}
+            failed = [page for page in failed if page < known_page]
+            if not self.reached_stop_page:
+                self.reached_stop_page = True
+                self.stop_page = known_page
+                self.stop_reason = known_reason
+                if known_reason == "watermark":
+                    self.send_progress(f"🛑 第 {known_page} 页已全部入库，增量采集到此为止", "info")
                 else:
-                    self.send_progress(f"⚠️ 第 {page} 页: 无数据", "warning")
-                
-                # 在页面间添加短暂延时，让停止检查有机会生效
-                time.sleep(0.1)
+                    self.send_progress(f"🛑 第 {known_page} 页已早于日期范围，后续页面不再获取", "info")
 
-            except Exception as e:
-                self.send_progress(f"❌ 第 {page} 页获取失败: {e}", "error")
+        return page_results, sorted(failed)
+
+    def _add_failed_pages(self, pages):
+        """记录失败页面（去重），检查点会保存它们供恢复时重新获取，有失败页面时不推进水位线"""
+        with self._failed_pages_lock:
+            known = set(self.failed_pages)
+            self.failed_pages.extend(page for page in pages if page not in known)
+
+    def failed_pages_snapshot(self):
+        """当前失败页面的有序副本（写入线程保存检查点时使用）"""
+        with self._failed_pages_lock:
+            return sorted(self.failed_pages)
+
+    def fetch_batch_responses(self, start_page, end_page):
+        """并发获取一批页面，失败页面重新排队，返回 页码->接口响应 字典"""
+        return self.fetch_pages_with_requeue(range(start_page, end_page + 1))[0]
+
+    def fetch_pages_with_requeue(self, pages):
+        """
+        并发获取指定页面，失败页面重新排队，仍失败的记入 failed_pages
+        :return: (页码->接口响应 字典, 本次仍失败的页码列表)
+        """
+        page_results, failed = self._fetch_pages(pages)
+
+        for round_num in range(1, self.page_requeue_rounds + 1):
+            if not failed or not self.is_running:
+                break
+            self.send_progress(f"🔁 第 {round_num} 轮重新获取失败页面: {failed}", "warning")
+            retried_results, failed = self._fetch_pages(failed)
+            page_results.update(retried_results)
+
+        if failed:
+            self._add_failed_pages(failed)
+            self.send_progress(f"❌ 以下页面多次重试后仍失败: {failed}", "error")
+
+        for page in sorted(page_results):
+            self._track_run_max(self._page_items(page_results[page]))
+
+        return page_results, failed
+
+    def extract_batch(self, page_responses):
+        """按页码顺序解析一批接口响应"""
+        return self._extract_filtered_batch(page_responses)[0]
+
+    def _extract_filtered_batch(self, page_responses):
+        """
+        按页码顺序解析一批接口响应，解析前先按日期范围过滤接口返回的视频列表，
+        范围外的记录不再经过解析和汇总
+        :return: (原始记录列表, 日期过滤掉的条数)
+        """
+        batch_raw_data = []
+        filtered = 0
+        for page in sorted(page_responses):
+            items = self._page_items(page_responses[page])
+            kept = self._filter_records_by_date(items, "submit_time")
+            filtered += len(items) - len(kept)
+            batch_raw_data.extend(map(extract_video_record, kept))
+        return batch_raw_data, filtered
+
+    def fetch_batch_pages(self, start_page, end_page):
+        """并发获取并解析一批页面，结果按页码顺序合并"""
+        return self.extract_batch(self.fetch_batch_responses(start_page, end_page))
+
+    def _fetch_stage(self, batches, output_queue):
+        """流水线第一段：按批次并发获取页面"""
+        stage = self.pipeline_stats["fetch"]
+        try:
+            for batch_num, batch_start_page, batch_end_page in batches:
+                if not self.is_running:
+                    self.send_progress("❌ 数据获取已停止", "warning")
+                    break
+                if self.reached_stop_page:
+                    break
+
+                self.send_progress(f"📦 获取批次 {batch_num}/{len(batches)}: 第 {batch_start_page} - {batch_end_page} 页", "info", sample="batch")
+
+                started = time.time()
+                page_responses, failed = self.fetch_pages_with_requeue(range(batch_start_page, batch_end_page + 1))
+                batch_failed = len(failed)
+                if self.reached_stop_page:
+                    batch_end_page = max(batch_start_page - 1, self.stop_page - 1)
+                if not self.is_running:
+                    # 中途停止：只保留从批次开头连续获取成功的页面，检查点不越过未获取的页面
+                    last_page = batch_start_page - 1
+                    while last_page + 1 in page_responses:
+                        last_page += 1
+                    page_responses = {page: response for page, response in page_responses.items() if page <= last_page}
+                    batch_end_page = min(batch_end_page, last_page)
+                    batch_failed = 0
+                stage.record(len(page_responses), time.time() - started)
+
+                # 队列有界：下游处理不过来时在此等待
+                output_queue.put((batch_num, batch_start_page, batch_end_page, batch_failed, page_responses))
+        except Exception as e:
+            self.send_progress(f"❌ 页面获取异常: {e}", "error")
+        finally:
+            output_queue.put(None)
+
+    def _extract_stage(self, input_queue, output_queue):
+        """流水线第二段：解析接口响应为原始记录"""
+        stage = self.pipeline_stats["extract"]
+        try:
+            while True:
+                item = input_queue.get()
+                if item is None:
+                    break
+
+                batch_num, batch_start_page, batch_end_page, batch_failed, page_responses = item
+                started = time.time()
+                try:
+                    batch_raw_data, batch_filtered = self._extract_filtered_batch(page_responses)
+                except Exception as e:
+                    self.send_progress(f"❌ 批次 {batch_num} 解析失败: {e}", "error")
+                    batch_raw_data, batch_filtered = None, 0
+                del item, page_responses
+                stage.record(len(batch_raw_data or []), time.time() - started)
+
+                output_queue.put((batch_num, batch_start_page, batch_end_page, batch_failed, batch_filtered, batch_raw_data))
+        finally:
+            output_queue.put(None)
+
+    def recollect_failed_pages(self, pages, total_stats):
+        """
+        恢复任务时重新获取上次失败的页面
+        这些页面在检查点之前，从 last_completed_page+1 继续的批次不会覆盖它们；
+        本次仍然失败（或因停止未获取）的页面留在 failed_pages 中，随检查点再次保存
+        """
+        pages = sorted(set(pages))
+        self.send_progress(f"🔁 重新获取上次失败的 {len(pages)} 个页面: {pages}", "info")
+
+        page_responses, failed = self.fetch_pages_with_requeue(pages)
+        retried_failed = set(failed)
+
+        try:
+            batch_raw_data, batch_filtered = self._extract_filtered_batch(page_responses)
+            total_stats["total_raw_filtered"] += batch_filtered
+            if batch_raw_data:
+                self._add_save_result(total_stats, self.save_batch_to_mongodb(batch_raw_data))
+            total_stats["processed_pages"] += len(page_responses)
+        except Exception as e:
+            self.send_progress(f"❌ 失败页面重新采集失败: {e}", "error")
+            retried_failed.update(page_responses)
+
+        # 到达停止页之后的页面无需再获取，其余未取到的页面仍算失败
+        for page in pages:
+            if page in page_responses or page in retried_failed:
                 continue
+            if not (self.reached_stop_page and page >= self.stop_page):
+                retried_failed.add(page)
+        self._add_failed_pages(sorted(retried_failed))
+        self.advance_progress('pages_done', len(pages))
+
+        recovered = len(pages) - len(retried_failed)
+        total_stats["failed_pages"] = max(0, total_stats["failed_pages"] - recovered)
+        self.send_progress(f"✅ 上次失败的页面已补采 {recovered} 页，仍失败 {len(retried_failed)} 页", "success")
+
+    @staticmethod
+    def _add_save_result(total_stats, save_result):
+        """把一批写入结果累加到总统计"""
+        total_stats["total_raw_saved"] += save_result["raw_saved"]
+        total_stats["total_summary_saved"] += save_result["summary_saved"]
+        total_stats["total_raw_skipped"] += save_result["raw_skipped"]
+        total_stats["total_summary_merged"] += save_result.get("summary_merged", 0)
+        total_stats["total_summary_pending"] = total_stats.get("total_summary_pending", 0) + save_result.get("summary_pending", 0)
+
+    def _write_batch(self, batch_num, batch_start_page, batch_end_page, batch_failed, batch_filtered, batch_raw_data,
+                     total_batches, start_time, total_stats):
+        """写入一个批次并累计统计"""
+        stage = self.pipeline_stats["write"]
+        batch_pages = batch_end_page - batch_start_page + 1
+        total_stats["failed_pages"] += batch_failed
+        total_stats["total_raw_filtered"] += batch_filtered
+        self.advance_progress('pages_done', batch_pages)
+
+        if batch_raw_data is None:
+            # 解析失败：页面没有入库，记为失败页面，检查点越过这批页面后恢复时仍会重新获取
+            total_stats["failed_pages"] += batch_pages - batch_failed
+            self._add_failed_pages(range(batch_start_page, batch_end_page + 1))
+            return
+
+        if not batch_raw_data:
+            if batch_filtered:
+                # 整批都不在日期范围内
+                total_stats["processed_pages"] += batch_pages - batch_failed
+            else:
+                self.send_progress("⚠️ 当前批次无数据", "warning")
+            return
+
+        self.send_progress(f"📊 批次原始数据: {len(batch_raw_data)} 条记录", "info", sample="batch_data")
+
+        started = time.time()
+        try:
+            self._add_save_result(total_stats, self.save_batch_to_mongodb(batch_raw_data))
+            total_stats["processed_pages"] += batch_pages - batch_failed
+
+            stage.record(len(batch_raw_data), time.time() - started)
+            self.show_progress(batch_num, total_batches, start_time, total_stats)
 
-        return batch_raw_data
+        except Exception as e:
+            # 原始数据没有写入：整批页面记为失败，检查点会保存它们，水位线也不会越过这批数据
+            self.send_progress(f"❌ 批次 {batch_num} 处理失败: {e}", "error")
+            total_stats["failed_pages"] += batch_pages - batch_failed
+            self._add_failed_pages(range(batch_start_page, batch_end_page + 1))
+
+    def _write_stage(self, input_queue, total_batches, start_time, total_stats, checkpoint_callback=None):
+        """流水线第三段：写入原始数据并合并用户日活跃，每批完成后保存检查点"""
+        while True:
+            item = input_queue.get()
+            if item is None:
+                break
+
+            batch_num, batch_start_page, batch_end_page, batch_failed, batch_filtered, batch_raw_data = item
+            del item
+            self._write_batch(batch_num, batch_start_page, batch_end_page, batch_failed, batch_filtered, batch_raw_data,
+                              total_batches, start_time, total_stats)
+            del batch_raw_data
+
+            if checkpoint_callback:
+                try:
+                    checkpoint_callback(batch_end_page, total_stats, self.failed_pages_snapshot())
+                except Exception as e:
+                    self.send_progress(f"⚠️ 保存检查点失败: {e}", "warning")
+
+    def get_pipeline_stats(self):
+        """返回流水线各阶段的吞吐量和队列深度"""
+        return {
+            "stages": {name: stage.snapshot() for name, stage in self.pipeline_stats.items()},
+            "queue_depth": {name: q.qsize() for name, q in self.pipeline_queues.items()}
+        }
 
-    def start_data_collection(self, total_pages=500, batch_size=20):
-        """启动数据采集过程"""
+    def start_data_collection(self, total_pages=500, batch_size=20, incremental=False,
+                              start_page=1, initial_stats=None, checkpoint_callback=None, retry_pages=None):
+        """
+        启动数据采集过程
+        获取、解析、写入三个阶段通过有界队列组成流水线，网络和数据库同时保持忙碌
+        :param incremental: 增量模式，遇到早于上次高水位线的页面即停止
+        :param start_page: 起始页码，从检查点恢复时大于1
+        :param initial_stats: 恢复时沿用的累计统计
+        :param retry_pages: 恢复时检查点中记录的失败页面，在继续后续页面之前先重新获取
+        :param checkpoint_callback: 每批写入后调用 checkpoint_callback(最后完成页码, 累计统计, 失败页面)
+        """
         self.is_running = True
+        self.run_status = "running"
         
         try:
             if not self.myclient:
                 self.send_progress("❌ MongoDB未连接", "error")
+                self.run_status = "failed"
+                self.is_running = False
                 return False
 
+            self.ensure_indexes()
+            self.merge_pending_summaries()
+
             self.send_progress("🚀 开始批量处理视频数据", "info")
-            self.send_progress(f"📊 总页数: {total_pages}, 批次大小: {batch_size}页/批", "info")
-            self.send_progress(f"⏱️ 预计处理时间: {(total_pages * 2 / 60):.1f} 分钟", "info")
+            self.send_progress(f"📊 总页数: {total_pages}, 批次大小: {batch_size}页/批, 并发数: {self.max_workers}", "info")
+            self.send_progress(f"⏱️ 预计处理时间: {(total_pages * 2 / 60 / self.max_workers):.1f} 分钟", "info")
 
             start_time = time.time()
-            total_batches = (total_pages + batch_size - 1) // batch_size
+            self.failed_pages = []
+            self.reached_stop_page = False
+            self.stop_page = None
+            self.stop_reason = None
+            self.run_max_submit_time = None
+            self.run_max_id = None
+            existing_watermark = self.load_watermark()
+            self.had_watermark = bool(existing_watermark and existing_watermark.get("max_submit_time"))
+            self.watermark = existing_watermark if incremental else None
+
+            if incremental:
+                if self.watermark:
+                    self.send_progress(f"📌 增量模式: 上次水位线 {self.watermark.get('max_submit_time')}", "info")
+                else:
+                    self.send_progress("📌 增量模式: 尚无水位线，本次执行完整采集", "info")
+
+            if start_page > 1:
+                self.send_progress(f"⏩ 从第 {start_page} 页继续采集", "info")
+            checkpoint_page = start_page - 1
+
+            # 设置了日期过滤时先定位日期范围所在的页面窗口，只获取窗口内的页面
+            if self.filter_start_date and self.filter_end_date:
+                start_page, total_pages = self.narrow_to_date_window(start_page, total_pages)
+
+            batches = [
+                (batch_num, batch_start_page, min(batch_start_page + batch_size - 1, total_pages))
+                for batch_num, batch_start_page in enumerate(range(start_page, total_pages + 1, batch_size), 1)
+            ]
+            total_batches = len(batches)
 
             total_stats = {
                 "total_raw_saved": 0,
                 "total_summary_saved": 0,
                 "total_raw_skipped": 0,
-                "total_summary_skipped": 0,
+                "total_summary_merged": 0,
+                "total_summary_pending": 0,
                 "total_raw_filtered": 0,
-                "total_summary_filtered": 0,
                 "processed_pages": 0,
                 "failed_pages": 0
             }
+            total_stats.update(initial_stats or {})
+            with self._progress_lock:
+                self.progress_state = {
+                    "start_time": start_time,
+                    "pages_total": max(0, total_pages - start_page + 1) + len(set(retry_pages or ())),
+                    "pages_fetched": 0,
+                    "pages_done": 0,
+                    "counters": total_stats
+                }
+            self.set_phase("collecting")
 
-            for batch_num in range(1, total_batches + 1):
-                if not self.is_running:
-                    self.send_progress("❌ 数据获取已停止", "warning")
-                    break
-                    
-                batch_start_page = (batch_num - 1) * batch_size + 1
-                batch_end_page = min(batch_num * batch_size, total_pages)
-
-                self.send_progress(f"📦 处理批次 {batch_num}/{total_batches}", "info")
-                self.send_progress(f"📄 页面范围: {batch_start_page} - {batch_end_page}", "info")
-
-                try:
-                    batch_raw_data = self.fetch_batch_pages(batch_start_page, batch_end_page)
-
-                    if not batch_raw_data:
-                        self.send_progress("⚠️ 当前批次无数据", "warning")
-                        continue
-
-                    self.send_progress(f"📊 批次原始数据: {len(batch_raw_data)} 条记录", "info")
-
-                    user_summaries = self.aggregate_user_daily_data(batch_raw_data)
-                    self.send_progress(f"📊 用户日活跃数据: {len(user_summaries)} 条记录", "info")
-
-                    save_result = self.save_batch_to_mongodb(batch_raw_data, user_summaries)
+            self.pipeline_stats = {name: StageStats(name) for name in ("fetch", "extract", "write")}
+            self.pipeline_queues = {
+                "fetch_to_extract": queue.Queue(maxsize=self.pipeline_queue_size),
+                "extract_to_write": queue.Queue(maxsize=self.pipeline_queue_size)
+            }
 
-                    total_stats["total_raw_saved"] += save_result["raw_saved"]
-                    total_stats["total_summary_saved"] += save_result["summary_saved"]
-                    total_stats["total_raw_skipped"] += save_result["raw_skipped"]
-                    total_stats["total_summary_skipped"] += save_result["summary_skipped"]
-                    total_stats["total_raw_filtered"] += save_result.get("raw_filtered", 0)
-                    total_stats["total_summary_filtered"] += save_result.get("summary_filtered", 0)
-                    total_stats["processed_pages"] += (batch_end_page - batch_start_page + 1)
+            if retry_pages:
+                self.recollect_failed_pages(retry_pages, total_stats)
+                if checkpoint_callback:
+                    try:
+                        checkpoint_callback(checkpoint_page, total_stats, self.failed_pages_snapshot())
+                    except Exception as e:
+                        self.send_progress(f"⚠️ 保存检查点失败: {e}", "warning")
 
-                    self.show_progress(batch_num, total_batches, start_time, total_stats)
+            fetch_thread = threading.Thread(
+                target=self._fetch_stage,
+                args=(batches, self.pipeline_queues["fetch_to_extract"]),
+                name='video-pipeline-fetch',
+                daemon=True
+            )
+            extract_thread = threading.Thread(
+                target=self._extract_stage,
+                args=(self.pipeline_queues["fetch_to_extract"], self.pipeline_queues["extract_to_write"]),
+                name='video-pipeline-extract',
+                daemon=True
+            )
+            fetch_thread.start()
+            extract_thread.start()
 
-                    del batch_raw_data, user_summaries
-                    gc.collect()
+            # 写入阶段在当前线程执行，直到上游全部结束
+            self._write_stage(self.pipeline_queues["extract_to_write"], total_batches, start_time, total_stats,
+                              checkpoint_callback=checkpoint_callback)
+            fetch_thread.join()
+            extract_thread.join()
 
-                except Exception as e:
-                    self.send_progress(f"❌ 批次 {batch_num} 处理失败: {e}", "error")
-                    total_stats["failed_pages"] += (batch_end_page - batch_start_page + 1)
-                    continue
+            if self.should_advance_watermark(start_page):
+                self.save_watermark()
+            elif self.had_watermark and self.is_running:
+                self.send_progress("📌 本次采集未衔接到上次水位线，保留原水位线", "info")
 
+            self.run_status = "completed" if self.is_running else "stopped"
+            self.set_phase(self.run_status)
             self.show_final_stats(total_stats, start_time)
             self.is_running = False
             return True
             
         except Exception as e:
             self.send_progress(f"❌ 数据采集失败: {e}", "error")
+            self.run_status = "failed"
+            self.set_phase(self.run_status)
             self.is_running = False
             return False
 
     def show_progress(self, current_batch, total_batches, start_time, stats):
+        """每批完成后更新进度：结构化事件合并节流发送，可读日志抽样输出"""
+        self.send_progress_event()
+
         progress = (current_batch / total_batches) * 100
         elapsed_minutes = (time.time() - start_time) / 60
+        remaining_minutes = elapsed_minutes / current_batch * (total_batches - current_batch) if current_batch > 0 else 0
 
-        if current_batch > 0:
-            estimated_total_minutes = elapsed_minutes / current_batch * total_batches
-            remaining_minutes = estimated_total_minutes - elapsed_minutes
-        else:
-            remaining_minutes = 0
+        self.send_progress(
+            f"📈 完成进度: {progress:.1f}% ({current_batch}/{total_batches}批), "
+            f"已用 {elapsed_minutes:.1f} 分钟, 预计剩余 {remaining_minutes:.1f} 分钟, "
+            f"累计保存: 原始数据 {stats['total_raw_saved']} 条, 用户日活跃 {stats['total_summary_saved']} 条",
+            "info",
+            sample="progress"
+        )
 
-        self.send_progress(f"📈 完成进度: {progress:.1f}% ({current_batch}/{total_batches}批)", "info")
-        self.send_progress(f"⏱️ 已用时间: {elapsed_minutes:.1f} 分钟", "info")
-        self.send_progress(f"⏳ 预计剩余: {remaining_minutes:.1f} 分钟", "info")
-        self.send_progress(f"📊 累计保存: 原始数据 {stats['total_raw_saved']} 条, 用户日活跃 {stats['total_summary_saved']} 条", "info")
+        if self.pipeline_stats:
+            pipeline = self.get_pipeline_stats()
+            stages = pipeline["stages"]
+            queue_depth = pipeline["queue_depth"]
+            self.send_progress(
+                f"🚰 流水线: 获取 {stages['fetch']['items_per_second']} 页/秒, "
+                f"解析 {stages['extract']['items_per_second']} 条/秒, "
+                f"写入 {stages['write']['items_per_second']} 条/秒, "
+                f"队列 {queue_depth['fetch_to_extract']}/{queue_depth['extract_to_write']}",
+                "info",
+                sample="pipeline"
+            )
 
     def show_final_stats(self, stats, start_time):
         total_time_minutes = (time.time() - start_time) / 60
@@ -560,10 +1352,9 @@ class VideoDataCollector:
             self.send_progress(f"📊 原始数据: 新增 {stats['total_raw_saved']} 条, 跳过 {stats['total_raw_skipped']} 条", "success")
         
         # 显示用户日活跃统计
-        if stats.get('total_summary_filtered', 0) > 0:
-            self.send_progress(f"📊 用户日活跃: 新增 {stats['total_summary_saved']} 条, 重复跳过 {stats['total_summary_skipped']} 条, 日期过滤 {stats['total_summary_filtered']} 条", "success")
-        else:
-            self.send_progress(f"📊 用户日活跃: 新增 {stats['total_summary_saved']} 条, 跳过 {stats['total_summary_skipped']} 条", "success")
+        self.send_progress(f"📊 用户日活跃: 新增 {stats['total_summary_saved']} 条, 合并更新 {stats['total_summary_merged']} 条", "success")
+        if stats.get('total_summary_pending', 0) > 0:
+            self.send_progress(f"⚠️ 用户日活跃: {stats['total_summary_pending']} 条原始数据合并失败，将在下次采集时重新合并", "warning")
 
     def stop_data_collection(self):
         """停止数据采集"""
@@ -574,22 +1365,10 @@ class VideoDataCollector:
     def cleanup(self):
         """清理资源"""
         self.is_running = False
-        if self.browser:
-            try:
-                self.browser.quit()
-                self.send_progress("🔧 浏览器已关闭", "info")
-            except:
-                pass
-        
-        # 强制终止浏览器进程
-        self._force_kill_browser_processes()
+        self.close_browser()
         
-        if self.myclient:
-            try:
-                self.myclient.close()
-                self.send_progress("🔧 MongoDB连接已关闭", "info")
-            except:
-                pass
+        # 只终止本实例启动的浏览器进程，不影响其他并行任务
+        self._force_kill_browser_processes(all_processes=False)
     
     def force_cleanup(self):
         """强制清理所有资源（程序退出时调用）"""
@@ -607,19 +1386,15 @@ class VideoDataCollector:
             # 强制终止所有Chrome相关进程
             self._force_kill_browser_processes()
             
-            # 关闭数据库连接
-            if self.myclient:
-                try:
-                    self.myclient.close()
-                except:
-                    pass
-            
             print("强制清理完成")
         except Exception as e:
             print(f"强制清理异常: {e}")
     
-    def _force_kill_browser_processes(self):
-        """强制终止Chrome/Chromium相关进程"""
+    def _force_kill_browser_processes(self, all_processes=True):
+        """
+        强制终止Chrome/Chromium相关进程
+        :param all_processes: 同时终止所有带调试端口的Chrome进程（仅在程序退出时使用）
+        """
         try:
             # 先尝试终止记录的浏览器进程
             if self.browser_pid:
@@ -645,6 +1420,10 @@ class VideoDataCollector:
                         self.send_progress(f"终止浏览器进程失败: {e}", "warning")
                     else:
                         print(f"终止浏览器进程失败: {e}")
+                self.browser_pid = None
+            
+            if not all_processes:
+                return
             
             # 查找并终止所有Chrome/Chromium进程
             chrome_processes = []
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试采集任务调度
+用内存任务记录和假的采集实例代替 MongoDB 和接口，只验证任务管理器本身的行为：
+恢复任务的记录顺序、页码/日期范围重叠的任务被拒绝、超出并发数的任务排队执行、
+重建汇总等独占操作与采集任务互斥
+"""
+import threading
+
+import pytest
+
+import services.collection_job_manager as job_manager_module
+from services.collection_job_manager import CollectionJobManager
+
+
+class MemoryJobStore:
+    """内存中的任务记录，按调用顺序记录操作"""
+
+    def __init__(self):
+        self.jobs = {}
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def _record(self, action, job_id, status=None):
+        with self.lock:
+            self.calls.append((action, job_id))
+            if status:
+                self.jobs[job_id] = status
+
+    def create_job(self, params):
+        job_id = f"job-{len(self.jobs) + 1}"
+        self._record('create_job', job_id, 'running')
+        return job_id
+
+    def mark_resumed(self, job_id):
+        self._record('mark_resumed', job_id, 'running')
+
+    def save_checkpoint(self, job_id, last_completed_page, total_stats, failed_pages):
+        self._record('save_checkpoint', job_id)
+
+    def finish_job(self, job_id, status, message=None):
+        self._record('finish_job', job_id, status)
+
+
+class FakeCollector:
+    """假的采集实例：获取令牌后等待 release 事件再结束"""
+
+    token_ok = True
+    release = None
+    started = []
+
+    def __init__(self, progress_callback=None, filter_start_date=None, filter_end_date=None, max_workers=8):
+        self.is_running = False
+        self.run_status = None
+
+    def acquire_token(self, username='admin', password=None):
+        return self.token_ok
+
+    def start_data_collection(self, total_pages=500, start_page=1, **kwargs):
+        self.is_running = True
+        self.started.append((start_page, total_pages, kwargs.get('retry_pages')))
+        if self.release:
+            self.release.wait(5)
+        self.run_status = 'completed'
+        self.is_running = False
+        return True
+
+    def get_pipeline_stats(self):
+        return {}
+
+    def stop_data_collection(self):
+        self.is_running = False
+
+    def cleanup(self):
+        pass
+
+    def force_cleanup(self):
+        pass
+
+
+@pytest.fixture
+def fake_collector(monkeypatch):
+    FakeCollector.token_ok = True
+    FakeCollector.release = threading.Event()
+    FakeCollector.started = []
+    monkeypatch.setattr(job_manager_module, 'VideoDataCollector', FakeCollector)
+    yield FakeCollector
+    FakeCollector.release.set()
+
+
+def wait_finished(manager, job_id):
+    job = manager.get_job(job_id)
+    job.future.result(timeout=5)
+    return job
+
+
+def test_resumed_job_is_marked_before_it_runs(fake_collector):
+    # 令牌获取失败，任务立即结束；最终状态不能被随后的“已恢复”覆盖
+    fake_collector.token_ok = False
+    store = MemoryJobStore()
+    manager = CollectionJobManager(job_store=store, max_concurrent_jobs=1)
+    try:
+        result = manager.submit({'total_pages': 10}, 'pw', job_id='old-job', start_page=6, retry_pages=[2, 3])
+        assert result['success']
+        wait_finished(manager, 'old-job')
+        assert [call for call in store.calls if call[1] == 'old-job'] == [
+            ('mark_resumed', 'old-job'), ('finish_job', 'old-job')]
+        assert store.jobs['old-job'] == 'failed'
+    finally:
+        manager.shutdown()
+
+
+def test_resumed_job_receives_retry_pages(fake_collector):
+    fake_collector.release.set()
+    store = MemoryJobStore()
+    manager = CollectionJobManager(job_store=store, max_concurrent_jobs=1)
+    try:
+        manager.submit({'total_pages': 10}, 'pw', job_id='old-job', start_page=6, retry_pages=[2, 3])
+        wait_finished(manager, 'old-job')
+        assert fake_collector.started == [(6, 10, [2, 3])]
+        assert store.jobs['old-job'] == 'completed'
+    finally:
+        manager.shutdown()
+
+
+def test_overlapping_job_is_rejected(fake_collector):
+    store = MemoryJobStore()
+    manager = CollectionJobManager(job_store=store, max_concurrent_jobs=3)
+    try:
+        first = manager.submit({'start_page': 1, 'total_pages': 50, 'filter_start_date': '2025-07-01',
+                                'filter_end_date': '2025-07-10'}, 'pw')
+        assert first['success'] and not first['queued']
+
+        # 页码重叠、不限日期（覆盖任意日期）：冲突，不创建任务记录
+        conflict = manager.submit({'start_page': 40, 'total_pages': 80}, 'pw')
+        assert not conflict['success']
+        assert conflict['conflict_job_id'] == first['job_id']
+        assert [call[0] for call in store.calls] == ['create_job']
+
+        # 页码和日期范围都重叠：冲突
+        assert not manager.submit({'start_page': 10, 'total_pages': 20, 'filter_start_date': '2025-07-10',
+                                   'filter_end_date': '2025-07-20'}, 'pw')['success']
+
+        # 页码重叠但日期范围不重叠：可以并行
+        assert manager.submit({'start_page': 1, 'total_pages': 50, 'filter_start_date': '2025-07-11',
+                               'filter_end_date': '2025-07-20'}, 'pw')['success']
+
+        # 页码不重叠：即使不限日期也可以提交
+        assert manager.submit({'start_page': 51, 'total_pages': 100}, 'pw')['success']
+    finally:
+        fake_collector.release.set()
+        manager.shutdown()
+
+
+def test_jobs_beyond_concurrency_limit_are_queued(fake_collector):
+    store = MemoryJobStore()
+    manager = CollectionJobManager(job_store=store, max_concurrent_jobs=1)
+    try:
+        first = manager.submit({'start_page': 1, 'total_pages': 10}, 'pw')
+        second = manager.submit({'start_page': 11, 'total_pages': 20}, 'pw')
+        assert not first['queued']
+        assert second['queued']
+        assert manager.get_job(second['job_id']).status == 'queued'
+
+        # 排队中的任务也参与重叠检查
+        assert not manager.submit({'start_page': 15, 'total_pages': 30}, 'pw')['success']
+
+        fake_collector.release.set()
+        assert wait_finished(manager, first['job_id']).status == 'completed'
+        assert wait_finished(manager, second['job_id']).status == 'completed'
+        # 同一时间只运行一个任务，按提交顺序执行
+        assert [started[0] for started in fake_collector.started] == [1, 11]
+        assert not manager.has_running_jobs()
+    finally:
+        manager.shutdown()
+
+
+def test_cancel_queued_job_removes_it_from_the_queue(fake_collector):
+    store = MemoryJobStore()
+    manager = CollectionJobManager(job_store=store, max_concurrent_jobs=1)
+    try:
+        first = manager.submit({'start_page': 1, 'total_pages': 10}, 'pw')
+        second = manager.submit({'start_page': 11, 'total_pages': 20}, 'pw')
+
+        assert manager.cancel(second['job_id'])['success']
+        assert manager.get_job(second['job_id']).status == 'stopped'
+        assert store.jobs[second['job_id']] == 'stopped'
+
+        # 取消后释放了页码范围，可以重新提交
+        assert manager.submit({'start_page': 15, 'total_pages': 30}, 'pw')['success']
+
+        fake_collector.release.set()
+        wait_finished(manager, first['job_id'])
+        assert 11 not in [started[0] for started in fake_collector.started]
+    finally:
+        fake_collector.release.set()
+        manager.shutdown()
+
+
+def test_exclusive_operation_excludes_collection_jobs(fake_collector):
+    store = MemoryJobStore()
+    manager = CollectionJobManager(job_store=store, max_concurrent_jobs=1)
+    try:
+        first = manager.submit({'start_page': 1, 'total_pages': 10}, 'pw')
+        calls = []
+        # 有任务运行时不执行重建
+        result = manager.run_exclusive('重建用户日活跃', calls.append, 'rebuild')
+        assert result['conflict'] and not calls
+
+        fake_collector.release.set()
+        wait_finished(manager, first['job_id'])
+
+        # 重建进行期间不接受新的采集任务
+        def rebuild():
+            submitted = manager.submit({'start_page': 1, 'total_pages': 10}, 'pw')
+            return {'success': True, 'submitted': submitted}
+
+        result = manager.run_exclusive('重建用户日活跃', rebuild)
+        assert result['success'] and not result['submitted']['success']
+        assert manager.submit({'start_page': 1, 'total_pages': 10}, 'pw')['success']
+    finally:
+        fake_collector.release.set()
+        manager.shutdown()
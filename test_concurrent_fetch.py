@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试并发页面获取
+使用本地桩HTTP服务器模拟 video_list 接口，对比串行与并发获取的耗时
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from services.video_data_collector import VideoDataCollector
+
+PAGE_DELAY = 0.05  # 模拟每页接口延迟（秒）
+
+
+class StubVideoListHandler(BaseHTTPRequestHandler):
+    """模拟 /api/cms/task/video_list 接口"""
+
+    # 这些页面第一次请求返回503，用于测试重试
+    flaky_pages = set()
+
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query)
+        page = int(query.get('page_number', ['1'])[0])
+        page_size = int(query.get('page_size', ['100'])[0])
+        time.sleep(PAGE_DELAY)
+
+        if page in self.flaky_pages:
+            self.flaky_pages.discard(page)
+            self.send_response(503)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        items = [{
+            'id': page * page_size + i,
+            'prompt': f'prompt {page}-{i}',
+            'nickname': f'user{i % 7}',
+            'status': '已完成',
+            'submit_time': '2025-07-20 10:00:00',
+            'finish_time': '2025-07-20 10:03:00'
+        } for i in range(page_size)]
+
+        body = json.dumps({'data': {'list': items}}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub_server():
+    """启动桩服务器，返回 (server, base_url)"""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubVideoListHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def run_fetch(base_url, max_workers, pages):
+    """用指定并发数获取 pages 页，返回 (记录数, 耗时)"""
+    collector = VideoDataCollector(max_workers=max_workers)
+    collector.api_base_url = base_url
+    collector.backserver_token = 'stub-token'
+    collector.is_running = True
+
+    start = time.time()
+    records = collector.fetch_batch_pages(1, pages)
+    return records, time.time() - start
+
+
+def test_concurrent_fetch(pages=40):
+    """并发获取的结果应与串行一致且更快"""
+    print("=== 测试并发页面获取 ===")
+    server, base_url = start_stub_server()
+    try:
+        serial_records, serial_time = run_fetch(base_url, 1, pages)
+        concurrent_records, concurrent_time = run_fetch(base_url, 8, pages)
+
+        print(f"串行: {len(serial_records)} 条, 用时 {serial_time:.2f}s")
+        print(f"并发(8): {len(concurrent_records)} 条, 用时 {concurrent_time:.2f}s")
+
+        assert [r['id'] for r in serial_records] == [r['id'] for r in concurrent_records]
+        assert concurrent_time < serial_time / 2
+    finally:
+        server.shutdown()
+
+    print("=== 测试完成 ===")
+
+
+def test_stop_cancels_pending_pages(pages=40):
+    """停止采集后不再发出剩余页面的请求"""
+    server, base_url = start_stub_server()
+    try:
+        collector = VideoDataCollector(max_workers=2)
+        collector.api_base_url = base_url
+        collector.backserver_token = 'stub-token'
+        collector.is_running = True
+
+        threading.Timer(PAGE_DELAY * 3, collector.stop_data_collection).start()
+        records = collector.fetch_batch_pages(1, pages)
+
+        print(f"停止后获取: {len(records)} 条")
+        assert len(records) < pages * 100
+    finally:
+        server.shutdown()
+
+
+def test_flaky_pages_are_retried(pages=10):
+    """返回503的页面会被重试而不是丢弃"""
+    server, base_url = start_stub_server()
+    StubVideoListHandler.flaky_pages = {3, 7}
+    try:
+        records, _ = run_fetch(base_url, 4, pages)
+
+        print(f"重试后获取: {len(records)} 条")
+        assert len(records) == pages * 100
+    finally:
+        StubVideoListHandler.flaky_pages = set()
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    test_concurrent_fetch()
+    test_stop_cancels_pending_pages()
+    test_flaky_pages_are_retried()
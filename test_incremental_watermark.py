@@ -0,0 +1,394 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试增量采集水位线
+使用本地桩HTTP服务器模拟按提交时间倒序的 video_list 接口，MongoDB 使用 mongomock：
+到达上次水位线时提前停止并推进水位线；没衔接上旧水位线的运行不推进，之后的增量运行能补齐中间的数据；
+汇总合并失败的原始数据保持未汇总标记，下次采集开始时重新合并；
+从检查点恢复时先重新获取检查点中记录的失败页面
+"""
+import gc
+import json
+import threading
+import weakref
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import pytest
+from pymongo.errors import BulkWriteError
+
+from services.video_data_collector import VideoDataCollector
+
+mongomock = pytest.importorskip("mongomock")
+
+PAGE_SIZE = 100
+NEWEST = datetime(2025, 7, 20, 12, 0, 0)
+
+
+class StubFeedHandler(BaseHTTPRequestHandler):
+    """模拟接口：共 total 条记录，最新的排在第1页；new_records 为之后新增的条数"""
+
+    total = 1000
+    new_records = 0
+    requested_pages = []
+    # 这些页面返回404（传输层不重试），用于模拟多次重试后仍失败的页面
+    failing_pages = set()
+
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query)
+        page = int(query.get('page_number', ['1'])[0])
+        self.requested_pages.append(page)
+
+        if page in self.failing_pages:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        count = self.total + self.new_records
+        items = []
+        for index in range((page - 1) * PAGE_SIZE, min(page * PAGE_SIZE, count)):
+            # index 0 为最新记录；新增记录的 id 和时间都大于已有记录
+            record_id = count - index
+            submit_time = NEWEST + timedelta(minutes=self.new_records - index)
+            items.append({
+                'id': record_id,
+                'prompt': f'prompt {record_id}',
+                'nickname': f'user{record_id % 5}',
+                'status': '已完成',
+                'submit_time': submit_time.strftime('%Y-%m-%d %H:%M:%S'),
+                'finish_time': (submit_time + timedelta(minutes=2)).strftime('%Y-%m-%d %H:%M:%S')
+            })
+
+        body = json.dumps({'data': {'list': items}}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def feed():
+    StubFeedHandler.total = 1000
+    StubFeedHandler.new_records = 0
+    StubFeedHandler.requested_pages = []
+    StubFeedHandler.failing_pages = set()
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubFeedHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+
+
+@pytest.fixture
+def mongo(monkeypatch):
+    # mongomock 不支持 $round，跳过平均处理时长的重算，其余汇总字段照常累加
+    monkeypatch.setattr(VideoDataCollector, 'refresh_avg_processing_minutes', lambda self, unique_keys: None)
+    return mongomock.MongoClient()
+
+
+def make_collector(base_url, client):
+    collector = VideoDataCollector(max_workers=4)
+    collector.myclient = client
+    collector.mydb = client['留存']
+    collector.mycol_raw = collector.mydb['原始数据']
+    collector.mycol_retention = collector.mydb['用户日活跃']
+    collector.mycol_state = collector.mydb['采集状态']
+    collector.api_base_url = base_url
+    collector.backserver_token = 'stub-token'
+    return collector
+
+
+def run(base_url, client, total_pages, incremental=True):
+    StubFeedHandler.requested_pages = []
+    collector = make_collector(base_url, client)
+    collector.start_data_collection(total_pages=total_pages, batch_size=5, incremental=incremental)
+    return collector
+
+
+def watermark(client):
+    state = client['留存']['采集状态'].find_one({'_id': 'video_list'})
+    return state and state['max_submit_time']
+
+
+def newest_time():
+    return (NEWEST + timedelta(minutes=StubFeedHandler.new_records)).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def test_first_run_sets_watermark(feed, mongo):
+    run(feed, mongo, total_pages=10)
+    assert mongo['留存']['原始数据'].count_documents({}) == 1000
+    assert watermark(mongo) == newest_time()
+
+
+def test_incremental_run_stops_at_watermark_and_advances(feed, mongo):
+    run(feed, mongo, total_pages=10)
+
+    StubFeedHandler.new_records = 150
+    collector = run(feed, mongo, total_pages=10)
+
+    assert collector.stop_reason == 'watermark'
+    # 新数据占前两页，第3页已全部入库；并发获取可能多请求几页，但不会扫完全部页面
+    assert max(StubFeedHandler.requested_pages) < 10
+    assert mongo['留存']['原始数据'].count_documents({}) == 1150
+    assert watermark(mongo) == newest_time()
+
+
+def test_run_that_misses_old_watermark_keeps_it(feed, mongo):
+    run(feed, mongo, total_pages=10)
+    old_mark = watermark(mongo)
+
+    # 新增 500 条（5页），增量运行只允许获取2页，到不了旧水位线
+    StubFeedHandler.new_records = 500
+    collector = run(feed, mongo, total_pages=2)
+    assert collector.stop_reason is None
+    assert watermark(mongo) == old_mark
+
+    # 下一次增量运行仍能补齐第3-5页的数据
+    run(feed, mongo, total_pages=10)
+    assert mongo['留存']['原始数据'].count_documents({}) == 1500
+    assert watermark(mongo) == newest_time()
+
+
+def test_partial_full_run_does_not_advance_existing_watermark(feed, mongo):
+    run(feed, mongo, total_pages=10)
+    old_mark = watermark(mongo)
+
+    StubFeedHandler.new_records = 500
+    run(feed, mongo, total_pages=2, incremental=False)
+    assert watermark(mongo) == old_mark
+
+    run(feed, mongo, total_pages=10)
+    assert mongo['留存']['原始数据'].count_documents({}) == 1500
+
+
+def fail_nth_raw_insert(monkeypatch, failing_call):
+    """让第 failing_call 次原始数据写入抛出异常"""
+    original = VideoDataCollector._bulk_insert_ignore
+    calls = []
+
+    def flaky_insert(self, collection, key_field, documents):
+        calls.append(key_field)
+        if len(calls) == failing_call:
+            raise RuntimeError('write failed')
+        return original(self, collection, key_field, documents)
+
+    monkeypatch.setattr(VideoDataCollector, '_bulk_insert_ignore', flaky_insert)
+
+
+def test_failed_raw_write_marks_pages_failed_and_keeps_watermark(feed, mongo, monkeypatch):
+    checkpoints = []
+    with monkeypatch.context() as patch:
+        fail_nth_raw_insert(patch, 2)
+        collector = make_collector(feed, mongo)
+        collector.start_data_collection(
+            total_pages=10, batch_size=5, incremental=True,
+            checkpoint_callback=lambda page, stats, failed: checkpoints.append((page, list(failed))))
+
+    assert mongo['留存']['原始数据'].count_documents({}) == 500
+    assert collector.failed_pages == [6, 7, 8, 9, 10]
+    assert checkpoints == [(5, []), (10, [6, 7, 8, 9, 10])]
+    assert watermark(mongo) is None
+
+    # 下一次增量运行补齐未写入的数据后才设置水位线
+    run(feed, mongo, total_pages=10)
+    assert mongo['留存']['原始数据'].count_documents({}) == 1000
+    assert watermark(mongo) == newest_time()
+
+
+def test_failed_extraction_is_checkpointed_and_recollected_on_resume(feed, mongo, monkeypatch):
+    original = VideoDataCollector._extract_filtered_batch
+    calls = []
+
+    def flaky_extract(self, page_responses):
+        calls.append(sorted(page_responses))
+        if len(calls) == 1:
+            raise ValueError('bad payload')
+        return original(self, page_responses)
+
+    checkpoints = []
+
+    def checkpoint(page, stats, failed):
+        checkpoints.append((page, dict(stats), list(failed)))
+
+    with monkeypatch.context() as patch:
+        patch.setattr(VideoDataCollector, '_extract_filtered_batch', flaky_extract)
+        make_collector(feed, mongo).start_data_collection(total_pages=10, batch_size=5, checkpoint_callback=checkpoint)
+
+    assert [(page, failed) for page, _, failed in checkpoints] == [(5, [1, 2, 3, 4, 5]), (10, [1, 2, 3, 4, 5])]
+    assert mongo['留存']['原始数据'].count_documents({}) == 500
+
+    # 恢复：从检查点之后继续（已无剩余页面），并重新获取失败页面
+    last_page, stats, failed = checkpoints[-1]
+    make_collector(feed, mongo).start_data_collection(total_pages=10, batch_size=5, start_page=last_page + 1,
+                                                      initial_stats=stats, checkpoint_callback=checkpoint,
+                                                      retry_pages=failed)
+    assert checkpoints[-1][2] == []
+    assert mongo['留存']['原始数据'].count_documents({}) == 1000
+
+
+def total_usage(client):
+    return sum(doc['usage_count'] for doc in client['留存']['用户日活跃'].find({}, {'usage_count': 1}))
+
+
+def test_failed_summary_merge_is_remerged_on_next_run(feed, mongo, monkeypatch):
+    def failing_merge(self, user_summaries):
+        raise RuntimeError('merge interrupted')
+
+    with monkeypatch.context() as patch:
+        patch.setattr(VideoDataCollector, 'merge_user_summaries', failing_merge)
+        run(feed, mongo, total_pages=3)
+
+    raw = mongo['留存']['原始数据']
+    assert raw.count_documents({}) == 300
+    assert raw.count_documents({'summarized': False}) == 300
+    assert total_usage(mongo) == 0
+
+    # 宽限期内的未汇总记录可能属于正在写入的其他任务，不会被重新合并
+    run(feed, mongo, total_pages=3)
+    assert total_usage(mongo) == 0
+
+    collector = make_collector(feed, mongo)
+    collector.pending_summary_grace_minutes = 0
+    assert collector.merge_pending_summaries(chunk_size=128) == 300
+    assert raw.count_documents({'summarized': False}) == 0
+    assert total_usage(mongo) == 300
+
+    # 已标记的记录不会重复计入
+    assert collector.merge_pending_summaries() == 0
+    assert total_usage(mongo) == 300
+
+
+def interrupted_merge(self, user_summaries):
+    raise RuntimeError('merge interrupted')
+
+
+def leave_unsummarized(feed, mongo, monkeypatch, total_pages):
+    with monkeypatch.context() as patch:
+        patch.setattr(VideoDataCollector, 'merge_user_summaries', interrupted_merge)
+        run(feed, mongo, total_pages=total_pages)
+
+
+def test_parallel_pending_merges_do_not_double_count(feed, mongo, monkeypatch):
+    leave_unsummarized(feed, mongo, monkeypatch, total_pages=3)
+
+    first = make_collector(feed, mongo)
+    second = make_collector(feed, mongo)
+    first.pending_summary_grace_minutes = second.pending_summary_grace_minutes = 0
+    original = VideoDataCollector.merge_user_summaries
+    second_merged = []
+
+    def merge_while_other_job_starts(self, user_summaries):
+        # 第一个任务合并期间，第二个任务开始并重新合并
+        if self is first and not second_merged:
+            second_merged.append(second.merge_pending_summaries(chunk_size=100))
+        return original(self, user_summaries)
+
+    monkeypatch.setattr(VideoDataCollector, 'merge_user_summaries', merge_while_other_job_starts)
+    first_merged = first.merge_pending_summaries(chunk_size=100)
+
+    assert first_merged + second_merged[0] == 300
+    assert mongo['留存']['原始数据'].count_documents({'summarized': True}) == 300
+    assert total_usage(mongo) == 300
+
+
+def test_stale_claim_is_remerged_and_failed_claim_released(feed, mongo, monkeypatch):
+    leave_unsummarized(feed, mongo, monkeypatch, total_pages=1)
+    raw = mongo['留存']['原始数据']
+    # 其他任务认领后退出，认领一直未完成
+    raw.update_many({}, {'$set': {'summarized': 'claim:dead', 'summary_claimed_at': '2000-01-01 00:00:00'}})
+
+    collector = make_collector(feed, mongo)
+    collector.pending_summary_grace_minutes = 0
+    with monkeypatch.context() as patch:
+        patch.setattr(VideoDataCollector, 'merge_user_summaries', interrupted_merge)
+        assert collector.merge_pending_summaries() == 0
+    # 合并失败时释放认领，记录回到未汇总状态
+    assert raw.count_documents({'summarized': False}) == 100
+
+    assert collector.merge_pending_summaries() == 100
+    assert raw.count_documents({'summarized': True}) == 100
+    assert total_usage(mongo) == 100
+
+
+def test_successful_merge_marks_raw_records_summarized(feed, mongo):
+    run(feed, mongo, total_pages=2)
+    raw = mongo['留存']['原始数据']
+    assert raw.count_documents({'summarized': True}) == 200
+    assert total_usage(mongo) == 200
+
+
+def test_resume_recollects_checkpointed_failed_pages(feed, mongo):
+    checkpoints = []
+
+    def checkpoint(last_completed_page, total_stats, failed_pages):
+        checkpoints.append((last_completed_page, dict(total_stats), list(failed_pages)))
+
+    StubFeedHandler.failing_pages = {3, 7}
+    collector = make_collector(feed, mongo)
+    collector.page_requeue_rounds = 0
+    collector.start_data_collection(total_pages=8, batch_size=4, checkpoint_callback=checkpoint)
+
+    last_page, stats, failed_pages = checkpoints[-1]
+    assert (last_page, failed_pages) == (8, [3, 7])
+    assert stats['failed_pages'] == 2
+    assert mongo['留存']['原始数据'].count_documents({}) == 600
+
+    # 检查点已到最后一页，恢复时只需要补采失败页面；第7页仍然失败
+    StubFeedHandler.failing_pages = {7}
+    checkpoints.clear()
+    collector = make_collector(feed, mongo)
+    collector.page_requeue_rounds = 0
+    collector.start_data_collection(total_pages=8, batch_size=4, start_page=last_page + 1, initial_stats=stats,
+                                    checkpoint_callback=checkpoint, retry_pages=failed_pages)
+
+    last_page, stats, failed_pages = checkpoints[-1]
+    assert (last_page, failed_pages) == (8, [7])
+    assert stats['failed_pages'] == 1
+    assert mongo['留存']['原始数据'].count_documents({}) == 700
+
+    StubFeedHandler.failing_pages = set()
+    collector = make_collector(feed, mongo)
+    collector.start_data_collection(total_pages=8, batch_size=4, start_page=last_page + 1, initial_stats=stats,
+                                    checkpoint_callback=checkpoint, retry_pages=failed_pages)
+    assert checkpoints[-1][2] == []
+    assert checkpoints[-1][1]['failed_pages'] == 0
+    assert mongo['留存']['原始数据'].count_documents({}) == 800
+
+
+class FailingBulkCollection:
+    """bulk_write 总是抛出 BulkWriteError，写入错误的错误码由 codes 指定"""
+
+    def __init__(self, codes):
+        self.codes = codes
+
+    def bulk_write(self, operations, ordered=False):
+        raise BulkWriteError({
+            'writeErrors': [{'index': index, 'code': code, 'errmsg': 'stub'} for index, code in enumerate(self.codes)],
+            'upserted': [{'index': index, '_id': index} for index in range(len(self.codes), len(operations))]
+        })
+
+
+def test_bulk_insert_ignore_only_skips_duplicate_keys(feed, mongo):
+    collector = make_collector(feed, mongo)
+    documents = [{'id': index} for index in range(3)]
+
+    # 唯一索引冲突：冲突的文档视为已存在，其余为新插入
+    assert collector._bulk_insert_ignore(FailingBulkCollection([11000]), 'id', documents) == {1, 2}
+
+    # 其他写入错误不能当作已存在
+    with pytest.raises(BulkWriteError):
+        collector._bulk_insert_ignore(FailingBulkCollection([11000, 121]), 'id', documents)
+
+
+def test_finished_collector_can_be_garbage_collected(feed, mongo):
+    # 每个任务一个采集实例，结束后不能被 atexit 等全局引用留住（连同其进度回调）
+    collector = run(feed, mongo, total_pages=1)
+    ref = weakref.ref(collector)
+    del collector
+    gc.collect()
+    assert ref() is None
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试日期范围页面窗口定位
+使用本地桩HTTP服务器模拟按提交时间倒序的 video_list 接口（每15分钟一条，每页100条，页面跨天），
+二分定位的窗口应与逐页扫描得到的结果一致：范围在第一页、最后一页、中间若干页，以及没有匹配页面
+"""
+import json
+import math
+import threading
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import pytest
+
+from services.video_data_collector import VideoDataCollector
+
+PAGE_SIZE = 100
+NEWEST = datetime(2025, 7, 20, 23, 45, 0)
+TOTAL_RECORDS = 20 * 96  # 2025-07-01 到 2025-07-20，共20页（最后一页不满）
+TOTAL_PAGES = math.ceil(TOTAL_RECORDS / PAGE_SIZE)
+
+
+def submit_time(index):
+    """第 index 条（0 为最新）记录的提交时间"""
+    return (NEWEST - timedelta(minutes=15 * index)).strftime('%Y-%m-%d %H:%M:%S')
+
+
+class StubFeedHandler(BaseHTTPRequestHandler):
+    """模拟接口：记录按提交时间倒序，超出数据末尾的页面返回空列表"""
+
+    requested_pages = []
+
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query)
+        page = int(query.get('page_number', ['1'])[0])
+        self.requested_pages.append(page)
+
+        items = [{
+            'id': TOTAL_RECORDS - index,
+            'nickname': f'user{index % 5}',
+            'status': '已完成',
+            'submit_time': submit_time(index)
+        } for index in range((page - 1) * PAGE_SIZE, min(page * PAGE_SIZE, TOTAL_RECORDS))]
+
+        body = json.dumps({'data': {'list': items}}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture(scope='module')
+def feed():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubFeedHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+
+
+def make_collector(base_url, start_date, end_date):
+    collector = VideoDataCollector(filter_start_date=start_date, filter_end_date=end_date)
+    collector.api_base_url = base_url
+    collector.backserver_token = 'stub-token'
+    return collector
+
+
+def scanned_window(start_date, end_date, total_pages=TOTAL_PAGES):
+    """逐页扫描：包含范围内记录的第一页和最后一页"""
+    pages = [
+        index // PAGE_SIZE + 1 for index in range(min(TOTAL_RECORDS, total_pages * PAGE_SIZE))
+        if start_date <= submit_time(index)[:10] <= end_date
+    ]
+    return (min(pages), max(pages)) if pages else None
+
+
+@pytest.mark.parametrize('start_date, end_date', [
+    ('2025-07-20', '2025-07-20'),  # 第一页
+    ('2025-07-20', '2025-07-31'),  # 结束日期晚于最新数据
+    ('2025-07-01', '2025-07-01'),  # 最后一页
+    ('2025-06-20', '2025-07-01'),  # 开始日期早于最早数据
+    ('2025-07-10', '2025-07-12'),  # 中间窗口，首尾页都跨天
+    ('2025-07-15', '2025-07-15'),
+])
+def test_window_matches_page_scan(feed, start_date, end_date):
+    StubFeedHandler.requested_pages = []
+    collector = make_collector(feed, start_date, end_date)
+
+    window, probes = collector.locate_page_window(TOTAL_PAGES)
+
+    assert window == scanned_window(start_date, end_date)
+    # 两次二分查找，探测页数只与总页数的对数有关
+    assert probes <= 2 * math.ceil(math.log2(TOTAL_PAGES + 1))
+    assert len(StubFeedHandler.requested_pages) == probes
+
+
+@pytest.mark.parametrize('start_date, end_date', [
+    ('2025-06-01', '2025-06-05'),  # 早于全部数据
+    ('2025-08-01', '2025-08-03'),  # 晚于全部数据
+])
+def test_range_without_matching_pages(feed, start_date, end_date):
+    collector = make_collector(feed, start_date, end_date)
+    window, _ = collector.locate_page_window(TOTAL_PAGES)
+    assert window is None
+
+    # 没有匹配页面时返回空范围（起始页 > 结束页），不再获取任何页面
+    start_page, end_page = collector.narrow_to_date_window(1, TOTAL_PAGES)
+    assert start_page > end_page
+
+
+def test_range_beyond_searched_pages(feed):
+    # 2025-07-01 在第19-20页，只允许搜索前10页时视为没有匹配
+    collector = make_collector(feed, '2025-07-01', '2025-07-01')
+    assert collector.locate_page_window(10)[0] is None
+
+
+@pytest.mark.parametrize('start_date, end_date, start_page, expected', [
+    # 第一页：结束页向后多取 page_window_slack 页
+    ('2025-07-20', '2025-07-20', 1, (1, 3)),
+    # 最后一页：不超过 total_pages
+    ('2025-07-01', '2025-07-01', 1, (19, TOTAL_PAGES)),
+    # 中间窗口（第8-11页）
+    ('2025-07-10', '2025-07-12', 1, (8, 13)),
+    # 从检查点恢复时，起始页不早于检查点
+    ('2025-07-10', '2025-07-12', 10, (10, 13)),
+])
+def test_narrow_to_date_window(feed, start_date, end_date, start_page, expected):
+    collector = make_collector(feed, start_date, end_date)
+    assert collector.narrow_to_date_window(start_page, TOTAL_PAGES) == expected
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试留存分析
+MongoDB 使用 mongomock：留存明细能对应回正确的 (访问ip, 地域)，未发布的导入数据不参与计算，
+留存间隔天数只接受正整数列表
+"""
+from datetime import datetime, timedelta
+
+import pytest
+
+from services.retention_service import RetentionService
+from utils.retention_filters import STAGING_STATUS
+from utils.database import db
+
+mongomock = pytest.importorskip("mongomock")
+
+FIRST_DAY = datetime(2025, 7, 17)
+
+
+@pytest.fixture
+def visits():
+    """共享客户端换成 mongomock，返回 留存.数据 集合"""
+    original = db._client
+    db._client = mongomock.MongoClient()
+    yield db.retention_db['数据']
+    db._client = original
+
+
+def visit(ip, region, day, **extra):
+    visit_time = FIRST_DAY + timedelta(days=day, hours=9)
+    return {'访问ip': ip, '地域': region, '访问日期': FIRST_DAY + timedelta(days=day),
+            '访问时间': visit_time, '访问次数': 1, **extra}
+
+
+def details(result, date, lag):
+    cell = next(c for c in result['data']['cohorts'] if c['date'] == date)['retention'][f'D{lag}']
+    return cell['retained'], sorted((d['ip'], d['region']) for d in cell['details'])
+
+
+def test_details_map_back_to_visited_users(visits):
+    # 用户首次出现的顺序与 ip 排序不同；同一 ip 不同地域是不同用户
+    visits.insert_many([
+        visit('10.0.0.9', '上海', 0),
+        visit('10.0.0.1', '北京', 0),
+        visit('10.0.0.5', '广东', 0),
+        visit('10.0.0.1', '上海', 1),
+        visit('10.0.0.5', '广东', 1),
+        visit('10.0.0.9', '上海', 1),
+        visit('10.0.0.1', '北京', 7),
+    ])
+
+    result = RetentionService.analyze_retention('2025-07-17', '2025-07-31', retention_days=[1, 7],
+                                                include_details=True)
+
+    assert result['success'], result['message']
+    assert result['data']['total_users'] == 4
+    assert result['data']['record_count'] == 7
+    assert details(result, '2025-07-17', 1) == (2, [('10.0.0.5', '广东'), ('10.0.0.9', '上海')])
+    assert details(result, '2025-07-17', 7) == (1, [('10.0.0.1', '北京')])
+    assert details(result, '2025-07-18', 1) == (0, [])
+
+
+def test_staging_rows_are_excluded(visits):
+    visits.insert_many([
+        visit('10.0.0.1', '北京', 0),
+        visit('10.0.0.2', '北京', 0),
+        visit('10.0.0.1', '北京', 1),
+        # 尚未发布的导入批次：不能让 10.0.0.2 变成次日留存，也不能增加用户数
+        visit('10.0.0.2', '北京', 1, 导入状态=STAGING_STATUS),
+        visit('10.0.0.3', '北京', 0, 导入状态=STAGING_STATUS),
+    ])
+
+    result = RetentionService.analyze_retention(retention_days=[1])
+
+    assert result['success'], result['message']
+    assert result['data']['total_users'] == 2
+    assert result['data']['record_count'] == 3
+    assert result['data']['average']['D1']['retained'] == 1
+    assert result['data']['average']['D1']['base_users'] == 2
+
+
+def test_empty_range_returns_no_cohorts(visits):
+    visits.insert_one(visit('10.0.0.1', '北京', 0, 导入状态=STAGING_STATUS))
+    result = RetentionService.analyze_retention(retention_days=[1])
+    assert result['success']
+    assert result['data']['cohorts'] == []
+
+
+@pytest.mark.parametrize('value, expected', [
+    ([30, 1, 7, 1], [1, 7, 30]),
+    ((1, 7, 30), [1, 7, 30]),
+])
+def test_parse_retention_days_accepts_positive_int_lists(value, expected):
+    assert RetentionService.parse_retention_days(value) == expected
+
+
+@pytest.mark.parametrize('value', ['30', 30, [], ['7'], [1, True], [0], [-1], [1.5], None])
+def test_parse_retention_days_rejects_other_values(value):
+    with pytest.raises(ValueError):
+        RetentionService.parse_retention_days(value)
+
+
+def test_analyze_retention_rejects_string_retention_days(visits):
+    visits.insert_one(visit('10.0.0.1', '北京', 0))
+    result = RetentionService.analyze_retention(retention_days='30')
+    assert not result['success']
+
+
+def test_requested_range_counts_trailing_empty_days_as_zero(visits):
+    visits.insert_many([visit('10.0.0.1', '北京', 0), visit('10.0.0.2', '北京', 1)])
+    # 数据只到第二天，但请求范围有五天：目标日落在范围内的空日期留存为 0 而不是 None
+    result = RetentionService.analyze_retention(start_date='2025-07-16', end_date='2025-07-21', retention_days=[1, 7])
+    data = result['data']
+    assert (data['start_date'], data['end_date']) == ('2025-07-16', '2025-07-21')
+
+    cohorts = {c['date']: c['retention'] for c in data['cohorts']}
+    assert cohorts['2025-07-18']['D1']['retained'] == 0
+    assert cohorts['2025-07-18']['D7'] is None
+    assert data['average']['D1']['cohort_count'] == 2
+
+
+@pytest.mark.parametrize('value, expected', [
+    (True, True), (False, False), ('false', False), ('TRUE', True), ('0', False), (1, True),
+])
+def test_parse_include_details_is_strict(value, expected):
+    assert RetentionService.parse_include_details(value) is expected
+
+
+@pytest.mark.parametrize('value', ['no', '', None, 2, [True]])
+def test_parse_include_details_rejects_other_values(value):
+    with pytest.raises(ValueError):
+        RetentionService.parse_include_details(value)
+
+
+@pytest.mark.parametrize('value', [-1, '-1', 1.5, True, 'ten', None])
+def test_parse_details_limit_rejects_negative_and_non_integers(value):
+    with pytest.raises(ValueError):
+        RetentionService.parse_details_limit(value)
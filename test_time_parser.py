@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试时间解析快速路径
+标准格式走正则 + 按位置取整数，结果必须与 datetime.strptime 完全一致；
+非标准格式回退到 strptime，无法解析的值返回 None
+"""
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+import utils.time_parser as time_parser
+from utils.time_parser import TIMESTAMP_FORMAT, timestamp_date, timestamp_seconds
+
+
+def reference_seconds(value):
+    """原实现：strptime 解析后换算成秒"""
+    try:
+        parsed = datetime.strptime(value, TIMESTAMP_FORMAT)
+    except (TypeError, ValueError):
+        return None
+    return parsed.toordinal() * 86400 + parsed.hour * 3600 + parsed.minute * 60 + parsed.second
+
+
+def reference_date(value):
+    try:
+        return datetime.strptime(value, TIMESTAMP_FORMAT).strftime('%Y-%m-%d')
+    except (TypeError, ValueError):
+        return None
+
+
+EDGE_VALUES = [
+    '2025-07-20 10:03:00',
+    '2024-02-29 23:59:59',   # 闰日
+    '2025-12-31 23:59:59',
+    '1970-01-01 00:00:00',
+    '2025-02-29 10:00:00',   # 非闰年
+    '2025-04-31 10:00:00',
+    '2025-13-01 10:00:00',
+    '2025-00-10 10:00:00',
+    '2025-07-20 24:00:00',
+    '2025-07-20 10:60:00',
+    '2025-07-20 10:00:60',   # strptime 不接受闰秒
+    '2025-07-20 10:00:61',
+    '2025-7-20 10:03:00',    # 未补零，走 strptime
+    '2025-07-20 9:03:00',
+    '2025-07-20T10:03:00',
+    '2025-07-20 10:03:00 ',
+    ' 2025-07-20 10:03:00',
+    '2025-07-20 10:03:00\n',
+    '2025-07-20',
+    '２０２５-07-20 10:03:00',  # 全角数字
+    '',
+    'unknown',
+    None,
+    20250720,
+]
+
+
+@pytest.mark.parametrize('value', EDGE_VALUES)
+def test_matches_strptime_on_edge_values(value):
+    assert timestamp_seconds(value) == reference_seconds(value)
+    assert timestamp_date(value) == reference_date(value)
+
+
+def test_matches_strptime_on_random_timestamps():
+    rng = random.Random(3)
+    start = datetime(1999, 1, 1)
+    for _ in range(20000):
+        value = (start + timedelta(seconds=rng.randrange(40 * 365 * 86400))).strftime(TIMESTAMP_FORMAT)
+        assert timestamp_seconds(value) == reference_seconds(value)
+        assert timestamp_date(value) == value[:10]
+
+
+def test_differences_match_datetime_across_boundaries():
+    pairs = [
+        ('2024-02-28 23:59:00', '2024-03-01 00:01:00'),
+        ('2025-12-31 23:00:00', '2026-01-01 01:30:15'),
+        ('2025-07-20 10:00:00', '2025-07-20 09:00:00'),
+    ]
+    for submit, finish in pairs:
+        expected = (datetime.strptime(finish, TIMESTAMP_FORMAT) - datetime.strptime(submit, TIMESTAMP_FORMAT)).total_seconds()
+        assert timestamp_seconds(finish) - timestamp_seconds(submit) == expected
+
+
+def test_padded_values_do_not_call_strptime(monkeypatch):
+    class NoStrptime:
+        @staticmethod
+        def strptime(value, fmt):
+            raise AssertionError(f'标准格式 {value!r} 不应回退到 strptime')
+
+    monkeypatch.setattr(time_parser, 'datetime', NoStrptime)
+    assert timestamp_seconds('2025-07-20 10:03:00') == reference_seconds('2025-07-20 10:03:00')
+    assert timestamp_date('2025-07-20 10:03:00') == '2025-07-20'
+    # 正则匹配但日期不合法时直接返回 None，也不回退
+    assert timestamp_seconds('2025-02-30 10:03:00') is None
+    assert timestamp_date('2025-02-30 10:03:00') is None
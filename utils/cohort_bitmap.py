@@ -0,0 +1,54 @@
+"""
+留存计算工具 - 用户×日期活跃位图
+用户映射为整数ID后，每天的活跃用户是一行按位压缩的位图（每个用户1位），
+N日留存 = 第d天与第d+N天两行按位与后统计1的个数，所有基准日一次向量化完成
+"""
+import numpy as np
+
+if hasattr(np, 'bitwise_count'):
+    _popcount = np.bitwise_count
+else:
+    # numpy 2.0 以前没有 bitwise_count，用查表代替
+    _POPCOUNT_TABLE = np.array([bin(value).count('1') for value in range(256)], dtype=np.uint8)
+
+    def _popcount(values):
+        return _POPCOUNT_TABLE[values]
+
+class CohortBitmap:
+    """按天的活跃用户位图"""
+
+    def __init__(self, day_index, user_index, n_days, n_users):
+        """
+        :param day_index: 每条活跃记录的日期序号（0 为第一天）
+        :param user_index: 每条活跃记录的用户ID（0..n_users-1），同一天重复出现不影响结果
+        """
+        self.n_days = n_days
+        self.n_users = n_users
+        day_index = np.asarray(day_index, dtype=np.int64)
+        user_index = np.asarray(user_index, dtype=np.int64)
+
+        # 直接写入压缩位图，不创建 n_days × n_users 的布尔矩阵
+        self.bits = np.zeros((n_days, (n_users + 7) // 8), dtype=np.uint8)
+        np.bitwise_or.at(self.bits, (day_index, user_index >> 3),
+                         np.left_shift(1, 7 - (user_index & 7)).astype(np.uint8))
+
+    def day_counts(self):
+        """每天的活跃用户数"""
+        return _popcount(self.bits).sum(axis=1, dtype=np.int64)
+
+    def retained_counts(self, lag):
+        """
+        每个基准日在 lag 天后仍活跃的用户数
+        :return: 长度为 n_days 的数组，目标日超出范围的基准日为 -1
+        """
+        counts = np.full(self.n_days, -1, dtype=np.int64)
+        if 0 < lag < self.n_days:
+            counts[:self.n_days - lag] = _popcount(self.bits[:-lag] & self.bits[lag:]).sum(axis=1, dtype=np.int64)
+        return counts
+
+    def retained_users(self, day, lag):
+        """基准日 day 在 lag 天后仍活跃的用户ID（升序）"""
+        if not 0 <= day + lag < self.n_days:
+            return np.array([], dtype=np.int64)
+        row = np.unpackbits(self.bits[day] & self.bits[day + lag])[:self.n_users]
+        return np.flatnonzero(row)
@@ -1,46 +1,93 @@
 """
 数据库工具类 - MongoDB连接和操作
+整个进程共用一个延迟创建的 MongoClient（自带连接池，线程安全），
+各服务通过命名的数据库/集合访问器取用，不再各自创建和关闭客户端
 """
+import threading
 import pymongo
 from config.config import Config
 
 class Database:
     """MongoDB数据库管理类"""
-    
+
     def __init__(self):
-        self.client = None
-        self.db = None
-        self.collection = None
-    
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        """共享客户端，首次访问时创建（创建客户端不会阻塞等待连接）"""
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = pymongo.MongoClient(
+                        Config.MONGO_URI,
+                        maxPoolSize=Config.MONGO_MAX_POOL_SIZE,
+                        minPoolSize=Config.MONGO_MIN_POOL_SIZE,
+                        maxIdleTimeMS=Config.MONGO_MAX_IDLE_TIME_MS,
+                        connectTimeoutMS=Config.MONGO_CONNECT_TIMEOUT_MS,
+                        serverSelectionTimeoutMS=Config.MONGO_SERVER_SELECTION_TIMEOUT_MS,
+                        socketTimeoutMS=Config.MONGO_SOCKET_TIMEOUT_MS
+                    )
+        return self._client
+
+    @property
+    def db(self):
+        """运营部数据库"""
+        return self.client[Config.MONGO_DB_NAME]
+
+    @property
+    def collection(self):
+        """运营部默认集合（Excel匹配记录）"""
+        return self.db[Config.MONGO_COLLECTION_NAME]
+
+    @property
+    def users(self):
+        """用户集合"""
+        return self.db.users
+
+    @property
+    def retention_db(self):
+        """留存数据库（留存分析、视频活跃数据、采集状态）"""
+        return self.client[Config.MONGO_RETENTION_DB_NAME]
+
+    def get_database(self, name=None):
+        """按名称获取数据库，未指定时返回运营部数据库"""
+        return self.client[name or Config.MONGO_DB_NAME]
+
+    def get_collection(self, name, database=None):
+        """按名称获取集合，database 未指定时为运营部数据库"""
+        return self.get_database(database)[name]
+
     def connect(self):
         """连接数据库"""
         try:
-            self.client = pymongo.MongoClient(Config.MONGO_URI)
-            self.db = self.client[Config.MONGO_DB_NAME]
-            self.collection = self.db[Config.MONGO_COLLECTION_NAME]
+            self.client
             print(f"成功连接到MongoDB: {Config.MONGO_DB_NAME}/{Config.MONGO_COLLECTION_NAME}")
             return True
         except Exception as e:
             print(f"MongoDB连接失败: {str(e)}")
             return False
-    
+
     def disconnect(self):
-        """断开数据库连接"""
-        if self.client:
-            self.client.close()
-            print("MongoDB连接已关闭")
-    
+        """断开数据库连接（只应在进程退出时调用，下次访问会重新创建客户端）"""
+        with self._lock:
+            if self._client:
+                self._client.close()
+                self._client = None
+                print("MongoDB连接已关闭")
+
     def insert_one(self, document):
         """插入单个文档"""
         return self.collection.insert_one(document)
-    
+
     def find(self, filter_dict, projection=None):
         """查询文档"""
         return self.collection.find(filter_dict, projection)
-    
+
     def find_one(self, filter_dict):
         """查询单个文档"""
         return self.collection.find_one(filter_dict)
 
 # 创建全局数据库实例
-db = Database() 
\ No newline at end of file
+db = Database()
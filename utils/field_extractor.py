@@ -0,0 +1,69 @@
+"""
+字段抽取工具 - 把声明式字段规格编译成单次遍历的抽取函数
+"""
+from collections import namedtuple
+
+# key: 输出字段名
+# source: 源字段路径，如 ('param', 'param', 'gen_time')
+# guard: 该路径上的值都是字典时才输出此字段，为空表示总是输出
+# strip: 字符串去除首尾空白（None 视为空字符串）
+FieldSpec = namedtuple('FieldSpec', ['key', 'source', 'guard', 'strip'], defaults=((), False))
+
+def compile_extractor(fields, name='extract'):
+    """
+    把字段规格编译成 extract(item) -> dict 函数
+    每个 guard 路径只解析一次，输出字典的字段顺序与规格一致
+    源字段必须直接位于 guard 路径（或其某个前缀）下，否则抛出 ValueError
+    """
+    fields = [FieldSpec(*field) for field in fields]
+    fields = [FieldSpec(field.key, tuple(field.source), tuple(field.guard), field.strip) for field in fields]
+
+    # 需要解析的嵌套字典路径（含所有前缀），按层级从浅到深分配局部变量
+    guard_paths = sorted({field.guard[:i] for field in fields for i in range(1, len(field.guard) + 1)},
+                         key=lambda path: (len(path), path))
+    var_names = {(): 'item'}
+    lines = [f'def {name}(item):']
+    for index, path in enumerate(guard_paths):
+        var = f'g{index}'
+        parent = var_names[path[:-1]]
+        if parent == 'item':
+            lines.append(f'    {var} = item.get({path[-1]!r})')
+        else:
+            lines.append(f'    {var} = {parent}.get({path[-1]!r}) if {parent} is not None else None')
+        lines.append(f'    if not isinstance({var}, dict): {var} = None')
+        var_names[path] = var
+
+    def value_expr(field):
+        parent_path = tuple(field.source[:-1])
+        if parent_path != field.guard[:len(parent_path)]:
+            raise ValueError(f"字段 {field.key} 的源路径 {field.source} 不在 guard 路径 {field.guard} 下")
+        expr = f'{var_names[parent_path]}.get({field.source[-1]!r})'
+        return f"({expr} or '').strip()" if field.strip else expr
+
+    # 开头无 guard 的字段直接构造字典字面量，其余字段按 guard 分组赋值
+    position = 0
+    literal = []
+    while position < len(fields) and not fields[position].guard:
+        literal.append(f'{fields[position].key!r}: {value_expr(fields[position])}')
+        position += 1
+    lines.append(f"    record = {{{', '.join(literal)}}}")
+
+    while position < len(fields):
+        guard = fields[position].guard
+        indent = '    '
+        if guard:
+            lines.append(f'    if {var_names[guard]} is not None:')
+            indent = '        '
+        while position < len(fields) and fields[position].guard == guard:
+            field = fields[position]
+            lines.append(f'{indent}record[{field.key!r}] = {value_expr(field)}')
+            position += 1
+
+    lines.append('    return record')
+    source = '\n'.join(lines) + '\n'
+
+    namespace = {}
+    exec(compile(source, f'<extractor {name}>', 'exec'), namespace)
+    extractor = namespace[name]
+    extractor.source = source
+    return extractor
@@ -0,0 +1,111 @@
+"""
+HTTP传输工具类 - 共享连接池、keep-alive 和失败重试
+"""
+import json
+import random
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from config.config import Config
+
+try:
+    import orjson
+except ImportError:  # 未安装 orjson 时使用标准库解析
+    orjson = None
+
+# 需要退避重试的状态码：限流和服务端错误
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+def loads_json(content):
+    """解析JSON响应体（bytes/str），优先使用 orjson，解析失败抛出 ValueError"""
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
+
+class HttpTransport:
+    """带连接池的HTTP传输层，对 429/5xx/超时 做指数退避重试"""
+
+    def __init__(self, pool_size=None, timeout=None, max_retries=None, backoff_base=None, backoff_max=None):
+        self.pool_size = pool_size or Config.HTTP_POOL_SIZE
+        self.timeout = timeout or Config.HTTP_TIMEOUT
+        self.max_retries = Config.HTTP_MAX_RETRIES if max_retries is None else max_retries
+        self.backoff_base = backoff_base or Config.HTTP_BACKOFF_BASE
+        self.backoff_max = backoff_max or Config.HTTP_BACKOFF_MAX
+
+        self.session = requests.Session()
+        # 重试由本类自行处理，适配器只负责连接池
+        adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update({
+            'Accept-Encoding': 'gzip, deflate',
+            'Connection': 'keep-alive'
+        })
+
+    def backoff_delay(self, attempt, retry_after=None):
+        """计算第 attempt 次重试前的等待时间（指数退避 + 全抖动）"""
+        if retry_after:
+            try:
+                return min(self.backoff_max, float(retry_after))
+            except (TypeError, ValueError):
+                pass
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def request(self, method, url, timeout=None, on_retry=None, **kwargs):
+        """
+        发送请求，可重试的失败会按指数退避重新发送
+        :param on_retry: 重试回调 on_retry(attempt, delay, reason)
+        :return: 最后一次收到的响应；所有尝试都是网络错误时抛出最后一次异常
+        """
+        response = None
+        last_error = None
+
+        for attempt in range(self.max_retries + 1):
+            retry_after = None
+            try:
+                response = self.session.request(method, url, timeout=timeout or self.timeout, **kwargs)
+                if response.status_code not in RETRY_STATUS_CODES:
+                    return response
+                reason = f"状态码 {response.status_code}"
+                retry_after = response.headers.get('Retry-After')
+            except (requests.Timeout, requests.ConnectionError) as e:
+                response = None
+                last_error = e
+                reason = type(e).__name__
+
+            if attempt == self.max_retries:
+                break
+
+            delay = self.backoff_delay(attempt, retry_after)
+            if on_retry:
+                on_retry(attempt + 1, delay, reason)
+            time.sleep(delay)
+
+        if response is not None:
+            return response
+        raise last_error
+
+    def get(self, url, params=None, headers=None, timeout=None, on_retry=None):
+        """发送GET请求（带重试）"""
+        return self.request('GET', url, params=params, headers=headers, timeout=timeout, on_retry=on_retry)
+
+    def post(self, url, json=None, data=None, headers=None, timeout=None, on_retry=None):
+        """发送POST请求（带重试）"""
+        return self.request('POST', url, json=json, data=data, headers=headers, timeout=timeout, on_retry=on_retry)
+
+    def close(self):
+        """关闭连接池"""
+        self.session.close()
+
+_shared_transport = None
+_shared_lock = threading.Lock()
+
+def get_shared_transport():
+    """获取进程内共享的传输实例（懒加载）"""
+    global _shared_transport
+    if _shared_transport is None:
+        with _shared_lock:
+            if _shared_transport is None:
+                _shared_transport = HttpTransport()
+    return _shared_transport
@@ -0,0 +1,179 @@
+"""
+索引管理工具 - 声明各查询形态需要的索引，启动时统一创建，并用 explain 自检是否仍有全表扫描
+"""
+import threading
+from collections import namedtuple
+from datetime import datetime
+import pymongo
+from config.config import Config
+from utils.retention_filters import VISIBLE_FILTER
+
+# database/collection: 库名和集合名
+# keys: 索引字段列表，如 [('date', 1), ('usage_count', -1)]
+# unique: 是否唯一索引
+IndexSpec = namedtuple('IndexSpec', ['database', 'collection', 'keys', 'unique'], defaults=(False,))
+
+# name: 自检报告里的查询说明
+# filter/sort: 与业务代码一致的查询条件和排序（取值只用于生成执行计划）
+QueryShape = namedtuple('QueryShape', ['name', 'database', 'collection', 'filter', 'sort'], defaults=(None,))
+
+RETENTION_DB = Config.MONGO_RETENTION_DB_NAME
+
+INDEX_SPECS = (
+    # 用户日活跃：按日期范围分页（date, _id 游标）
+    IndexSpec(RETENTION_DB, '用户日活跃', [('date', 1), ('_id', 1)]),
+    # 用户日活跃：单日按使用次数倒序分页（usage_count, _id 游标）
+    IndexSpec(RETENTION_DB, '用户日活跃', [('date', 1), ('usage_count', -1), ('_id', 1)]),
+    # 用户日活跃：按昵称查询历史并按日期分页
+    IndexSpec(RETENTION_DB, '用户日活跃', [('nickname', 1), ('date', 1), ('_id', 1)]),
+    IndexSpec(RETENTION_DB, '用户日活跃', [('unique_key', 1)], unique=True),
+    # 原始数据：按视频ID去重，按提交时间范围重建汇总
+    IndexSpec(RETENTION_DB, '原始数据', [('id', 1)], unique=True),
+    IndexSpec(RETENTION_DB, '原始数据', [('submit_time', 1)]),
+    # 原始数据：查找入库后尚未计入用户日活跃的记录
+    IndexSpec(RETENTION_DB, '原始数据', [('summarized', 1), ('collected_at', 1)]),
+    # 留存数据：按访问日期检查/删除重复数据，按访问时间取最早/最晚记录
+    IndexSpec(RETENTION_DB, '数据', [('访问日期', 1)]),
+    IndexSpec(RETENTION_DB, '数据', [('访问时间', 1)]),
+    # 留存数据：按导入批次发布/清理暂存数据
+    IndexSpec(RETENTION_DB, '数据', [('导入批次', 1)]),
+    # 采集任务：查找最近一个可继续的任务
+    IndexSpec(RETENTION_DB, '采集任务', [('status', 1), ('updated_at', -1)]),
+    # 用户：登录和注册按用户名查找
+    IndexSpec(Config.MONGO_DB_NAME, 'users', [('username', 1)], unique=True),
+    # Excel匹配历史记录：按事件查询并按创建时间倒序
+    IndexSpec(Config.MONGO_DB_NAME, Config.MONGO_COLLECTION_NAME, [('事件', 1), ('创建时间', -1)]),
+)
+
+QUERY_SHAPES = (
+    QueryShape('用户日活跃-日期范围', RETENTION_DB, '用户日活跃',
+               {'date': {'$gte': '2025-01-01', '$lte': '2025-01-31'}}, [('date', 1), ('_id', 1)]),
+    QueryShape('用户日活跃-单日排行', RETENTION_DB, '用户日活跃',
+               {'date': '2025-01-01'}, [('usage_count', -1), ('_id', 1)]),
+    QueryShape('用户日活跃-用户历史', RETENTION_DB, '用户日活跃',
+               {'nickname': 'demo'}, [('date', 1), ('_id', 1)]),
+    QueryShape('原始数据-视频ID', RETENTION_DB, '原始数据', {'id': 0}),
+    QueryShape('原始数据-提交时间范围', RETENTION_DB, '原始数据',
+               {'submit_time': {'$gte': '2025-01-01', '$lte': '2025-01-31\uffff'}}),
+    QueryShape('原始数据-待合并汇总', RETENTION_DB, '原始数据',
+               {'summarized': False, 'collected_at': {'$lte': '2025-01-01 00:00:00'}}),
+    # 留存数据的读取都带 VISIBLE_FILTER（排除未发布的导入批次）
+    QueryShape('留存数据-访问日期', RETENTION_DB, '数据',
+               {**VISIBLE_FILTER, '访问日期': {'$gte': datetime(2025, 1, 1), '$lt': datetime(2025, 1, 2)}}),
+    QueryShape('留存数据-访问时间排序', RETENTION_DB, '数据', dict(VISIBLE_FILTER), [('访问时间', 1)]),
+    QueryShape('采集任务-可继续任务', RETENTION_DB, '采集任务',
+               {'status': {'$in': ['running', 'stopped', 'failed']}}, [('updated_at', -1)]),
+    QueryShape('用户-用户名', Config.MONGO_DB_NAME, 'users', {'username': 'admin'}),
+    QueryShape('匹配记录-历史', Config.MONGO_DB_NAME, Config.MONGO_COLLECTION_NAME,
+               {'事件': '注册匹配'}, [('创建时间', -1)]),
+)
+
+def index_name(keys):
+    """与 MongoDB 默认规则一致的索引名，如 date_1_usage_count_-1"""
+    return '_'.join(f'{field}_{direction}' for field, direction in keys)
+
+def ensure_indexes(client, specs=INDEX_SPECS):
+    """
+    创建声明的索引（已存在时为空操作），单个索引失败不影响其他索引
+    :return: {'success': bool, 'message': str, 'created': [...], 'failed': [...]}
+    """
+    created = []
+    failed = []
+    for spec in specs:
+        label = f"{spec.database}.{spec.collection}.{index_name(spec.keys)}"
+        try:
+            client[spec.database][spec.collection].create_index(spec.keys, unique=spec.unique)
+            created.append(label)
+        except pymongo.errors.PyMongoError as e:
+            # 唯一索引在存在历史重复数据时会失败，需要人工清理后重启
+            failed.append({'index': label, 'error': str(e)})
+
+    return {
+        'success': not failed,
+        'message': f'索引检查完成: {len(created)} 个就绪, {len(failed)} 个失败',
+        'created': created,
+        'failed': failed
+    }
+
+def ensure_collection_indexes(collection, specs=INDEX_SPECS):
+    """
+    只创建声明给指定集合的索引（按库名和集合名匹配），供采集、重建汇总等写入前确认索引就绪，
+    索引定义统一维护在 INDEX_SPECS 中
+    :return: 同 ensure_indexes
+    """
+    database = collection.database
+    matching = [spec for spec in specs if spec.database == database.name and spec.collection == collection.name]
+    return ensure_indexes(database.client, matching)
+
+def _plan_stages(plan):
+    """递归收集执行计划中的所有 stage 名称"""
+    stages = []
+    if isinstance(plan, dict):
+        if 'stage' in plan:
+            stages.append(plan['stage'])
+        for value in plan.values():
+            if isinstance(value, (dict, list)):
+                stages.extend(_plan_stages(value))
+    elif isinstance(plan, list):
+        for item in plan:
+            stages.extend(_plan_stages(item))
+    return stages
+
+def check_query_plans(client, shapes=QUERY_SHAPES):
+    """
+    对每种查询形态执行 explain，报告胜出计划中含 COLLSCAN 的查询
+    :return: {'success': bool, 'message': str, 'collscans': [...], 'queries': [...]}
+    """
+    queries = []
+    for shape in shapes:
+        entry = {'name': shape.name, 'collection': f'{shape.database}.{shape.collection}'}
+        try:
+            cursor = client[shape.database][shape.collection].find(shape.filter)
+            if shape.sort:
+                cursor = cursor.sort(shape.sort)
+            winning_plan = cursor.explain().get('queryPlanner', {}).get('winningPlan', {})
+            stages = _plan_stages(winning_plan)
+            entry['stages'] = stages
+            entry['collscan'] = 'COLLSCAN' in stages
+        except pymongo.errors.PyMongoError as e:
+            entry['error'] = str(e)
+        queries.append(entry)
+
+    collscans = [entry['name'] for entry in queries if entry.get('collscan')]
+    errors = [entry['name'] for entry in queries if 'error' in entry]
+    if collscans:
+        message = f"⚠️ {len(collscans)} 个查询仍在全表扫描: {', '.join(collscans)}"
+    elif errors:
+        message = f"⚠️ {len(errors)} 个查询无法获取执行计划"
+    else:
+        message = f'✅ {len(queries)} 个查询均已命中索引'
+
+    return {
+        'success': not collscans and not errors,
+        'message': message,
+        'collscans': collscans,
+        'queries': queries
+    }
+
+def bootstrap_indexes(client):
+    """启动时创建索引并打印自检结果，数据库不可用时只打印提示"""
+    try:
+        # 先确认数据库可用，避免每个索引都等待一次服务器选择超时
+        client.admin.command('ping')
+        result = ensure_indexes(client)
+        print(f"🗂️ {result['message']}")
+        for failure in result['failed']:
+            print(f"⚠️ 创建索引失败 {failure['index']}: {failure['error']}")
+
+        report = check_query_plans(client)
+        print(f"🔍 查询计划自检: {report['message']}")
+        return result
+    except Exception as e:
+        print(f"索引初始化失败: {str(e)}")
+        return {'success': False, 'message': f'索引初始化失败: {str(e)}'}
+
+def bootstrap_indexes_async(client):
+    """在后台线程中执行索引初始化，不阻塞应用启动（已有索引时几乎立即完成）"""
+    thread = threading.Thread(target=bootstrap_indexes, args=(client,), name='index-bootstrap', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,80 @@
+"""
+进度广播工具类 - 每个任务一个有界环形缓冲区，支持多个订阅者按事件ID续读
+"""
+import threading
+from collections import deque
+
+class ProgressChannel:
+    """
+    单个任务的进度通道
+    发布的事件带递增ID并保存在环形缓冲区中，订阅者各自记录读到的ID，
+    读取不会消费事件，所以多个页面/标签页都能收到完整进度
+    """
+
+    def __init__(self, maxlen=1000):
+        self.events = deque(maxlen=maxlen)
+        self.last_id = 0
+        self.closed = False
+        self.condition = threading.Condition()
+
+    def publish(self, event):
+        """发布事件，返回分配的事件ID"""
+        with self.condition:
+            self.last_id += 1
+            event['id'] = self.last_id
+            self.events.append(event)
+            self.condition.notify_all()
+            return self.last_id
+
+    def close(self):
+        """任务结束后关闭通道，等待中的订阅者会立即返回"""
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def events_since(self, last_event_id=0):
+        """返回ID大于 last_event_id 的缓冲事件（已被挤出缓冲区的事件无法补发）"""
+        with self.condition:
+            return self._events_after(last_event_id)
+
+    def wait_for_events(self, last_event_id=0, timeout=15):
+        """
+        等待新事件（最长 timeout 秒）
+        :return: (新事件列表, 通道是否已关闭)
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.last_id > last_event_id or self.closed, timeout=timeout)
+            return self._events_after(last_event_id), self.closed
+
+    def _events_after(self, last_event_id):
+        if last_event_id >= self.last_id:
+            return []
+        # 事件ID连续，直接从缓冲区尾部截取
+        count = min(self.last_id - last_event_id, len(self.events))
+        return list(self.events)[-count:]
+
+
+class SubscriberLimiter:
+    """
+    限制同时阻塞等待进度的订阅者数量（SSE 连接、wait>0 的长轮询）
+    Flask 同步部署中每个等待中的订阅者占用一个工作线程，直到有新事件或超时；
+    超过上限时调用方应直接返回 503，不让进度订阅占满工作线程、拖慢其他接口
+    """
+
+    def __init__(self, limit):
+        self.limit = max(0, int(limit))
+        self.active = 0
+        self.lock = threading.Lock()
+
+    def try_acquire(self):
+        """占用一个订阅名额，已达上限时返回 False（不等待）"""
+        with self.lock:
+            if self.active >= self.limit:
+                return False
+            self.active += 1
+            return True
+
+    def release(self):
+        """归还订阅名额"""
+        with self.lock:
+            self.active = max(0, self.active - 1)
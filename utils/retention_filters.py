@@ -0,0 +1,9 @@
+"""
+留存数据查询条件 - 导入批次的可见性约定
+留存服务、路由和索引声明共用，放在 utils 中，避免为这两个常量加载留存服务及其依赖（pandas、openpyxl 等）
+"""
+
+# 导入批次：新数据先带 导入状态=staging 写入（对查询不可见），全部写完后一次性切换为可见
+STAGING_STATUS = 'staging'
+# 所有读取 留存.数据 的查询都要带上此条件，排除尚未发布的导入数据
+VISIBLE_FILTER = {'导入状态': {'$ne': STAGING_STATUS}}
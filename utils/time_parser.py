@@ -0,0 +1,61 @@
+"""
+时间解析工具 - 'YYYY-MM-DD HH:MM:SS' 固定格式的快速解析
+用正则校验后按位置取整数代替 datetime.strptime，日期部分的换算结果缓存复用
+（同一批数据里的日期只有少数几个）；格式不标准时回退到 strptime
+"""
+import re
+from datetime import date, datetime
+from functools import lru_cache
+
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+# 标准格式（两位补零、ASCII 数字）的时间字符串，时分秒的取值范围与 datetime.strptime 一致（秒不接受闰秒 60/61）
+# 全角等非 ASCII 数字交给 strptime，保证返回的日期字符串是规范的 ASCII 形式
+_TIMESTAMP_RE = re.compile(r'(\d{4}-\d\d-\d\d) ([01]\d|2[0-3]):([0-5]\d):([0-5]\d)', re.ASCII)
+
+@lru_cache(maxsize=4096)
+def _day_ordinal(date_str):
+    """'YYYY-MM-DD' -> 公历序数，日期不合法时抛出 ValueError"""
+    return date(int(date_str[0:4]), int(date_str[5:7]), int(date_str[8:10])).toordinal()
+
+def timestamp_seconds(value):
+    """
+    把时间字符串转成秒数（公元元年起），只用于计算时间差和比较
+    :return: 秒数，无法解析时返回 None
+    """
+    if not isinstance(value, str) or not value:
+        return None
+
+    match = _TIMESTAMP_RE.fullmatch(value)
+    if match:
+        date_str, hour, minute, second = match.groups()
+        try:
+            return _day_ordinal(date_str) * 86400 + int(hour) * 3600 + int(minute) * 60 + int(second)
+        except ValueError:
+            return None
+
+    # 非标准格式（如未补零）交给 strptime
+    try:
+        parsed = datetime.strptime(value, TIMESTAMP_FORMAT)
+    except (TypeError, ValueError):
+        return None
+    return parsed.toordinal() * 86400 + parsed.hour * 3600 + parsed.minute * 60 + parsed.second
+
+def timestamp_date(value):
+    """
+    取时间字符串的日期部分 'YYYY-MM-DD'
+    :return: 日期字符串，无法解析时返回 None
+    """
+    if not isinstance(value, str) or not value:
+        return None
+
+    if _TIMESTAMP_RE.fullmatch(value):
+        try:
+            _day_ordinal(value[:10])
+            return value[:10]
+        except ValueError:
+            return None
+
+    try:
+        return datetime.strptime(value, TIMESTAMP_FORMAT).strftime('%Y-%m-%d')
+    except (TypeError, ValueError):
+        return None
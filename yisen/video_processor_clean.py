@@ -4,6 +4,13 @@ import pymongo
 from datetime import datetime
 from collections import defaultdict
 import gc
+import os
+import sys
+
+# 本脚本在 yisen 目录下独立运行，把项目根目录加入搜索路径以复用配置和共享的 HTTP 连接池
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config.config import Config
+from utils.http_client import get_shared_transport
 
 class Client:
     def __init__(self, username: str, password: str):
@@ -100,14 +107,12 @@ class Client:
         return getattr(self, 'backserver_token', None)
     
     def get_video_list(self, page_number=1, page_size=100, status=-1, username=""):
-        import requests
-        
         token = self.get_token()
         if not token:
             print("❌ 未获取到token")
             return None
         
-        url = "https://tu.liandanxia.com/api/cms/task/video_list"
+        url = f"{Config.VIDEO_API_BASE_URL}/api/cms/task/video_list"
         params = {
             'page_number': page_number,
             'page_size': page_size,
@@ -123,7 +128,7 @@ class Client:
         }
         
         try:
-            response = requests.get(url, params=params, headers=headers, timeout=30)
+            response = get_shared_transport().get(url, params=params, headers=headers)
             if response.status_code == 200:
                 return response.json()
             else:
@@ -294,28 +299,47 @@ class Client:
             print(f"❌ 保存到MongoDB失败: {e}")
             return result
 
-    def fetch_batch_pages(self, start_page, end_page):
-        batch_raw_data = []
-
-        for page in range(start_page, end_page + 1):
-            try:
-                print(f"🔄 正在获取第 {page} 页数据...")
-                page_response = self.get_video_list(page_number=page, page_size=100)
+    def fetch_page(self, page):
+        """获取并解析一页数据，请求失败返回 None（空页面返回空列表）"""
+        try:
+            print(f"🔄 正在获取第 {page} 页数据...")
+            page_response = self.get_video_list(page_number=page, page_size=100)
+            if not page_response or 'data' not in page_response:
+                print(f"❌ 第 {page} 页获取失败")
+                return None
+            page_extracted = self.extract_video_data(page_response)
+            print(f"✅ 第 {page} 页: 获取 {len(page_extracted)} 条记录")
+            return page_extracted
+        except Exception as e:
+            print(f"❌ 第 {page} 页获取失败: {e}")
+            return None
 
-                if page_response and 'data' in page_response:
-                    page_extracted = self.extract_video_data(page_response)
-                    batch_raw_data.extend(page_extracted)
-                    print(f"✅ 第 {page} 页: 获取 {len(page_extracted)} 条记录")
+    def fetch_batch_pages(self, start_page, end_page, requeue_rounds=2):
+        """
+        获取一批页面，失败的页面在批次末尾重新排队获取，不直接丢弃
+        :return: (原始记录列表, 重试后仍失败的页码列表)
+        """
+        batch_raw_data = []
+        pending = list(range(start_page, end_page + 1))
+
+        for round_num in range(requeue_rounds + 1):
+            if round_num:
+                print(f"🔁 第 {round_num} 轮重新获取失败页面: {pending}")
+                time.sleep(round_num)
+            failed = []
+            for page in pending:
+                page_extracted = self.fetch_page(page)
+                if page_extracted is None:
+                    failed.append(page)
                 else:
-                    print(f"⚠️ 第 {page} 页: 无数据")
-
-                
-
-            except Exception as e:
-                print(f"❌ 第 {page} 页获取失败: {e}")
-                continue
+                    batch_raw_data.extend(page_extracted)
+            pending = failed
+            if not pending:
+                break
 
-        return batch_raw_data
+        if pending:
+            print(f"❌ 以下页面多次重试后仍失败: {pending}")
+        return batch_raw_data, pending
 
     def process_all_video_data(self, total_pages=500, batch_size=20):
         if not self.myclient:
@@ -346,8 +370,10 @@ class Client:
             print(f"\n📦 处理批次 {batch_num}/{total_batches}")
             print(f"📄 页面范围: {batch_start_page} - {batch_end_page}")
 
+            failed_pages = []
             try:
-                batch_raw_data = self.fetch_batch_pages(batch_start_page, batch_end_page)
+                batch_raw_data, failed_pages = self.fetch_batch_pages(batch_start_page, batch_end_page)
+                total_stats["failed_pages"] += len(failed_pages)
 
                 if not batch_raw_data:
                     print("⚠️ 当前批次无数据")
@@ -364,7 +390,7 @@ class Client:
                 total_stats["total_summary_saved"] += save_result["summary_saved"]
                 total_stats["total_raw_skipped"] += save_result["raw_skipped"]
                 total_stats["total_summary_skipped"] += save_result["summary_skipped"]
-                total_stats["processed_pages"] += (batch_end_page - batch_start_page + 1)
+                total_stats["processed_pages"] += (batch_end_page - batch_start_page + 1) - len(failed_pages)
 
                 self.show_progress(batch_num, total_batches, start_time, total_stats)
 
@@ -373,7 +399,7 @@ class Client:
 
             except Exception as e:
                 print(f"❌ 批次 {batch_num} 处理失败: {e}")
-                total_stats["failed_pages"] += (batch_end_page - batch_start_page + 1)
+                total_stats["failed_pages"] += (batch_end_page - batch_start_page + 1) - len(failed_pages)
                 continue
 
         self.show_final_stats(total_stats, start_time)